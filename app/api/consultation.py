@@ -0,0 +1,313 @@
+import json
+import time
+import uuid
+import asyncio
+import logging
+import weakref
+from contextlib import aclosing
+from functools import lru_cache
+from typing import Callable, Optional
+from fastapi import HTTPException, APIRouter, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, ValidationError
+from app.core.llm import get_llm, MedicalConsultation, HistoryPolicyConfig
+from app.core.session_store import SessionStoreBase, create_session_store
+from app.core.rag import KnowledgeRetriever, RAGConfig, get_knowledge_retriever
+from app.core.semantic_cache import SemanticCache, SemanticCacheConfig
+from app.core.prompts import load_consultation_prompt
+
+logger = logging.getLogger(__name__)
+
+consultation_router = APIRouter(tags=["Consultation路由"])
+
+# 以下依赖都在第一个问诊请求到来时才创建，导入本模块不会连接模型服务、打开会话库或加载向量库与嵌入模型
+
+
+@lru_cache(maxsize=1)
+def get_system_prompt() -> str:
+    """问诊系统提示词，只读取一次"""
+    return load_consultation_prompt()
+
+
+@lru_cache(maxsize=1)
+def get_history_policy() -> HistoryPolicyConfig:
+    """对话历史策略：超过 token 上限的早期轮次被压缩，每轮提示词长度保持稳定"""
+    return HistoryPolicyConfig()
+
+
+@lru_cache(maxsize=1)
+def get_session_store() -> SessionStoreBase:
+    """会话存储：会话状态在每轮结束后保存，请求之间不在进程内保留 MedicalConsultation 对象"""
+    return create_session_store()
+
+
+@lru_cache(maxsize=1)
+def get_rag_config() -> RAGConfig:
+    """知识库检索配置，配置无效时记录错误并关闭 RAG 模式，不影响问诊本身"""
+    try:
+        return RAGConfig()
+    except ValidationError as e:
+        logger.error(f"知识库检索配置无效，已关闭知识库检索: {e}")
+        return RAGConfig(enabled=False)
+
+
+def get_knowledge() -> Optional[KnowledgeRetriever]:
+    """知识库检索（RAG 模式），CONSULTATION_RAG_ENABLED 未开启时为 None"""
+    return get_knowledge_retriever(get_rag_config())
+
+
+@lru_cache(maxsize=1)
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """回复语义缓存，CONSULTATION_SEMANTIC_CACHE_ENABLED 未开启时为 None"""
+    config = SemanticCacheConfig()
+    if not config.enabled:
+        return None
+    from app.core.embedding import Embedding
+    # 模型按路径与后端在注册表中共享，不会重复加载
+    embedding = Embedding()
+    return SemanticCache(lambda texts: embedding.encode(texts, normalize_embeddings=True), config)
+
+
+class PatientInfo(BaseModel):
+    """患者基本信息"""
+    disease: str = Field(description="主诉疾病（如\"头痛\"、\"胃痛\"）")
+    name: str = Field(description="患者姓名")
+    age: str = Field(description="年龄")
+    sex: str = Field(description="性别（男/女）")
+    tongue: str = Field(default="未查", description="舌象")
+    face: str = Field(default="未查", description="面象")
+    left_pulse: str = Field(default="未查", description="左手脉象")
+    right_pulse: str = Field(default="未查", description="右手脉象")
+
+
+class ConsultationMessage(BaseModel):
+    """患者的一轮回答或提问"""
+    message: str = Field(min_length=1, description="患者的回答或提问")
+
+
+# 进程内的会话锁：同一会话同时只允许进行一轮对话，避免历史交错；会话不再使用时锁自动回收
+# 锁只在当前进程内有效，多个 worker 共享 sqlite 会话存储时不做跨进程的串行化，
+# 同一会话的请求需由负载均衡固定到同一个 worker，否则并发的两轮对话以后保存的一轮为准
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _session_lock(session_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
+
+
+def _acquire(session_id: str) -> asyncio.Lock:
+    """获取会话锁，上一轮尚未结束时返回 409"""
+    lock = _session_lock(session_id)
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="上一轮对话尚未结束")
+    return lock
+
+
+async def _hold(session_id: str) -> Callable[[], None]:
+    """
+    占用会话锁直到返回的 release 被调用，上一轮尚未结束时返回 409
+
+    用于响应返回之后仍要继续持有锁的接口（事件流、后台压缩历史）；检查与占用之间没有 await，
+    并发的第二个请求一定会看到锁已被占用。release 可重复调用。
+    """
+    lock = _acquire(session_id)
+    await lock.acquire()
+    released = False
+
+    def release() -> None:
+        nonlocal released
+        if not released:
+            released = True
+            lock.release()
+
+    return release
+
+
+def _new_consultation() -> MedicalConsultation:
+    return MedicalConsultation(get_llm(), get_system_prompt(), get_history_policy(),
+                               knowledge=get_knowledge(), semantic_cache=get_semantic_cache())
+
+
+async def _load(session_id: str) -> MedicalConsultation:
+    """从会话存储恢复会话，不存在或已过期时返回 404"""
+    state = await asyncio.to_thread(get_session_store().get, session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {session_id}")
+    return _new_consultation().load_state(state)
+
+
+async def _save(session_id: str, consultation: MedicalConsultation) -> None:
+    await asyncio.to_thread(get_session_store().put, session_id, consultation.to_state())
+
+
+def _sse(event: str, data: dict) -> str:
+    """格式化一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@consultation_router.post("/consultation/sessions")
+async def create_session(patient: PatientInfo):
+    """创建问诊会话并设置患者信息"""
+    consultation = _new_consultation()
+    consultation.set_patient_info(**patient.model_dump())
+    session_id = uuid.uuid4().hex
+    await _save(session_id, consultation)
+    return {"session_id": session_id, "status": consultation.get_status()}
+
+
+@consultation_router.put("/consultation/sessions/{session_id}/patient")
+async def set_patient(session_id: str, patient: PatientInfo):
+    """更新患者信息，已有的对话历史保留；上一轮对话尚未结束时返回 409"""
+    async with _acquire(session_id):
+        consultation = await _load(session_id)
+        consultation.set_patient_info(**patient.model_dump())
+        await _save(session_id, consultation)
+    return {"session_id": session_id, "status": consultation.get_status()}
+
+
+@consultation_router.get("/consultation/sessions/{session_id}")
+async def get_session(session_id: str):
+    """
+    获取会话状态与对话历史
+
+    已被压缩的早期轮次不在 history 中，其内容见 summary。
+    """
+    consultation = await _load(session_id)
+    return {
+        "session_id": session_id,
+        "status": consultation.get_status(),
+        "summary": consultation.summary,
+        "history": consultation.get_conversation_history(),
+    }
+
+
+@consultation_router.post("/consultation/sessions/{session_id}/reset")
+async def reset_session(session_id: str):
+    """清空对话历史，重新开始问诊；上一轮对话尚未结束时返回 409"""
+    async with _acquire(session_id):
+        consultation = await _load(session_id)
+        consultation.reset()
+        await _save(session_id, consultation)
+    return {"session_id": session_id, "status": consultation.get_status()}
+
+
+@consultation_router.delete("/consultation/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """结束并删除会话"""
+    if not await asyncio.to_thread(get_session_store().delete, session_id):
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {session_id}")
+    return {"session_id": session_id, "deleted": True}
+
+
+@consultation_router.get("/consultation/stats")
+async def consultation_stats():
+    """获取会话存储状态与历史策略"""
+    semantic_cache = get_semantic_cache()
+    return {
+        "sessions": await asyncio.to_thread(get_session_store().stats),
+        "history_policy": get_history_policy().model_dump(),
+        "rag": get_rag_config().model_dump(exclude={"db_path"}),
+        "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+    }
+
+
+@consultation_router.post("/consultation/sessions/{session_id}/messages")
+async def send_message(session_id: str, request: ConsultationMessage, background_tasks: BackgroundTasks):
+    """
+    发送一轮消息，等待完整回复后返回；上一轮对话尚未结束时返回 409
+
+    需要压缩历史时在响应返回之后进行，压缩完成前会话锁保持占用，下一轮请求返回 409。
+    """
+    release = await _hold(session_id)
+    try:
+        consultation = await _load(session_id)
+        started = time.perf_counter()
+        # invoke 为同步调用，放入线程中执行，避免阻塞事件循环
+        reply = await asyncio.to_thread(consultation.invoke, request.message)
+        total_seconds = time.perf_counter() - started
+        await _save(session_id, consultation)
+    except BaseException:
+        release()
+        raise
+
+    async def compact() -> None:
+        # 为下一轮压缩历史（可能需要一次摘要调用），不计入本轮耗时
+        try:
+            if await consultation.acompact():
+                await _save(session_id, consultation)
+        finally:
+            release()
+
+    background_tasks.add_task(compact)
+    return {
+        "session_id": session_id,
+        "reply": reply,
+        "status": consultation.get_status(),
+        "latency": {**consultation.last_timings, "total_seconds": round(total_seconds, 4)},
+    }
+
+
+@consultation_router.post("/consultation/sessions/{session_id}/stream")
+async def stream_message(session_id: str, request: ConsultationMessage):
+    """
+    发送一轮消息，以 Server-Sent Events 逐片段返回回复
+
+    事件格式:
+    - event: delta，data: {"content": "..."}，每个文本片段一条
+    - event: done，data: {"status": {...}, "latency": {...}}
+      latency 中 first_token_seconds / total_seconds 为端到端耗时，
+      cache_hit / cache_seconds 为语义缓存是否命中及查询耗时（命中时不再检索与调用模型），
+      retrieval_seconds 为知识库检索耗时，llm_first_token_seconds / llm_seconds 为检索结束后模型的耗时
+
+    上一轮对话尚未结束时返回 409。
+    """
+    # 在返回事件流之前占用会话锁并读取会话，使冲突与不存在的会话返回 409 / 404 而不是空的事件流
+    release = await _hold(session_id)
+    try:
+        consultation = await _load(session_id)
+    except BaseException:
+        release()
+        raise
+
+    async def events():
+        started = time.perf_counter()
+        first_token_seconds = None
+        try:
+            # 客户端断开时响应被取消，aclosing 保证生成器先关闭，部分回复写入历史
+            async with aclosing(consultation.stream(request.message)) as stream:
+                async for content in stream:
+                    if first_token_seconds is None:
+                        first_token_seconds = time.perf_counter() - started
+                    yield _sse("delta", {"content": content})
+            total_seconds = time.perf_counter() - started
+            logger.info(f"会话 {session_id} 第 {consultation.round_count} 轮完成，"
+                        f"检索 {consultation.last_timings.get('retrieval_seconds', 0):.3f}秒，"
+                        f"首字 {first_token_seconds or total_seconds:.3f}秒，总耗时 {total_seconds:.3f}秒")
+            yield _sse("done", {
+                "status": consultation.get_status(),
+                "latency": {
+                    **consultation.last_timings,
+                    "first_token_seconds": round(first_token_seconds or total_seconds, 4),
+                    "total_seconds": round(total_seconds, 4),
+                },
+            })
+            # 回复已全部送出后再为下一轮压缩历史
+            await consultation.acompact()
+        finally:
+            try:
+                # 任务被取消后不能再等待，这里同步保存
+                get_session_store().put(session_id, consultation.to_state())
+            finally:
+                release()
+
+    # 关闭代理缓冲，使每个片段立即送达客户端；
+    # 响应体从未开始发送时生成器的 finally 不会执行，由后台任务释放会话锁（release 可重复调用）；
+    # 两者都没有执行时，响应被丢弃后锁不再被引用，会从弱引用表中消失，会话不会一直被占用
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(release))
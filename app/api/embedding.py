@@ -1,29 +1,58 @@
+# 引入 os，用于取模型目录名
+import os
+# 引入 base64，用于紧凑编码向量
+import base64
+# 引入 quote，把响应头中的模型名转义为 ASCII
+from urllib.parse import quote
+# 引入 asyncio，在线程中执行分词统计，避免阻塞事件循环
+import asyncio
+# 引入 numpy，用于向量矩阵的类型转换
+import numpy as np
 # 引入 FastAPI、HTTPException 和 APIRouter，用于创建API路由与异常处理
 from fastapi import HTTPException, APIRouter
+# 引入 Response 与 JSONResponse，直接返回已序列化的结果，跳过逐行的 pydantic 校验
+from fastapi.responses import Response, JSONResponse
 # 引入 pydantic 的 BaseModel，用于数据模型校验
 from pydantic import BaseModel
-# 引入类型提示 List 和 Union
-from typing import List, Union
+# 引入类型提示 List、Union 和 Literal
+from typing import List, Literal, Union
 # 引入自定义的 Embedding 类
 from app.core.embedding import Embedding
+# 引入请求合并批处理器
+from app.core.batcher import EmbeddingBatcher
+# 引入向量缓存
+from app.core.embedding_cache import get_embedding_cache, get_cache_stats, normalize_text
 
 # 创建 Embedding 实例，用于后续处理
 embedding = Embedding()
-# 预加载模型，仅加载一次以提升性能
-embedding_model = embedding.remote_embedding()
+# 创建批处理器：合并并发请求，在工作线程中统一执行 encode，避免阻塞事件循环
+# 模型在第一个批次执行时才从注册表加载，导入本模块不会加载模型
+# 合并后的批次再按 token 长度分桶编码，单次补齐后的 token 数受 EMBEDDING_MAX_BATCH_TOKENS 限制
+# 路由已统计的 token 数随请求传入，编码时不再重复分词
+embedding_batcher = EmbeddingBatcher(
+    lambda texts, lengths: embedding.encode(texts, normalize_embeddings=True, lengths=lengths))
+# 向量缓存：键中包含模型标识（路径与推理后端）与归一化参数，避免与其他编码方式混用
+embedding_cache = get_embedding_cache(f"{embedding.model_id}|st|normalize")
+# 响应头中的模型名：取服务端实际加载的模型目录名而不是回显客户端传入的 model，
+# 并做百分号转义，保证响应头只含 ASCII 字符
+EMBEDDING_MODEL_HEADER = quote(os.path.basename(os.path.normpath(str(embedding.model_path))) or "local")
 
 # 创建用于 Embedding 接口的 APIRouter
 embedding_router = APIRouter(tags=["Embedding路由"])
 
 # 定义请求体的数据模型，包括输入内容（可以为字符串或字符串列表）和模型名（默认为 "bge-large-zh-v15"）
+# encoding_format 与 OpenAI 接口一致：float 为浮点数组，base64 为小端序向量字节的 base64 字符串；
+# binary 直接返回 application/octet-stream 的向量矩阵，形状与类型见响应头
 class EmbeddingRequest(BaseModel):
     input: Union[str, List[str]]
     model: str = "bge-large-zh-v15"  # 默认模型名称
+    encoding_format: Literal["float", "base64", "binary"] = "float"  # 向量编码格式
+    dtype: Literal["float32", "float16"] = "float32"  # base64/binary 格式下的向量精度
 
 # 定义 Embedding 对象的数据结构，每个对象包括类型说明（object）、向量结果（embedding）、及索引（index）
 class EmbeddingObject(BaseModel):
     object: str = "embedding"
-    embedding: List[float]
+    embedding: Union[List[float], str]
     index: int
 
 # 定义响应体的数据结构，包括类型（object）、数据（data）、模型名（model）、以及用量信息（usage）
@@ -40,22 +69,83 @@ async def create_embedding(request: EmbeddingRequest):
     # 如果输入为字符串，则转为列表，统一处理
     if isinstance(inputs, str):
         inputs = [inputs]
+    if not inputs:
+        raise HTTPException(status_code=400, detail="input 不能为空")
+    if len(inputs) > embedding.limits.max_inputs:
+        raise HTTPException(
+            status_code=413,
+            detail=f"input 条数 {len(inputs)} 超过上限 {embedding.limits.max_inputs}")
 
     try:
-        # 调用 embedding_model 的 encode 方法，对输入文本进行编码，生成 embedding 向量
-        embeddings = embedding_model.encode(inputs, normalize_embeddings=True)
-
-        # 组装返回的数据，embedding 向量转换为 list
-        data = [
-            EmbeddingObject(
-                embedding=emb.tolist() if hasattr(emb, 'tolist') else list(emb),
-                index=i
-            )
-            for i, emb in enumerate(embeddings)
-        ]
-        # 返回 embedding 结果
-        return EmbeddingResponse(data=data, model=request.model)
+        # 统计 token 数用于 usage 与请求限制，缓存命中的文本同样计入
+        token_counts = await asyncio.to_thread(embedding.count_tokens, inputs)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Embedding failed: {str(e)}")
+    prompt_tokens = sum(token_counts)
+    if prompt_tokens > embedding.limits.max_request_tokens:
+        raise HTTPException(
+            status_code=413,
+            detail=f"请求 token 总数 {prompt_tokens} 超过上限 {embedding.limits.max_request_tokens}")
+
+    # 缓存以规范化后的文本提交编码，两种写法都记录对应的 token 数
+    known_tokens = dict(zip(inputs, token_counts))
+    known_tokens.update(zip((normalize_text(text) for text in inputs), token_counts))
+
+    async def encode_missing(texts: List[str]) -> np.ndarray:
+        lengths = [known_tokens.get(text) for text in texts]
+        return await embedding_batcher.encode(texts, None if None in lengths else lengths)
+
+    try:
+        # 先查缓存，未命中的文本再提交给批处理器，与其他并发请求合并后编码
+        embeddings = await embedding_cache.aencode(inputs, encode_missing)
+
+        # 组装返回的数据并直接返回 Response，跳过 response_model 的逐行校验
+        usage = {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}
+        return _render_embeddings(embeddings, request, usage)
     except Exception as e:
         # 捕捉异常，返回 500 错误
         raise HTTPException(
             status_code=500, detail=f"Embedding failed: {str(e)}")
+
+
+def _render_embeddings(embeddings: np.ndarray, request: EmbeddingRequest, usage: dict) -> Response:
+    """按 encoding_format 序列化向量矩阵"""
+    # 小端序，保证客户端可直接用 np.frombuffer / Float32Array 解码
+    dtype = np.dtype(request.dtype).newbyteorder("<")
+    matrix = np.ascontiguousarray(embeddings, dtype=dtype)
+
+    if request.encoding_format == "binary":
+        # 整个矩阵一次性输出，客户端按响应头中的形状零拷贝解码
+        return Response(
+            content=matrix.tobytes(),
+            media_type="application/octet-stream",
+            headers={
+                "X-Embedding-Shape": f"{matrix.shape[0]},{matrix.shape[1] if matrix.ndim > 1 else 0}",
+                "X-Embedding-Dtype": request.dtype,
+                "X-Embedding-Model": EMBEDDING_MODEL_HEADER,
+                "X-Usage-Prompt-Tokens": str(usage["prompt_tokens"]),
+                "X-Usage-Total-Tokens": str(usage["total_tokens"]),
+            })
+
+    if request.encoding_format == "base64":
+        vectors = [base64.b64encode(row.tobytes()).decode("ascii") for row in matrix]
+    else:
+        # 整个矩阵一次 tolist，比逐行转换更快
+        vectors = np.asarray(embeddings, dtype=np.float32).tolist()
+
+    return JSONResponse({
+        "object": "list",
+        "data": [
+            {"object": "embedding", "embedding": vector, "index": i}
+            for i, vector in enumerate(vectors)
+        ],
+        "model": request.model,
+        "usage": usage,
+    })
+
+
+# 定义 API 路由/接口，用于查看向量缓存的命中统计
+@embedding_router.get("/embeddings/cache/stats")
+async def embedding_cache_stats():
+    return {"caches": get_cache_stats()}
@@ -0,0 +1,39 @@
+from fastapi import APIRouter
+from app.core.embedding import Embedding
+from app.api import tts
+
+health_router = APIRouter(tags=["Health路由"])
+
+# 应用启动状态，由 main.py 的 lifespan 更新
+app_state = {
+    "started": False,
+    "warmup": {},
+}
+
+
+@health_router.get("/health")
+async def health():
+    """存活检查：进程可以响应请求即返回"""
+    return {"status": "ok"}
+
+
+@health_router.get("/ready")
+async def ready():
+    """
+    就绪检查
+
+    返回格式:
+    - ready: 应用是否已完成启动流程（含可选的预热）
+    - models: 已加载的模型
+    - warmup: 各模型预热耗时（秒），未开启预热时为空
+    """
+    return {
+        "ready": app_state["started"],
+        "models": {
+            "embedding": Embedding.loaded_models(),
+            "embedding_pool": Embedding.pool_stats(),
+            "asr": tts.asr_pool is not None and tts.asr_pool.ready,
+            "asr_streaming": tts.streaming_engine is not None and tts.streaming_engine.ready,
+        },
+        "warmup": app_state["warmup"],
+    }
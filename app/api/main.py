@@ -1,10 +1,16 @@
 from fastapi import APIRouter
 from app.api.embedding import embedding_router
 from app.api.tts import tts_router
+from app.api.health import health_router
+from app.api.consultation import consultation_router
 
 router = APIRouter()
 
 router.include_router(
     embedding_router, prefix='/api/v1', tags=['Embedding路由'])
 router.include_router(
-    tts_router, prefix='/api/v1', tags=['TTS路由'])
\ No newline at end of file
+    tts_router, prefix='/api/v1', tags=['TTS路由'])
+router.include_router(
+    health_router, prefix='/api/v1', tags=['Health路由'])
+router.include_router(
+    consultation_router, prefix='/api/v1', tags=['Consultation路由'])
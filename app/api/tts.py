@@ -1,45 +1,90 @@
 import os
+import json
+import time
 import logging
-import numpy as np
 from dotenv import load_dotenv, find_dotenv
-from funasr import AutoModel
 
-from fastapi import HTTPException, APIRouter, Body
-from contextlib import asynccontextmanager
+from fastapi import HTTPException, APIRouter, Body, FastAPI, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from contextlib import asynccontextmanager, AsyncExitStack
+from app.core.asr import (ASRWorkerPool, ASRQueueFullError, StreamingASREngine,
+                          ASRBatchConfig, transcribe_files, transcribe_segments)
+from app.core.vad import SpeechDetector, VADMode
+from app.tools.audio import pcm16_to_float32, list_audio_files
 
 load_dotenv(find_dotenv(), override=True)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 TTS_MODEL_PATH = os.getenv("TTS_MODEL_PATH")
+ASR_ENABLED = os.getenv("ASR_ENABLED", "True").lower() == "true"
+STREAMING_ASR_ENABLED = os.getenv("STREAMING_ASR_ENABLED", "True").lower() == "true"
+# 批量转写只允许读取该目录下的文件，为空时关闭批量接口
+ASR_BATCH_ROOT = os.getenv("ASR_BATCH_ROOT") or None
 SAMPLE_RATE = 16000
 
 tts_router = APIRouter(tags=["TTS路由"])
 
+# 语音识别推理池，由 lifespan 启动
+asr_pool: ASRWorkerPool = None
+# 流式语音识别引擎，由 lifespan 启动
+streaming_engine: StreamingASREngine = None
+# 语音活动检测器，由 lifespan 启动
+speech_detector: SpeechDetector = None
+
 
 @asynccontextmanager
-async def lifespan(app: tts_router):
-    """应用生命周期管理：启动时加载模型，关闭时清理资源"""
-    global model
-    # 启动时执行
-    try:
-        logger.info("正在加载流式语音识别模型...")
-        logger.info("模型: paraformer-zh-streaming")
+async def lifespan(app: FastAPI):
+    """应用生命周期管理：启动时加载模型到推理池，关闭时清理资源"""
+    global asr_pool, streaming_engine, speech_detector
+    if not ASR_ENABLED:
+        logger.info("语音识别已关闭（ASR_ENABLED=False），跳过模型加载")
+        yield
+        return
 
-        # model = AutoModel(model="paraformer-zh-streaming")
-        model = AutoModel(model=TTS_MODEL_PATH)
+    def clear_globals() -> None:
+        global asr_pool, streaming_engine, speech_detector
+        asr_pool = None
+        streaming_engine = None
+        speech_detector = None
 
-        logger.info("流式模型加载成功！")
+    # 每个资源在启动前就登记清理函数（stop 可处理启动到一半的状态），
+    # 无论启动中途失败还是应用正常关闭，已创建的资源都按相反顺序释放
+    async with AsyncExitStack() as stack:
+        stack.callback(clear_globals)
+        try:
+            logger.info(f"正在加载语音识别模型: {TTS_MODEL_PATH}")
 
-    except Exception as e:
-        logger.error(f"模型加载失败: {str(e)}")
-        raise
+            pool = ASRWorkerPool()
+            stack.push_async_callback(pool.stop)
+            await pool.start()
+            asr_pool = pool
+
+            detector = SpeechDetector()
+            stack.push_async_callback(detector.stop)
+            await detector.start()
+            speech_detector = detector
+
+            if STREAMING_ASR_ENABLED:
+                engine = StreamingASREngine()
+                stack.push_async_callback(engine.stop)
+                await engine.start()
+                streaming_engine = engine
+
+            logger.info("语音识别模型加载成功！")
+
+        except Exception as e:
+            logger.error(f"模型加载失败: {str(e)}")
+            raise
 
-    yield  # 应用运行期间
+        yield  # 应用运行期间
 
 
 @tts_router.post("/api/translate_audio")
-async def translate_audio(audio_data: bytes = Body(...)):
+async def translate_audio(audio_data: bytes = Body(...),
+                          vad: Optional[VADMode] = Query(default=None)):
     """
     接收完整的音频二进制数据并识别
 
@@ -48,14 +93,19 @@ async def translate_audio(audio_data: bytes = Body(...)):
     请求格式:
     - Content-Type: application/octet-stream 或 audio/pcm
     - Body: PCM音频二进制数据 (16kHz, 16bit, mono)
+    - Query vad: 语音活动检测方式（none/energy/fsmn，可选，默认取 ASR_VAD_MODE）
+      开启后先去除静音、切分语音片段，再并行识别各片段
 
     返回格式:
     - success: 是否成功
     - text: 识别结果文本
     - details: 详细识别信息
     - audio_length_seconds: 音频长度（秒）
+    - latency: 排队与推理耗时（秒）
+    - segments: 开启 vad 时，各语音片段的起止时间（秒）与文本
+    - speech_seconds: 开启 vad 时，有效语音总时长（秒）
     """
-    if model is None:
+    if asr_pool is None or not asr_pool.ready:
         return {"success": False, "error": "模型未加载", "code": 500}
 
     try:
@@ -71,11 +121,8 @@ async def translate_audio(audio_data: bytes = Body(...)):
 
         logger.info(f"接收到音频数据，大小: {len(raw_bytes)} bytes")
 
-        audio_data = np.frombuffer(raw_bytes, dtype=np.int16)
-        
- 
-        audio_data = audio_data.astype(np.float32) / 32768.0
-
+        # 直接在接收缓冲区上做向量化转换，不产生中间副本
+        audio_data = pcm16_to_float32(raw_bytes[:len(raw_bytes) - len(raw_bytes) % 2])
 
         if len(audio_data) < SAMPLE_RATE * 0.1:  # 小于0.1秒
             return {
@@ -87,7 +134,15 @@ async def translate_audio(audio_data: bytes = Body(...)):
         logger.info(
             f"开始识别完整音频，长度: {len(audio_data)} samples ({len(audio_data)/SAMPLE_RATE:.2f}秒)")
 
-        result = model.generate(input=audio_data)
+        vad_mode = vad or speech_detector.config.mode
+        if vad_mode != "none":
+            return await _translate_segments(audio_data, vad_mode)
+
+        try:
+            job = await asr_pool.submit(audio_data)
+        except ASRQueueFullError as e:
+            return {"success": False, "error": str(e), "code": 503}
+        result = job.result
 
         if result and isinstance(result, list) and len(result) > 0:
             text = result[0].get("text", "") if isinstance(
@@ -106,7 +161,11 @@ async def translate_audio(audio_data: bytes = Body(...)):
             "text": text,
             "details": result,
             "audio_length_seconds": round(audio_length, 2),
-            "audio_samples": len(audio_data)
+            "audio_samples": len(audio_data),
+            "latency": {
+                "queue_seconds": round(job.queue_seconds, 4),
+                "inference_seconds": round(job.inference_seconds, 4),
+            }
         }
 
     except Exception as e:
@@ -116,3 +175,174 @@ async def translate_audio(audio_data: bytes = Body(...)):
             "error": str(e),
             "code": 500
         }
+
+
+async def _translate_segments(audio_data, vad_mode: VADMode) -> dict:
+    """先做语音活动检测，再并行识别各语音片段"""
+    started = time.perf_counter()
+    segments = await speech_detector.detect(audio_data, vad_mode)
+    vad_seconds = time.perf_counter() - started
+    try:
+        records = await transcribe_segments(asr_pool, audio_data, segments)
+    except ASRQueueFullError as e:
+        return {"success": False, "error": str(e), "code": 503}
+
+    text = "".join(record["text"] for record in records)
+    audio_length = len(audio_data) / SAMPLE_RATE
+    speech_seconds = sum(end - start for start, end in segments) / SAMPLE_RATE
+    logger.info(
+        f"识别完成，结果: {text[:100]}...，音频长度: {audio_length:.2f}秒，"
+        f"语音片段 {len(segments)} 个共 {speech_seconds:.2f}秒")
+
+    return {
+        "success": True,
+        "text": text,
+        "segments": records,
+        "audio_length_seconds": round(audio_length, 2),
+        "speech_seconds": round(speech_seconds, 2),
+        "audio_samples": len(audio_data),
+        "latency": {
+            "vad_seconds": round(vad_seconds, 4),
+            "total_seconds": round(time.perf_counter() - started, 4),
+        }
+    }
+
+
+# 单次批量转写请求可指定的最大批大小，不超过 ASR_BATCH_MAX_SIZE
+ASR_BATCH_SIZE_CAP = ASRBatchConfig().max_batch_size
+
+
+class BatchTranscribeRequest(BaseModel):
+    """批量转写请求：文件路径与目录二选一或同时提供，路径需位于 ASR_BATCH_ROOT 下"""
+    paths: List[str] = []
+    directory: Optional[str] = None
+    max_batch_size: Optional[int] = Field(default=None, ge=1, le=ASR_BATCH_SIZE_CAP,
+                                          description="单次推理最多包含的录音条数")
+
+
+def _contained_path(root: str, path: str) -> str:
+    """
+    解析相对 root 的路径（含符号链接），不在 root 内时返回 400
+
+    错误信息不包含任何文件系统路径。
+    """
+    real_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, real_path]) != root:
+        raise HTTPException(status_code=400, detail="路径不在允许的目录内")
+    return real_path
+
+
+def _resolve_batch_paths(request: BatchTranscribeRequest) -> List[str]:
+    """校验所有路径都位于 ASR_BATCH_ROOT 下，目录先校验再展开"""
+    root = os.path.realpath(ASR_BATCH_ROOT)
+    resolved = [_contained_path(root, path) for path in request.paths]
+    if request.directory:
+        directory = _contained_path(root, request.directory)
+        if not os.path.isdir(directory):
+            raise HTTPException(status_code=404, detail="目录不存在")
+        # 目录内的符号链接可能指向 root 之外，逐个再校验
+        resolved.extend(_contained_path(root, path) for path in list_audio_files(directory))
+    return list(dict.fromkeys(resolved))
+
+
+@tts_router.post("/api/asr/batch")
+async def batch_transcribe(request: BatchTranscribeRequest):
+    """
+    批量转写服务器上的录音文件
+
+    使用场景：对归档的问诊录音做离线批处理，按长度分组后批量推理
+
+    请求格式:
+    - paths: 相对 ASR_BATCH_ROOT 的文件路径列表（16kHz、16bit、单声道的 wav 或 pcm）
+    - directory: 相对 ASR_BATCH_ROOT 的目录，递归转写其中所有音频
+    - max_batch_size: 单次推理最多包含的录音条数（可选）
+
+    返回格式:
+    - application/x-ndjson，每行一个文件的结果：path、success、text、audio_length_seconds 或 error
+    """
+    if ASR_BATCH_ROOT is None:
+        raise HTTPException(status_code=403, detail="未配置 ASR_BATCH_ROOT，批量转写接口未开启")
+    if asr_pool is None or not asr_pool.ready:
+        raise HTTPException(status_code=500, detail="模型未加载")
+
+    paths = _resolve_batch_paths(request)
+
+    config = ASRBatchConfig()
+    if request.max_batch_size:
+        config.max_batch_size = request.max_batch_size
+    logger.info(f"开始批量识别，共 {len(paths)} 个文件")
+
+    async def lines():
+        async for record in transcribe_files(asr_pool, paths, config):
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@tts_router.get("/api/asr/stats")
+async def asr_stats():
+    """获取语音识别推理池的队列深度与延迟统计"""
+    if asr_pool is None:
+        return {"ready": False}
+    stats = asr_pool.stats()
+    if streaming_engine is not None:
+        stats["streaming"] = streaming_engine.stats()
+    return stats
+
+
+@tts_router.websocket("/api/asr/stream")
+async def stream_audio(websocket: WebSocket):
+    """
+    流式语音识别（WebSocket）
+
+    使用场景：浏览器端边录音边发送，服务端每凑满一个推理块（默认600ms）就推送增量结果
+
+    客户端消息:
+    - 二进制帧: PCM音频数据 (16kHz, 16bit, mono)，长度任意
+    - 文本帧 {"type": "end"}: 当前语句结束，返回最终结果后可继续发送下一句
+
+    服务端消息:
+    - {"type": "partial", "delta": 新增文本, "text": 当前语句已识别文本}
+    - {"type": "final", "text": 当前语句完整文本, "audio_length_seconds": 音频长度（秒）}
+    - {"type": "error", "error": 错误信息}
+    """
+    await websocket.accept()
+    if streaming_engine is None or not streaming_engine.ready:
+        await websocket.send_json({"type": "error", "error": "流式模型未加载"})
+        await websocket.close()
+        return
+
+    session = streaming_engine.create_session()
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("bytes"):
+                for delta in await session.feed(message["bytes"]):
+                    await websocket.send_json(
+                        {"type": "partial", "delta": delta, "text": session.text})
+            elif message.get("text"):
+                try:
+                    command = json.loads(message["text"]).get("type")
+                except (ValueError, AttributeError):
+                    command = message["text"].strip()
+                if command == "end":
+                    audio_length = session.samples / SAMPLE_RATE
+                    text = await session.finish()
+                    logger.info(f"流式识别完成，结果: {text[:100]}...，音频长度: {audio_length:.2f}秒")
+                    await websocket.send_json({
+                        "type": "final",
+                        "text": text,
+                        "audio_length_seconds": round(audio_length, 2),
+                    })
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"流式识别失败: {str(e)}", exc_info=True)
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close()
+    finally:
+        session.close()
@@ -0,0 +1,563 @@
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, List, Literal, Optional, Sequence, Tuple
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field
+from app.tools.audio import (SAMPLE_RATE, pcm16_to_float32, probe_audio,
+                             load_audio_batch, group_by_length)
+
+load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
+
+
+class ASRPoolConfig(BaseModel):
+    """语音识别推理池配置类"""
+    model_path: Optional[str] = Field(default=os.getenv(
+        "TTS_MODEL_PATH"), description="语音识别模型路径")
+    num_workers: int = Field(default=int(os.getenv(
+        "ASR_NUM_WORKERS", 1)), ge=1, description="推理工作者数量，每个工作者持有一份模型")
+    max_queue_size: int = Field(default=int(os.getenv(
+        "ASR_MAX_QUEUE_SIZE", 16)), ge=1, description="等待队列上限，队列满时拒绝新请求")
+    mode: Literal["auto", "thread", "process"] = Field(default=os.getenv(
+        "ASR_WORKER_MODE", "auto"), description="工作者类型，auto 时 GPU 用线程、CPU 用进程")
+    device: Optional[str] = Field(default=os.getenv(
+        "ASR_DEVICE") or None, description="推理设备，如 cuda:0 或 cpu，为空时自动选择")
+
+
+class ASRQueueFullError(RuntimeError):
+    """等待队列已满，调用方应稍后重试"""
+
+
+@dataclass
+class ASRJobResult:
+    """单次识别结果及耗时"""
+    result: Any
+    queue_seconds: float
+    inference_seconds: float
+
+
+@dataclass
+class _ASRJob:
+    """排队中的识别任务"""
+    audio: Any
+    kwargs: dict
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+# 进程模式下，每个子进程持有的模型实例
+_process_model = None
+
+
+def _load_model(model_path: str, device: str, ncpu: int):
+    """加载 funasr 模型（funasr 导入较慢，仅在此处导入）"""
+    from funasr import AutoModel
+    return AutoModel(model=model_path, device=device, ncpu=ncpu, disable_update=True)
+
+
+def _init_process_worker(model_path: str, device: str, ncpu: int) -> None:
+    """子进程初始化：加载模型"""
+    global _process_model
+    _process_model = _load_model(model_path, device, ncpu)
+
+
+def _process_ready() -> bool:
+    """用于确认子进程已完成模型加载"""
+    return _process_model is not None
+
+
+def _process_generate(audio: Any, kwargs: dict) -> Any:
+    """在子进程中执行识别"""
+    return _process_model.generate(input=audio, **kwargs)
+
+
+class ASRWorkerPool:
+    """
+    语音识别推理池
+
+    请求先进入有界队列，由 N 个工作者依次取出执行 model.generate。
+    每个工作者持有一份模型，推理在线程（GPU）或子进程（CPU）中进行，不阻塞事件循环；
+    队列已满时直接拒绝，避免长录音堆积拖垮整个服务。
+    """
+
+    def __init__(self, config: Optional[ASRPoolConfig] = None):
+        """
+        Args:
+            config: 推理池配置，默认从环境变量读取
+        """
+        self.config = config or ASRPoolConfig()
+        self.device = self.config.device or self._default_device()
+        self.mode = self.config.mode
+        if self.mode == "auto":
+            self.mode = "thread" if self.device.startswith("cuda") else "process"
+
+        self.ready = False
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self._latencies: deque = deque(maxlen=1024)
+        self._queue: Optional[asyncio.Queue] = None
+        self._executors: List[Executor] = []
+        self._runners: List[Callable[[Any, dict], Any]] = []
+        self._tasks: List[asyncio.Task] = []
+
+    @staticmethod
+    def _default_device() -> str:
+        import torch
+        return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+    async def start(self) -> None:
+        """加载模型并启动工作者"""
+        loop = asyncio.get_running_loop()
+        # CPU 推理时平分核心，避免多个工作者争抢线程
+        ncpu = max(1, (os.cpu_count() or 1) // self.config.num_workers)
+        logger.info(
+            f"正在启动语音识别推理池: {self.config.num_workers} 个{self.mode}工作者, 设备 {self.device}")
+
+        if self.mode == "thread":
+            for _ in range(self.config.num_workers):
+                self._executors.append(ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="asr-worker"))
+            models = await asyncio.gather(*[
+                loop.run_in_executor(executor, _load_model,
+                                     self.config.model_path, self.device, ncpu)
+                for executor in self._executors
+            ])
+            self._runners = [
+                (lambda audio, kwargs, m=m: m.generate(input=audio, **kwargs)) for m in models
+            ]
+        else:
+            context = multiprocessing.get_context("spawn")
+            for _ in range(self.config.num_workers):
+                self._executors.append(ProcessPoolExecutor(
+                    max_workers=1, mp_context=context, initializer=_init_process_worker,
+                    initargs=(self.config.model_path, self.device, ncpu)))
+            # 等待所有子进程加载完成，加载失败时在启动阶段暴露
+            await asyncio.gather(*[
+                loop.run_in_executor(executor, _process_ready) for executor in self._executors
+            ])
+            self._runners = [_process_generate] * self.config.num_workers
+
+        self._queue = asyncio.Queue(maxsize=self.config.max_queue_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(executor, runner))
+            for executor, runner in zip(self._executors, self._runners)
+        ]
+        self.ready = True
+        logger.info("语音识别推理池启动成功！")
+
+    async def stop(self) -> None:
+        """停止工作者并释放模型资源"""
+        self.ready = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # 未处理的请求直接失败，避免调用方无限等待
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("语音识别推理池已关闭"))
+
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors = []
+        self._runners = []
+
+    async def submit(self, audio: Any, **kwargs) -> ASRJobResult:
+        """
+        提交识别任务并等待结果
+
+        Args:
+            audio: float32 音频数组（或数组列表）
+            **kwargs: 透传给 model.generate 的参数
+
+        Returns:
+            识别结果及排队、推理耗时
+
+        Raises:
+            ASRQueueFullError: 等待队列已满
+        """
+        if not self.ready:
+            raise RuntimeError("语音识别推理池未启动")
+
+        job = _ASRJob(audio=audio, kwargs=kwargs,
+                      future=asyncio.get_running_loop().create_future())
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ASRQueueFullError(
+                f"语音识别队列已满（{self.config.max_queue_size}），请稍后重试")
+        return await job.future
+
+    async def _worker(self, executor: Executor, runner: Callable[[Any, dict], Any]) -> None:
+        """工作者循环：从队列取任务并在专属执行器中推理"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job.future.done():
+                continue
+            started = time.perf_counter()
+            self.in_flight += 1
+            try:
+                result = await loop.run_in_executor(executor, runner, job.audio, job.kwargs)
+            except Exception as e:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                continue
+            finally:
+                self.in_flight -= 1
+
+            finished = time.perf_counter()
+            self.completed += 1
+            self._latencies.append(finished - job.enqueued_at)
+            if not job.future.done():
+                job.future.set_result(ASRJobResult(
+                    result=result,
+                    queue_seconds=started - job.enqueued_at,
+                    inference_seconds=finished - started))
+
+    async def warmup(self, seconds: float = 1.0, sample_rate: int = 16000) -> None:
+        """每个工作者各执行一次静音推理，完成算子初始化"""
+        silence = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(executor, runner, silence, {})
+            for executor, runner in zip(self._executors, self._runners)
+        ])
+
+    def stats(self) -> dict:
+        """获取队列深度与延迟统计"""
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4)
+
+        return {
+            "ready": self.ready,
+            "mode": self.mode,
+            "device": self.device,
+            "num_workers": self.config.num_workers,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_size": self.config.max_queue_size,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "latency_seconds": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(latencies[-1], 4) if latencies else None,
+            },
+        }
+
+
+class StreamingASRConfig(BaseModel):
+    """流式语音识别配置类"""
+    model_path: str = Field(default=os.getenv(
+        "STREAMING_ASR_MODEL_PATH", "paraformer-zh-streaming"), description="流式识别模型路径或名称")
+    num_workers: int = Field(default=int(os.getenv(
+        "STREAMING_ASR_NUM_WORKERS", 1)), ge=1, description="流式推理工作者数量，每个工作者持有一份模型")
+    device: Optional[str] = Field(default=os.getenv(
+        "ASR_DEVICE") or None, description="推理设备，为空时自动选择")
+    chunk_size: List[int] = Field(
+        default=[0, 10, 5], description="[0, 当前块, 前瞻块]，单位 60ms，[0, 10, 5] 即每块 600ms")
+    encoder_chunk_look_back: int = Field(default=4, description="编码器自注意力回看的块数")
+    decoder_chunk_look_back: int = Field(default=1, description="解码器交叉注意力回看的编码块数")
+    sample_rate: int = Field(default=16000, description="输入音频采样率")
+
+    @property
+    def chunk_stride(self) -> int:
+        """每个推理块包含的采样点数"""
+        return self.chunk_size[1] * 960
+
+
+class StreamingASREngine:
+    """
+    流式语音识别引擎
+
+    funasr 的 generate 会修改模型内部参数，同一模型不能并发调用，
+    因此每个工作者持有一份模型和一个单线程执行器，会话按轮询方式绑定到工作者。
+    """
+
+    def __init__(self, config: Optional[StreamingASRConfig] = None):
+        """
+        Args:
+            config: 流式识别配置，默认从环境变量读取
+        """
+        self.config = config or StreamingASRConfig()
+        self.device = self.config.device or ASRWorkerPool._default_device()
+        self.ready = False
+        self.active_sessions = 0
+        self._models: List[Any] = []
+        self._executors: List[ThreadPoolExecutor] = []
+        self._next_worker = 0
+
+    async def start(self) -> None:
+        """加载流式模型"""
+        loop = asyncio.get_running_loop()
+        logger.info(f"正在加载流式语音识别模型: {self.config.model_path}")
+        self._executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="asr-streaming")
+            for _ in range(self.config.num_workers)
+        ]
+        self._models = await asyncio.gather(*[
+            loop.run_in_executor(executor, _load_model,
+                                 self.config.model_path, self.device, 1)
+            for executor in self._executors
+        ])
+        self.ready = True
+        logger.info("流式模型加载成功！")
+
+    async def stop(self) -> None:
+        """释放模型与执行器"""
+        self.ready = False
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors = []
+        self._models = []
+
+    def create_session(self) -> "StreamingASRSession":
+        """创建新的识别会话，并绑定到一个工作者"""
+        if not self.ready:
+            raise RuntimeError("流式语音识别模型未加载")
+        worker = self._next_worker
+        self._next_worker = (self._next_worker + 1) % len(self._models)
+        return StreamingASRSession(self, worker)
+
+    async def _generate(self, worker: int, audio: np.ndarray, cache: dict, is_final: bool) -> str:
+        """在工作者线程中对一个音频块做增量识别，返回本块新增文本"""
+        model = self._models[worker]
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self._executors[worker],
+            lambda: model.generate(
+                input=audio, cache=cache, is_final=is_final,
+                chunk_size=self.config.chunk_size,
+                encoder_chunk_look_back=self.config.encoder_chunk_look_back,
+                decoder_chunk_look_back=self.config.decoder_chunk_look_back))
+        if result and isinstance(result, list) and isinstance(result[0], dict):
+            return result[0].get("text", "")
+        return ""
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "model": self.config.model_path,
+            "num_workers": self.config.num_workers,
+            "active_sessions": self.active_sessions,
+            "chunk_ms": self.config.chunk_stride * 1000 // self.config.sample_rate,
+        }
+
+
+class StreamingASRSession:
+    """
+    单个流式识别会话
+
+    按接收顺序缓存 16kHz int16 PCM，每凑满一个推理块就送入模型，
+    模型的块间状态保存在 cache 中；finish 时以 is_final=True 冲刷剩余音频。
+    """
+
+    def __init__(self, engine: StreamingASREngine, worker: int):
+        self.engine = engine
+        self.worker = worker
+        self.text = ""
+        self.samples = 0
+        self._cache: dict = {}
+        self._pending = np.empty(0, dtype=np.float32)
+        self._odd_byte = b""
+        engine.active_sessions += 1
+
+    def _append(self, pcm: bytes) -> None:
+        """追加 PCM 数据；消息边界可能切开一个采样点，多出的单字节留到下次拼接"""
+        pcm = self._odd_byte + pcm
+        usable = len(pcm) - len(pcm) % 2
+        self._odd_byte = pcm[usable:]
+        samples = pcm16_to_float32(pcm[:usable])
+        self._pending = np.concatenate([self._pending, samples])
+        self.samples += len(samples)
+
+    async def feed(self, pcm: bytes) -> List[str]:
+        """
+        输入一段 PCM 数据，对其中完整的推理块做识别
+
+        Args:
+            pcm: 16kHz、16bit、单声道 PCM 字节
+
+        Returns:
+            每个完整推理块新增的文本（可能为空列表）
+        """
+        self._append(pcm)
+        stride = self.engine.config.chunk_stride
+        deltas = []
+        while len(self._pending) >= stride:
+            chunk, self._pending = self._pending[:stride], self._pending[stride:]
+            delta = await self.engine._generate(self.worker, chunk, self._cache, is_final=False)
+            if delta:
+                self.text += delta
+                deltas.append(delta)
+        return deltas
+
+    async def finish(self) -> str:
+        """
+        结束当前语句：冲刷剩余音频并返回完整文本，之后会话可继续用于下一句
+
+        Returns:
+            本句完整识别结果
+        """
+        if self.samples == 0:
+            return ""
+        # 剩余音频为空时补一小段静音，保证最后一次调用能冲刷出解码器中的尾部文本
+        tail = self._pending if len(self._pending) else np.zeros(960, dtype=np.float32)
+        delta = await self.engine._generate(self.worker, tail, self._cache, is_final=True)
+        text = self.text + delta
+        self.text = ""
+        self._cache = {}
+        self._pending = np.empty(0, dtype=np.float32)
+        self._odd_byte = b""
+        self.samples = 0
+        return text
+
+    def close(self) -> None:
+        """释放会话"""
+        self.engine.active_sessions -= 1
+
+
+class ASRBatchConfig(BaseModel):
+    """批量转写配置类"""
+    max_batch_size: int = Field(default=int(os.getenv(
+        "ASR_BATCH_MAX_SIZE", 16)), ge=1, description="单次 generate 最多包含的录音条数")
+    max_batch_seconds: float = Field(default=float(os.getenv(
+        "ASR_BATCH_MAX_SECONDS", 300)), gt=0, description="单批补零后的最大音频总时长（秒）")
+    retry_interval: float = Field(default=0.5, description="推理池队列已满时的重试间隔（秒）")
+
+
+async def transcribe_files(pool: ASRWorkerPool, file_paths: Sequence[str],
+                           config: Optional[ASRBatchConfig] = None) -> AsyncIterator[dict]:
+    """
+    批量转写音频文件，按完成顺序逐条产出结果
+
+    先按长度分组以减少补零，每组读入同一块缓冲区后一次 generate 完成推理；
+    同时在推理池中运行的分组数不超过工作者数量。
+
+    Args:
+        pool: 已启动的语音识别推理池
+        file_paths: 音频文件路径列表（16kHz、16bit、单声道的 wav 或 pcm）
+        config: 批量转写配置，默认从环境变量读取
+
+    Yields:
+        每个文件的结果：path、success、text、audio_length_seconds 或 error
+    """
+    config = config or ASRBatchConfig()
+    lengths = {}
+    for path in file_paths:
+        try:
+            lengths[path] = probe_audio(path)
+        except Exception as e:
+            yield {"path": path, "success": False, "error": str(e)}
+
+    paths = [path for path in file_paths if path in lengths and lengths[path] > 0]
+    for path in file_paths:
+        if lengths.get(path) == 0:
+            yield {"path": path, "success": False, "error": "音频为空"}
+
+    groups = group_by_length([lengths[path] for path in paths], config.max_batch_size,
+                             int(config.max_batch_seconds * SAMPLE_RATE))
+    slots = asyncio.Semaphore(pool.config.num_workers)
+
+    async def run_group(group: List[int]) -> List[dict]:
+        group_paths = [paths[i] for i in group]
+        async with slots:
+            try:
+                _, views = await asyncio.to_thread(load_audio_batch, group_paths)
+                while True:
+                    try:
+                        job = await pool.submit(views, batch_size=len(views))
+                        break
+                    except ASRQueueFullError:
+                        # 推理池繁忙时等待，批量任务让位于在线请求
+                        await asyncio.sleep(config.retry_interval)
+            except Exception as e:
+                logger.error(f"批量识别失败: {str(e)}")
+                return [{"path": path, "success": False, "error": str(e)} for path in group_paths]
+
+        results = job.result if isinstance(job.result, list) else [job.result]
+        records = []
+        for path, view, item in zip(group_paths, views, results):
+            records.append({
+                "path": path,
+                "success": True,
+                "text": item.get("text", "") if isinstance(item, dict) else "",
+                "audio_length_seconds": round(len(view) / SAMPLE_RATE, 2),
+            })
+        return records
+
+    tasks = [asyncio.create_task(run_group(group)) for group in groups]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            for record in await finished:
+                yield record
+    finally:
+        # 调用方提前停止（如客户端断开）时取消剩余分组
+        for task in tasks:
+            task.cancel()
+
+
+async def transcribe_segments(pool: ASRWorkerPool, audio: np.ndarray,
+                              segments: Sequence[Tuple[int, int]],
+                              config: Optional[ASRBatchConfig] = None) -> List[dict]:
+    """
+    并行转写同一段音频中的多个语音片段
+
+    片段以切片视图传入（不复制音频），按长度分组后分散到各个工作者同时推理。
+
+    Args:
+        pool: 已启动的语音识别推理池
+        audio: float32 音频数组
+        segments: 语音片段列表，每项为 (起始采样点, 结束采样点)
+        config: 批量转写配置，默认从环境变量读取
+
+    Returns:
+        按时间顺序排列的片段结果：start、end（秒）与 text
+
+    Raises:
+        ASRQueueFullError: 推理池队列已满
+    """
+    if not segments:
+        return []
+    config = config or ASRBatchConfig()
+    views = [audio[start:end] for start, end in segments]
+    # 单批条数不超过 片段数/工作者数，保证片段能分散到所有工作者上并行推理
+    per_worker = -(-len(views) // pool.config.num_workers)
+    groups = group_by_length([len(view) for view in views],
+                             min(config.max_batch_size, per_worker),
+                             int(config.max_batch_seconds * SAMPLE_RATE))
+
+    async def run_group(group: List[int]):
+        job = await pool.submit([views[i] for i in group], batch_size=len(group))
+        results = job.result if isinstance(job.result, list) else [job.result]
+        return group, results
+
+    records: List[Optional[dict]] = [None] * len(views)
+    for group, results in await asyncio.gather(*[run_group(group) for group in groups]):
+        for index, item in zip(group, results):
+            start, end = segments[index]
+            records[index] = {
+                "start": round(start / SAMPLE_RATE, 3),
+                "end": round(end / SAMPLE_RATE, 3),
+                "text": item.get("text", "") if isinstance(item, dict) else "",
+            }
+    return records
@@ -0,0 +1,186 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field
+
+load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
+
+
+class BatcherConfig(BaseModel):
+    """动态微批处理配置类"""
+    max_batch_size: int = Field(default=int(os.getenv(
+        "EMBEDDING_BATCH_MAX_SIZE", 64)), ge=1, description="单个批次最多合并的文本条数")
+    max_wait_ms: float = Field(default=float(os.getenv(
+        "EMBEDDING_BATCH_WAIT_MS", 5)), ge=0, description="凑批等待窗口（毫秒），超时后立即发车")
+    num_workers: int = Field(default=int(os.getenv(
+        "EMBEDDING_BATCH_WORKERS", 1)), ge=1, description="执行 encode 的工作线程数")
+
+
+@dataclass
+class _PendingRequest:
+    """排队中的单个请求：待编码文本、已统计的 token 数（可选）与回填结果的 Future"""
+    texts: List[str]
+    future: asyncio.Future
+    lengths: Optional[List[int]] = None
+
+
+class EmbeddingBatcher:
+    """
+    请求合并批处理器
+
+    将并发到达的多个 embedding 请求在一个时间窗口（或达到最大批量）内合并，
+    在工作线程中只调用一次 encode，再把结果按请求切片回填给各调用方，
+    既提升吞吐又避免阻塞事件循环。
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str], Optional[List[int]]], np.ndarray],
+                 config: Optional[BatcherConfig] = None):
+        """
+        Args:
+            encode_fn: 同步编码函数，输入文本列表与对应的 token 数（批内有请求未提供时为 None），
+                返回 (n, dim) 的向量矩阵
+            config: 批处理配置，默认从环境变量读取
+        """
+        self.encode_fn = encode_fn
+        self.config = config or BatcherConfig()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.config.num_workers, thread_name_prefix="embedding-batcher")
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._carry: Optional[_PendingRequest] = None
+        # 执行中的批次任务，保留引用避免被回收，关闭时等待它们完成
+        self._dispatches: Set[asyncio.Task] = set()
+
+    def _ensure_started(self) -> None:
+        """在当前事件循环中惰性启动后台凑批任务"""
+        if self._worker_task is None or self._worker_task.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.config.num_workers)
+            self._carry = None
+            self._worker_task = asyncio.create_task(self._run())
+
+    async def encode(self, texts: List[str], lengths: Optional[List[int]] = None) -> np.ndarray:
+        """
+        提交文本并等待所属批次完成
+
+        Args:
+            texts: 待编码的文本列表
+            lengths: 调用方已统计的每条文本的 token 数，传入后编码时不再重复分词
+
+        Returns:
+            与 texts 一一对应的向量矩阵
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingRequest(
+            texts=list(texts), future=future, lengths=list(lengths) if lengths is not None else None))
+        return await future
+
+    async def _next_request(self, timeout: Optional[float]) -> Optional[_PendingRequest]:
+        """取出下一个请求（优先取上一批放不下的请求），超时返回 None"""
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        if timeout is None:
+            return await self._queue.get()
+        if timeout <= 0:
+            try:
+                return self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return None
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _run(self) -> None:
+        """后台凑批循环：等到有空闲工作线程后收集一批请求并发车"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # 工作线程全忙时不急于凑批，让请求在队列中继续累积
+            await self._slots.acquire()
+            first = await self._next_request(timeout=None)
+            batch = [first]
+            size = len(first.texts)
+            deadline = loop.time() + self.config.max_wait_ms / 1000
+
+            try:
+                while size < self.config.max_batch_size:
+                    request = await self._next_request(timeout=deadline - loop.time())
+                    if request is None:
+                        break
+                    if size + len(request.texts) > self.config.max_batch_size:
+                        # 放不下的请求留到下一批，保证单批不超过上限
+                        self._carry = request
+                        break
+                    batch.append(request)
+                    size += len(request.texts)
+            except asyncio.CancelledError:
+                # 关闭时正在凑的这一批不再发车
+                self._fail(batch)
+                raise
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    @staticmethod
+    def _fail(requests: List[_PendingRequest]) -> None:
+        """让尚未完成的请求以"批处理器已关闭"失败，调用方不会一直等待"""
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("嵌入批处理器已关闭"))
+
+    async def _dispatch(self, batch: List[_PendingRequest]) -> None:
+        """在工作线程中执行一次 encode，并把结果切片回填给各请求"""
+        loop = asyncio.get_running_loop()
+        texts = [text for request in batch for text in request.texts]
+        # 批内所有请求都带有 token 数时才整体传入，否则由 encode_fn 自行统计
+        lengths = None
+        if all(request.lengths is not None for request in batch):
+            lengths = [length for request in batch for length in request.lengths]
+        try:
+            vectors = await loop.run_in_executor(self._executor, self.encode_fn, texts, lengths)
+        except Exception as e:
+            logger.error(f"批量编码失败: {str(e)}")
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        offset = 0
+        for request in batch:
+            count = len(request.texts)
+            if not request.future.done():
+                request.future.set_result(vectors[offset:offset + count])
+            offset += count
+
+    async def close(self) -> None:
+        """停止凑批，等待已发车的批次完成，队列中尚未处理的请求以错误结束，最后关闭工作线程池"""
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+        if self._dispatches:
+            await asyncio.gather(*self._dispatches, return_exceptions=True)
+        pending = [self._carry] if self._carry is not None else []
+        self._carry = None
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        self._fail(pending)
+        self._executor.shutdown(wait=False)
@@ -1,13 +1,21 @@
 import os
+import logging
+import threading
 from dotenv import load_dotenv, find_dotenv
 from pydantic import BaseModel, Field
-from typing import Literal
-from sentence_transformers import SentenceTransformer
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-import torch
+from typing import TYPE_CHECKING, Callable, Dict, List, Literal, Optional, Sequence
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from app.core.embedding_cache import CachedEmbeddings, get_embedding_cache
+from app.core.embedding_pool import EmbeddingPoolConfig, EmbeddingProcessPool
+
+if TYPE_CHECKING:
+    # torch 与 sentence_transformers 导入较慢，仅在实际加载模型时导入
+    from sentence_transformers import SentenceTransformer
 
 # 加载.env配置文件中的环境变量
 load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
 
 # 获取本地嵌入模型路径环境变量
 EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH")
@@ -20,36 +28,318 @@ EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH")
 #     )
 
 
+class EmbeddingBackendConfig(BaseModel):
+    """嵌入模型推理后端配置类"""
+    backend: Literal["torch", "onnx", "openvino"] = Field(default=os.getenv(
+        "EMBEDDING_BACKEND", "torch"), description="推理后端：torch、onnx（ONNX Runtime）或 openvino")
+    device: Optional[str] = Field(default=os.getenv(
+        "EMBEDDING_DEVICE") or None, description="推理设备，为空时有 GPU 用 cuda，否则用 cpu")
+    file_name: Optional[str] = Field(default=os.getenv(
+        "EMBEDDING_BACKEND_FILE") or None,
+        description="模型目录下导出文件的相对路径，如 onnx/model_qint8_avx512_vnni.onnx，为空使用默认导出文件")
+    num_threads: int = Field(default=int(os.getenv(
+        "EMBEDDING_NUM_THREADS", 0)), ge=0, description="CPU 推理的算子内线程数，0 表示使用库的默认值")
+
+    def model_key(self, model_path: str) -> str:
+        """注册表与向量缓存使用的模型标识，不同后端或量化文件的向量不混用"""
+        if self.backend == "torch":
+            return model_path
+        return f"{model_path}|{self.backend}|{self.file_name or 'default'}"
+
+
+class EmbeddingLimitsConfig(BaseModel):
+    """嵌入请求限制与按 token 分桶编码的配置类"""
+    max_inputs: int = Field(default=int(os.getenv(
+        "EMBEDDING_MAX_INPUTS", 2048)), ge=1, description="单个请求最多的文本条数")
+    max_request_tokens: int = Field(default=int(os.getenv(
+        "EMBEDDING_MAX_REQUEST_TOKENS", 300000)), ge=1, description="单个请求的 token 总数上限")
+    max_batch_tokens: int = Field(default=int(os.getenv(
+        "EMBEDDING_MAX_BATCH_TOKENS", 16384)), ge=1,
+        description="单次前向计算补齐后的 token 数上限（批内最长 × 条数）")
+    max_batch_size: int = Field(default=int(os.getenv(
+        "EMBEDDING_ENCODE_BATCH_SIZE", 128)), ge=1, description="单次前向计算的最大条数")
+
+
+def bucket_by_tokens(lengths: Sequence[int], max_batch_tokens: int,
+                     max_batch_size: int) -> List[List[int]]:
+    """
+    按 token 长度排序后分桶，使同一桶内长度接近，减少补齐带来的无效计算
+
+    每桶不超过 max_batch_size 条，且 桶内最长 × 条数 不超过 max_batch_tokens；
+    单条超过上限的文本单独成桶。
+
+    Args:
+        lengths: 每条文本的 token 数
+        max_batch_tokens: 单桶补齐后的最大 token 数
+        max_batch_size: 单桶最大条数
+
+    Returns:
+        分桶后的下标列表
+    """
+    buckets: List[List[int]] = []
+    current: List[int] = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # 升序遍历，新加入的文本就是桶内最长的
+        padded = lengths[index] * (len(current) + 1)
+        if current and (len(current) >= max_batch_size or padded > max_batch_tokens):
+            buckets.append(current)
+            current = []
+        current.append(index)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """
+    基于共享 SentenceTransformer 权重的 LangChain 嵌入封装
+
+    与 HuggingFaceEmbeddings 的默认行为保持一致（换行替换为空格、不归一化），
+    但不再单独加载模型，而是通过 Embedding.encode 编码（共享权重、按 token 分桶，
+    开启推理池时由多个子进程并行完成）。
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str], bool], np.ndarray],
+                 normalize_embeddings: bool = False):
+        """
+        Args:
+            encode_fn: 编码函数，参数为文本列表与是否归一化，首次调用时才加载模型
+            normalize_embeddings: 是否对向量做 L2 归一化
+        """
+        self.encode_fn = encode_fn
+        self.normalize_embeddings = normalize_embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.encode_fn(texts, self.normalize_embeddings).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量编码查询，查询与文档的编码方式相同"""
+        return self.embed_documents(texts)
+
+
 class Embedding:
-    def __init__(self):
-        pass
-        # 保存配置对象
-        # self.config = config
-        # 根据配置类型初始化对应的嵌入模型，并保存为实例属性
-        # if self.config.type == "local":
-        #     self._embedding_model = self.local_embedding()
-        # elif self.config.type == "remote":
-        #     self._embedding_model = self.remote_embedding()
-        # else:
-        #     raise ValueError(f"不支持的嵌入模型类型: {self.config.type}")
-
-    def local_embedding(self) -> HuggingFaceEmbeddings:
-        """
-        使用本地 HuggingFaceEmbeddings 模型进行文本编码
+    """
+    进程级嵌入模型注册表
+
+    同一路径的模型在进程内只加载一次（首次使用时加载），
+    API 使用的原始 SentenceTransformer 与向量库使用的 LangChain 封装共享同一份权重。
+    设置 EMBEDDING_POOL_WORKERS 后，encode 与 count_tokens 改由多进程推理池执行，主进程不加载模型。
+    """
+    _models: Dict[str, "SentenceTransformer"] = {}
+    _pools: Dict[str, EmbeddingProcessPool] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_path: Optional[str] = None,
+                 limits: Optional[EmbeddingLimitsConfig] = None,
+                 backend: Optional[EmbeddingBackendConfig] = None,
+                 pool: Optional[EmbeddingPoolConfig] = None):
+        """
+        Args:
+            model_path: 模型路径，默认使用环境变量 EMBEDDING_MODEL_PATH
+            limits: 请求限制与分桶配置，默认从环境变量读取
+            backend: 推理后端配置，默认从环境变量读取
+            pool: 多进程推理池配置，默认从环境变量读取
+        """
+        self.model_path = model_path or EMBEDDING_MODEL_PATH
+        self.limits = limits or EmbeddingLimitsConfig()
+        self.backend = backend or EmbeddingBackendConfig()
+        self.pool_config = pool or EmbeddingPoolConfig()
+
+    @property
+    def model_id(self) -> str:
+        """当前模型在注册表中的标识"""
+        return self.backend.model_key(self.model_path)
+
+    @classmethod
+    def get_model(cls, model_path: str,
+                  backend: Optional[EmbeddingBackendConfig] = None) -> "SentenceTransformer":
+        """
+        获取共享的 SentenceTransformer 实例，不存在时加载
+
+        Args:
+            model_path: 模型路径
+            backend: 推理后端配置，默认使用 torch 后端
+
+        Returns:
+            已初始化的嵌入模型实例
+        """
+        backend = backend or EmbeddingBackendConfig(backend="torch")
+        key = backend.model_key(model_path)
+        model = cls._models.get(key)
+        if model is not None:
+            return model
+
+        with cls._lock:
+            model = cls._models.get(key)
+            if model is None:
+                logger.info(f"正在加载嵌入模型: {key}")
+                model = cls._load_model(model_path, backend)
+                cls._models[key] = model
+                logger.info(f"嵌入模型加载成功: {key}")
+        return model
+
+    @staticmethod
+    def _load_model(model_path: str, backend: EmbeddingBackendConfig) -> "SentenceTransformer":
+        """
+        按后端配置加载模型
+
+        onnx / openvino 后端依赖 optimum（pip install "optimum[onnxruntime]" 或 "optimum[openvino]"），
+        模型目录中没有对应导出文件时由 sentence_transformers 自动导出。
+        int8 量化模型通过 file_name 指定，如 onnx/model_qint8_avx512_vnni.onnx。
+        """
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        device = backend.device or ("cuda" if torch.cuda.is_available() else "cpu")
+        model_kwargs = {}
+        if backend.file_name:
+            model_kwargs["file_name"] = backend.file_name
+
+        if backend.backend == "torch":
+            if backend.num_threads and device == "cpu":
+                torch.set_num_threads(backend.num_threads)
+        elif backend.backend == "onnx":
+            import onnxruntime
+
+            session_options = onnxruntime.SessionOptions()
+            if backend.num_threads:
+                session_options.intra_op_num_threads = backend.num_threads
+            model_kwargs["session_options"] = session_options
+            model_kwargs["provider"] = ("CUDAExecutionProvider" if device.startswith("cuda")
+                                        else "CPUExecutionProvider")
+        elif backend.backend == "openvino" and backend.num_threads:
+            model_kwargs["ov_config"] = {"INFERENCE_NUM_THREADS": backend.num_threads}
+
+        model = SentenceTransformer(model_path, device=device, backend=backend.backend,
+                                    model_kwargs=model_kwargs or None)
+        if backend.backend == "torch":
+            model.eval()
+        return model
+
+    @classmethod
+    def loaded_models(cls) -> List[str]:
+        """获取已加载的模型标识列表"""
+        return list(cls._models.keys()) + [f"{key}|pool" for key in cls._pools]
+
+    def get_pool(self) -> Optional[EmbeddingProcessPool]:
+        """获取共享的多进程推理池，未开启时返回 None，首次调用时启动"""
+        if not self.pool_config.num_workers:
+            return None
+        key = self.model_id
+        pool = self._pools.get(key)
+        if pool is not None:
+            return pool
+
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = EmbeddingProcessPool(
+                    self.model_path, self.backend, self.limits, self.pool_config)
+                pool.start()
+                self._pools[key] = pool
+        return pool
+
+    @classmethod
+    def pool_stats(cls) -> List[dict]:
+        """获取各推理池状态"""
+        return [pool.stats() for pool in cls._pools.values()]
+
+    @classmethod
+    def shutdown_pools(cls) -> None:
+        """关闭所有推理池的子进程"""
+        with cls._lock:
+            pools, cls._pools = list(cls._pools.values()), {}
+        for pool in pools:
+            pool.stop()
+
+    def local_embedding(self) -> CachedEmbeddings:
+        """
+        使用共享的 SentenceTransformer 进行文本编码
         在langchain内部使用
-        返回已初始化的嵌入模型实例
+        返回带向量缓存的嵌入模型实例，模型在首次编码时才加载
         """
-        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_PATH)
+        return CachedEmbeddings(
+            SentenceTransformerEmbeddings(self.encode),
+            cache=get_embedding_cache(f"{self.model_id}|st|raw"))
 
-    def remote_embedding(self) -> SentenceTransformer:
+    def remote_embedding(self) -> "SentenceTransformer":
         """
         使用 SentenceTransformer 进行文本嵌入
         为了api兼容，返回 SentenceTransformer 对象
-        返回已初始化的嵌入模型实例
+        返回共享的嵌入模型实例
         """
-        model = SentenceTransformer(
-            EMBEDDING_MODEL_PATH, device="cuda" if torch.cuda.is_available() else "cpu")
+        return self.get_model(self.model_path, self.backend)
 
-        model.eval()
-        return model
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """
+        使用模型自带的分词器统计每条文本的 token 数
+
+        计数包含特殊符号，并按模型的 max_seq_length 截断，与实际参与计算的长度一致。
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            与 texts 一一对应的 token 数
+        """
+        if not texts:
+            return []
+        pool = self.get_pool()
+        if pool is not None:
+            return pool.count_tokens(texts)
+        model = self.remote_embedding()
+        encoded = model.tokenizer(
+            texts, add_special_tokens=True, truncation=True, max_length=model.max_seq_length,
+            return_attention_mask=False, return_token_type_ids=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True,
+               lengths: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        按 token 长度分桶编码，结果按原顺序返回
 
+        长短文本混在一起时按最长文本补齐会浪费大量计算，超大输入一次编码也可能耗尽显存；
+        这里先按 token 数排序分桶，逐桶编码后再写回原位置。
+
+        Args:
+            texts: 文本列表
+            normalize_embeddings: 是否对向量做 L2 归一化
+            lengths: 调用方已统计的每条文本的 token 数，只用于分桶；不传时在这里分词统计
+
+        Returns:
+            与 texts 一一对应的 (n, dim) float32 向量矩阵
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if lengths is not None and len(lengths) != len(texts):
+            raise ValueError(f"lengths 长度 {len(lengths)} 与 texts 长度 {len(texts)} 不一致")
+        pool = self.get_pool()
+        if pool is not None:
+            # 子进程内同样按 token 分桶编码
+            return pool.encode(texts, normalize_embeddings=normalize_embeddings, lengths=lengths)
+        model = self.remote_embedding()
+        if lengths is None:
+            lengths = self.count_tokens(texts)
+
+        output: Optional[np.ndarray] = None
+        for bucket in bucket_by_tokens(lengths, self.limits.max_batch_tokens,
+                                       self.limits.max_batch_size):
+            vectors = model.encode(
+                [texts[i] for i in bucket], batch_size=len(bucket),
+                normalize_embeddings=normalize_embeddings, convert_to_numpy=True)
+            if output is None:
+                output = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            output[bucket] = vectors
+        return output
+
+    def warmup(self) -> None:
+        """
+        预热：加载模型并执行一次推理
+        提前完成 CUDA 上下文与算子初始化，避免首个真实请求承担这部分耗时
+        开启推理池时会启动全部子进程
+        """
+        self.encode(["预热"], normalize_embeddings=True)
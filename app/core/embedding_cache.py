@@ -0,0 +1,367 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field
+from langchain_core.embeddings import Embeddings
+
+load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
+
+# 每个缓存键的字节长度（blake2b 摘要）
+KEY_SIZE = 16
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class EmbeddingCacheConfig(BaseModel):
+    """向量缓存配置类"""
+    enabled: bool = Field(default=os.getenv(
+        "EMBEDDING_CACHE_ENABLED", "True").lower() == "true", description="是否启用向量缓存")
+    max_memory_bytes: int = Field(default=int(os.getenv(
+        "EMBEDDING_CACHE_MAX_BYTES", 256 * 1024 * 1024)), ge=0, description="内存 LRU 层的字节上限")
+    disk_dir: Optional[str] = Field(default=os.getenv(
+        "EMBEDDING_CACHE_DIR") or None, description="磁盘持久层目录，为空则不落盘")
+
+
+def normalize_text(text: str) -> str:
+    """
+    规范化文本，用于生成缓存键
+
+    只做不影响分词结果的处理：Unicode NFC 规范化、去除首尾空白、合并连续空白。
+    """
+    text = unicodedata.normalize("NFC", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def make_cache_key(model_id: str, text: str) -> bytes:
+    """根据模型标识与规范化文本生成内容寻址的缓存键"""
+    payload = f"{model_id}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=KEY_SIZE).digest()
+
+
+class _MemoryTier:
+    """按字节数限制容量的内存 LRU 层"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        vector = self._items.get(key)
+        if vector is not None:
+            self._items.move_to_end(key)
+        return vector
+
+    def put(self, key: bytes, vector: np.ndarray) -> None:
+        cost = vector.nbytes + KEY_SIZE
+        if cost > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.current_bytes -= old.nbytes + KEY_SIZE
+        self._items[key] = vector
+        self.current_bytes += cost
+        # 超出上限时淘汰最久未使用的条目
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.current_bytes -= evicted.nbytes + KEY_SIZE
+
+
+class _DiskTier:
+    """
+    基于内存映射文件的磁盘持久层
+
+    目录下保存三个文件：
+    - meta.json: 向量维度
+    - vectors.f32: 按行追加的 float32 向量矩阵，读取时通过 np.memmap 映射
+    - keys.bin: 与向量逐行对应的定长缓存键
+    先写向量再写键，进程异常退出时以两者中较短的行数为准。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._keys_path = os.path.join(directory, "keys.bin")
+        self.dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._mmap: Optional[np.memmap] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _load(self) -> None:
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            self.dim = json.load(f)["dim"]
+
+        keys = b""
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, "rb") as f:
+                keys = f.read()
+        vector_rows = 0
+        if os.path.exists(self._vectors_path):
+            vector_rows = os.path.getsize(self._vectors_path) // (self.dim * 4)
+        rows = min(len(keys) // KEY_SIZE, vector_rows)
+        for row in range(rows):
+            self._rows[keys[row * KEY_SIZE:(row + 1) * KEY_SIZE]] = row
+
+        # 截掉未成对写完的尾部数据
+        with open(self._keys_path, "ab") as f:
+            f.truncate(rows * KEY_SIZE)
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(rows * self.dim * 4)
+        logger.info(f"已加载磁盘向量缓存 {self.directory}，共 {rows} 条")
+
+    def _remap(self) -> None:
+        """文件增长后重新建立内存映射"""
+        rows = len(self._rows)
+        self._mmap = np.memmap(self._vectors_path, dtype=np.float32,
+                               mode="r", shape=(rows, self.dim)) if rows else None
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            self._remap()
+        return np.array(self._mmap[row])
+
+    def put_many(self, items: List[Tuple[bytes, np.ndarray]]) -> None:
+        unique = {key: vector for key, vector in items if key not in self._rows}
+        items = list(unique.items())
+        if not items:
+            return
+        if self.dim is None:
+            self.dim = int(items[0][1].shape[-1])
+            with open(self._meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim}, f)
+
+        matrix = np.ascontiguousarray(
+            np.stack([vector for _, vector in items]), dtype=np.float32)
+        with open(self._vectors_path, "ab") as f:
+            f.write(matrix.tobytes())
+        with open(self._keys_path, "ab") as f:
+            f.write(b"".join(key for key, _ in items))
+
+        start = len(self._rows)
+        for offset, (key, _) in enumerate(items):
+            self._rows[key] = start + offset
+
+
+class EmbeddingCache:
+    """
+    内容寻址的向量缓存
+
+    缓存键由模型标识与规范化文本的哈希组成；内存 LRU 层按字节数限制容量，
+    可选的磁盘层使用内存映射文件持久化，进程重启后仍然有效。
+    """
+
+    def __init__(self, model_id: str, config: Optional[EmbeddingCacheConfig] = None):
+        """
+        Args:
+            model_id: 模型标识，不同模型或编码参数应使用不同标识
+            config: 缓存配置，默认从环境变量读取
+        """
+        self.model_id = model_id
+        self.config = config or EmbeddingCacheConfig()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = _MemoryTier(self.config.max_memory_bytes)
+        self._disk: Optional[_DiskTier] = None
+        if self.config.disk_dir:
+            namespace = hashlib.blake2b(
+                model_id.encode("utf-8"), digest_size=8).hexdigest()
+            self._disk = _DiskTier(os.path.join(self.config.disk_dir, namespace))
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        批量查询缓存
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            与 texts 一一对应的向量，未命中的位置为 None
+        """
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for text in texts:
+                key = make_cache_key(self.model_id, text)
+                vector = self._memory.get(key)
+                if vector is None and self._disk is not None:
+                    vector = self._disk.get(key)
+                    if vector is not None:
+                        # 磁盘命中后提升到内存层
+                        self._memory.put(key, vector)
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray) -> None:
+        """
+        批量写入缓存
+
+        Args:
+            texts: 文本列表
+            vectors: 与 texts 一一对应的向量矩阵
+        """
+        items = []
+        for text, vector in zip(texts, vectors):
+            vector = np.array(vector, dtype=np.float32)
+            items.append((make_cache_key(self.model_id, text), vector))
+        with self._lock:
+            for key, vector in items:
+                self._memory.put(key, vector)
+            if self._disk is not None:
+                self._disk.put_many(items)
+
+    def _plan(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[str]]:
+        """查询缓存，返回已命中结果与按规范化文本去重后的待编码文本"""
+        cached = self.get_many(texts)
+        missing = list(dict.fromkeys(
+            normalize_text(text) for text, vector in zip(texts, cached) if vector is None))
+        return cached, missing
+
+    @staticmethod
+    def _assemble(texts: List[str], cached: List[Optional[np.ndarray]],
+                  missing: List[str], encoded) -> np.ndarray:
+        """把缓存结果与新编码结果按原顺序拼成矩阵"""
+        fresh = {text: vector for text, vector in zip(missing, encoded)}
+        return np.stack([
+            vector if vector is not None else np.asarray(
+                fresh[normalize_text(text)], dtype=np.float32)
+            for text, vector in zip(texts, cached)
+        ])
+
+    def encode(self, texts: List[str],
+               encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        经过缓存的同步编码：只对未命中的文本调用 encode_fn
+
+        Args:
+            texts: 文本列表
+            encode_fn: 实际执行编码的函数
+
+        Returns:
+            与 texts 一一对应的向量矩阵
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if not self.config.enabled:
+            return np.asarray(encode_fn(texts), dtype=np.float32)
+
+        cached, missing = self._plan(texts)
+        encoded = encode_fn(missing) if missing else []
+        if missing:
+            self.put_many(missing, encoded)
+        return self._assemble(texts, cached, missing, encoded)
+
+    async def aencode(self, texts: List[str],
+                      encode_fn: Callable[[List[str]], Awaitable[np.ndarray]]) -> np.ndarray:
+        """
+        经过缓存的异步编码：只对未命中的文本 await encode_fn
+
+        Args:
+            texts: 文本列表
+            encode_fn: 实际执行编码的异步函数
+
+        Returns:
+            与 texts 一一对应的向量矩阵
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if not self.config.enabled:
+            return np.asarray(await encode_fn(texts), dtype=np.float32)
+
+        cached, missing = self._plan(texts)
+        encoded = await encode_fn(missing) if missing else []
+        if missing:
+            self.put_many(missing, encoded)
+        return self._assemble(texts, cached, missing, encoded)
+
+    def stats(self) -> dict:
+        """获取命中统计与容量信息，用于评估缓存大小"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "model_id": self.model_id,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory.current_bytes,
+                "memory_max_bytes": self._memory.max_bytes,
+                "disk_items": len(self._disk) if self._disk is not None else 0,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """为 LangChain Embeddings 增加向量缓存的包装类"""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        # 查询向量与文档向量的编码方式可能不同（如带查询指令），使用独立命名空间
+        self.query_cache = get_embedding_cache(f"{cache.model_id}#query")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.encode(
+            list(texts), lambda missing: np.asarray(self.embeddings.embed_documents(missing)))
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        vectors = self.query_cache.encode(
+            [text], lambda missing: np.asarray([self.embeddings.embed_query(missing[0])]))
+        return vectors[0].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """批量编码查询：内部模型支持 embed_queries 时未命中的查询只编码一次"""
+        embed_queries = getattr(self.embeddings, "embed_queries", None)
+        if embed_queries is None:
+            def encode(missing):
+                return np.asarray([self.embeddings.embed_query(text) for text in missing])
+        else:
+            def encode(missing):
+                return np.asarray(embed_queries(missing))
+        return self.query_cache.encode(list(texts), encode).tolist()
+
+
+# 进程内按模型标识共享的缓存实例
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_id: str) -> EmbeddingCache:
+    """获取（必要时创建）指定模型标识的缓存实例"""
+    with _caches_lock:
+        cache = _caches.get(model_id)
+        if cache is None:
+            cache = EmbeddingCache(model_id)
+            _caches[model_id] = cache
+        return cache
+
+
+def get_cache_stats() -> List[dict]:
+    """获取所有缓存实例的统计信息"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return [cache.stats() for cache in caches]
@@ -0,0 +1,238 @@
+import os
+import logging
+import threading
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, List, Optional, Sequence
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field
+
+if TYPE_CHECKING:
+    from app.core.embedding import Embedding, EmbeddingBackendConfig, EmbeddingLimitsConfig
+
+load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingPoolConfig(BaseModel):
+    """多进程嵌入推理池配置类"""
+    num_workers: int = Field(default=int(os.getenv(
+        "EMBEDDING_POOL_WORKERS", 0)), ge=0, description="推理子进程数量，0 表示在当前进程内推理")
+    threads_per_worker: int = Field(default=int(os.getenv(
+        "EMBEDDING_POOL_THREADS", 0)), ge=0, description="每个子进程的算子内线程数，0 表示平分 CPU 核心")
+    min_shard_size: int = Field(default=int(os.getenv(
+        "EMBEDDING_POOL_MIN_SHARD", 16)), ge=1, description="拆分到多个子进程时每份的最少文本条数")
+
+
+# 子进程持有的嵌入模型
+_worker_embedding: Optional["Embedding"] = None
+
+
+def _init_worker(model_path: str, backend: dict, limits: dict, threads: int) -> None:
+    """子进程初始化：固定线程数并加载模型"""
+    global _worker_embedding
+    # 须在导入 torch / onnxruntime 之前设置，避免每个子进程都按全部核心开线程
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(threads)
+
+    from app.core.embedding import Embedding, EmbeddingBackendConfig, EmbeddingLimitsConfig
+    _worker_embedding = Embedding(
+        model_path,
+        limits=EmbeddingLimitsConfig(**limits),
+        backend=EmbeddingBackendConfig(**{**backend, "num_threads": threads}),
+        pool=EmbeddingPoolConfig(num_workers=0))
+
+
+def _worker_dimension() -> int:
+    """执行一次推理，完成预热并返回向量维度"""
+    return int(_worker_embedding.encode(["预热"]).shape[1])
+
+
+def _worker_count_tokens(texts: List[str]) -> List[int]:
+    return _worker_embedding.count_tokens(texts)
+
+
+def _worker_encode(input_name: str, output_name: str, count: int, dim: int,
+                   indices: List[int], normalize_embeddings: bool,
+                   lengths: Optional[List[int]] = None) -> None:
+    """从共享内存读取指定下标的文本，编码后写回输出矩阵的对应行"""
+    source = shared_memory.SharedMemory(name=input_name)
+    target = shared_memory.SharedMemory(name=output_name)
+    try:
+        texts = _unpack_texts(source.buf, count, indices)
+        vectors = _worker_embedding.encode(texts, normalize_embeddings=normalize_embeddings, lengths=lengths)
+        output = np.ndarray((count, dim), dtype=np.float32, buffer=target.buf)
+        try:
+            output[indices] = vectors
+        finally:
+            # 关闭共享内存前须释放所有引用其缓冲区的数组；写入失败时同样释放，
+            # 否则 close() 抛出的 BufferError 会掩盖真正的错误
+            del output
+    finally:
+        source.close()
+        target.close()
+
+
+def _pack_texts(texts: List[str]) -> shared_memory.SharedMemory:
+    """
+    把文本写入一块共享内存
+
+    布局：(n + 1) 个 int64 偏移量，随后是所有文本的 UTF-8 字节。
+    """
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    header = offsets.nbytes
+    segment = shared_memory.SharedMemory(create=True, size=max(1, header + int(offsets[-1])))
+    segment.buf[:header] = offsets.tobytes()
+    segment.buf[header:header + int(offsets[-1])] = b"".join(encoded)
+    return segment
+
+
+def _unpack_texts(buffer: memoryview, count: int, indices: List[int]) -> List[str]:
+    """从共享内存中解码指定下标的文本"""
+    offsets = np.ndarray((count + 1,), dtype=np.int64, buffer=buffer)
+    data = np.ndarray((len(buffer),), dtype=np.uint8, buffer=buffer)
+    header = offsets.nbytes
+    texts = [data[header + offsets[i]:header + offsets[i + 1]].tobytes().decode("utf-8")
+             for i in indices]
+    del offsets, data
+    return texts
+
+
+def _release(segment: shared_memory.SharedMemory) -> None:
+    """结果数组被回收后关闭并删除共享内存"""
+    segment.close()
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class EmbeddingProcessPool:
+    """
+    多进程嵌入推理池
+
+    启动 K 个子进程，每个子进程持有一份模型并固定算子线程数，使单个服务进程能用满所有 CPU 核心。
+    一次编码的文本打包进共享内存，按长度交错拆分给多个子进程并行编码，
+    各子进程把结果直接写入同一块共享内存中的输出矩阵；返回的数组直接映射这块内存，不再复制，
+    数组（及其所有切片）被回收时自动释放共享内存。
+    """
+
+    def __init__(self, model_path: str, backend: "EmbeddingBackendConfig",
+                 limits: "EmbeddingLimitsConfig", config: Optional[EmbeddingPoolConfig] = None):
+        """
+        Args:
+            model_path: 模型路径
+            backend: 推理后端配置
+            limits: 分桶编码配置
+            config: 推理池配置，默认从环境变量读取
+        """
+        self.model_path = model_path
+        self.backend = backend
+        self.limits = limits
+        self.config = config or EmbeddingPoolConfig()
+        self.num_workers = max(1, self.config.num_workers)
+        self.threads_per_worker = (self.config.threads_per_worker
+                                   or max(1, (os.cpu_count() or 1) // self.num_workers))
+        self.dim: Optional[int] = None
+        self.completed = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """启动子进程并等待模型全部加载完成，加载失败时在此处抛出"""
+        logger.info(f"正在启动嵌入推理池: {self.num_workers} 个进程, "
+                    f"每个进程 {self.threads_per_worker} 个线程")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_path, self.backend.model_dump(), self.limits.model_dump(),
+                      self.threads_per_worker))
+        # 同时提交 K 个任务，促使进程池立即拉起全部子进程并各自完成预热
+        futures = [self._executor.submit(_worker_dimension) for _ in range(self.num_workers)]
+        self.dim = futures[0].result()
+        for future in futures[1:]:
+            future.result()
+        logger.info("嵌入推理池启动成功！")
+
+    def stop(self) -> None:
+        """关闭子进程"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """在子进程中统计 token 数，主进程不加载分词器与模型"""
+        if not texts:
+            return []
+        return self._executor.submit(_worker_count_tokens, texts).result()
+
+    def _shard(self, texts: List[str], lengths: Optional[Sequence[int]] = None) -> List[List[int]]:
+        """按长度（已知 token 数时按 token 数，否则按字符数）排序后交错拆分，使各子进程分到的长短文本比例相近"""
+        shards = min(self.num_workers, max(1, len(texts) // self.config.min_shard_size))
+        sizes = lengths if lengths is not None else [len(text) for text in texts]
+        ordered = sorted(range(len(texts)), key=lambda i: sizes[i])
+        return [ordered[k::shards] for k in range(shards)]
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True,
+               lengths: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        并行编码
+
+        Args:
+            texts: 文本列表
+            normalize_embeddings: 是否对向量做 L2 归一化
+            lengths: 已统计的每条文本的 token 数，随分片传给子进程，子进程不再重复分词
+
+        Returns:
+            与 texts 一一对应的 (n, dim) float32 矩阵，内存位于共享内存中
+        """
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if self._executor is None:
+            raise RuntimeError("嵌入推理池未启动")
+
+        count = len(texts)
+        source = _pack_texts(texts)
+        target = shared_memory.SharedMemory(create=True, size=count * self.dim * 4)
+        try:
+            futures = [
+                self._executor.submit(_worker_encode, source.name, target.name, count,
+                                      self.dim, indices, normalize_embeddings,
+                                      [lengths[i] for i in indices] if lengths is not None else None)
+                for indices in self._shard(texts, lengths)
+            ]
+            # 等全部分片结束（或任一失败）后再处理共享内存，避免子进程仍在读写
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+            wait(pending)
+            for future in done:
+                future.result()
+        except BaseException:
+            _release(target)
+            raise
+        finally:
+            _release(source)
+
+        result = np.ndarray((count, self.dim), dtype=np.float32, buffer=target.buf)
+        weakref.finalize(result, _release, target)
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def stats(self) -> dict:
+        """获取推理池状态"""
+        return {
+            "model_path": self.model_path,
+            "backend": self.backend.backend,
+            "num_workers": self.num_workers,
+            "threads_per_worker": self.threads_per_worker,
+            "dim": self.dim,
+            "completed": self.completed,
+            "running": self._executor is not None,
+        }
@@ -1,11 +1,24 @@
 import os
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import httpx
 from dotenv import load_dotenv, find_dotenv
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 from typing import Iterator, Any, Callable, Optional
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, List, Dict, Literal, Optional, Tuple
+from concurrent.futures import Future
+
+if TYPE_CHECKING:
+    import numpy as np
+    from langchain_openai import ChatOpenAI
+    from app.core.rag import KnowledgeRetriever
+    from app.core.semantic_cache import SemanticCache
 load_dotenv(find_dotenv(), override=True)
 
 
@@ -30,30 +43,196 @@ class LLMConfig(BaseModel):
     }, description="额外请求体")
 
 
-llm = ChatOpenAI(
-    model=os.getenv('MODEL_NAME'),
-    openai_api_base=os.getenv('MODEL_BASE_URL'),
-    openai_api_key=os.getenv('MODEL_KEY'),
-    temperature=os.getenv('MODEL_TEMPERATURE'),
-    max_tokens=os.getenv('MODEL_MAX_TOKEN'),
-    presence_penalty=os.getenv('MODEL_PRESENCE_PENALTY'),
-    top_p=os.getenv('MODEL_TOP_P'),
-    extra_body={
-        "top_k": os.getenv('MODEL_TOP_K'),
-        "chat_template_kwargs": {"enable_thinking": os.getenv('MODEL_IS_THINK')},
-    },
-
-)
+class LLMHttpConfig(BaseModel):
+    """模型服务 HTTP 连接池配置类"""
+    max_connections: int = Field(default=int(os.getenv(
+        "MODEL_MAX_CONNECTIONS", 64)), ge=1, description="到模型服务的最大并发连接数")
+    max_keepalive_connections: int = Field(default=int(os.getenv(
+        "MODEL_MAX_KEEPALIVE_CONNECTIONS", 32)), ge=0, description="保持空闲的长连接数量")
+    keepalive_expiry: float = Field(default=float(os.getenv(
+        "MODEL_KEEPALIVE_EXPIRY", 60)), ge=0, description="空闲长连接的保留时间（秒）")
+    connect_timeout: float = Field(default=float(os.getenv(
+        "MODEL_CONNECT_TIMEOUT", 5)), gt=0, description="建立连接的超时时间（秒）")
+    read_timeout: float = Field(default=float(os.getenv(
+        "MODEL_READ_TIMEOUT", 120)), gt=0, description="两次读取之间的超时时间（秒），流式输出时按片段计算")
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout,
+                             pool=self.read_timeout)
+
+
+llm_http_config = LLMHttpConfig()
+
+
+@lru_cache(maxsize=1)
+def get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    获取所有会话共享的连接池，首次调用时创建
+    复用到模型服务的长连接，省去每轮对话的建连开销，并限制并发连接数
+    """
+    return (httpx.Client(limits=llm_http_config.limits(), timeout=llm_http_config.timeout()),
+            httpx.AsyncClient(limits=llm_http_config.limits(), timeout=llm_http_config.timeout()))
+
+
+async def close_http_clients() -> None:
+    """关闭共享连接池（应用退出时调用），从未创建过时什么也不做"""
+    if get_http_clients.cache_info().currsize == 0:
+        return
+    http_client, http_async_client = get_http_clients()
+    # 模型与其调用链持有这两个连接池，一并丢弃，之后再使用时重新创建
+    get_llm.cache_clear()
+    clear_chains()
+    get_http_clients.cache_clear()
+    await http_async_client.aclose()
+    await asyncio.to_thread(http_client.close)
+
+
+@lru_cache(maxsize=1)
+def get_llm() -> "ChatOpenAI":
+    """获取共享的对话模型，首次调用时导入 langchain_openai 并创建，导入本模块不会创建模型与连接池"""
+    from langchain_openai import ChatOpenAI
+    http_client, http_async_client = get_http_clients()
+    return ChatOpenAI(
+        model=os.getenv('MODEL_NAME'),
+        openai_api_base=os.getenv('MODEL_BASE_URL'),
+        openai_api_key=os.getenv('MODEL_KEY'),
+        temperature=os.getenv('MODEL_TEMPERATURE'),
+        max_tokens=os.getenv('MODEL_MAX_TOKEN'),
+        presence_penalty=os.getenv('MODEL_PRESENCE_PENALTY'),
+        top_p=os.getenv('MODEL_TOP_P'),
+        extra_body={
+            "top_k": os.getenv('MODEL_TOP_K'),
+            "chat_template_kwargs": {"enable_thinking": os.getenv('MODEL_IS_THINK')},
+        },
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+
+def __getattr__(name: str) -> Any:
+    # 兼容 from app.core.llm import llm 的旧用法，访问时才创建模型
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class HistoryPolicyConfig(BaseModel):
+    """
+    对话历史策略配置类
+
+    历史超过 max_tokens 时，把最早的若干轮压缩到 max_tokens * compact_ratio 以内：
+    summarize 策略把移出的轮次合并进一段累积摘要，trim 策略直接丢弃，
+    因此每轮发送给模型的提示词长度不随问诊轮数增长。
+    """
+    max_tokens: int = Field(default=int(os.getenv(
+        "CONSULTATION_HISTORY_MAX_TOKENS", 3072)), ge=1, description="发送给模型的对话历史 token 上限")
+    strategy: Literal["summarize", "trim"] = Field(default=os.getenv(
+        "CONSULTATION_HISTORY_STRATEGY", "summarize"), description="历史超限时的处理方式")
+    keep_rounds: int = Field(default=int(os.getenv(
+        "CONSULTATION_HISTORY_KEEP_ROUNDS", 2)), ge=1, description="始终原样保留的最近轮数")
+    compact_ratio: float = Field(default=0.5, gt=0.0, le=1.0,
+                                 description="压缩后历史占上限的比例，留出余量避免每轮都压缩")
+    summary_max_tokens: int = Field(default=int(os.getenv(
+        "CONSULTATION_SUMMARY_MAX_TOKENS", 512)), ge=1, description="摘要的最大 token 数")
+
+
+# 生成问诊摘要的提示词
+SUMMARY_PROMPT = """请把以下中医问诊记录整理为一段简洁的摘要，供医生继续问诊时参考。
+保留患者已回答的症状、病史、生活习惯等要点以及医生已给出的判断和建议，省略寒暄与重复内容，不要添加记录中没有的信息。"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的 token 数：中日韩字符按每字 1 个计算，其余字符按每 4 个 1 个计算"""
+    cjk = sum(1 for char in text if "\u2e80" <= char <= "\u9fff" or "\uf900" <= char <= "\uffef")
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+# 对话模板：系统提示词作为第一条消息随历史一起传入，模板本身与患者无关，只需编译一次
+CHAT_TEMPLATE = ChatPromptTemplate.from_messages([MessagesPlaceholder(variable_name="messages")])
+
+# id(模型) -> 已编译的 CHAT_TEMPLATE | llm 调用链，所有会话共享，按最近使用顺序淘汰
+# ChatOpenAI 不可哈希，无法使用 WeakKeyDictionary；调用链本身持有模型，条目存在期间 id 不会被复用
+_chains: "OrderedDict[int, Any]" = OrderedDict()
+_chains_lock = threading.Lock()
+# 同时保留的调用链数量，通常只有 get_llm() 返回的一个模型
+_CHAINS_MAX_SIZE = 8
+
+
+def get_chain(llm):
+    """获取（必要时编译）指定模型的调用链"""
+    with _chains_lock:
+        chain = _chains.get(id(llm))
+        if chain is None:
+            chain = CHAT_TEMPLATE | llm
+            _chains[id(llm)] = chain
+            while len(_chains) > _CHAINS_MAX_SIZE:
+                _chains.popitem(last=False)
+        else:
+            _chains.move_to_end(id(llm))
+        return chain
+
+
+def clear_chains() -> None:
+    """丢弃所有已编译的调用链及其持有的模型"""
+    with _chains_lock:
+        _chains.clear()
+
+
+@lru_cache(maxsize=32)
+def compile_prompt_template(system_prompt: str) -> PromptTemplate:
+    """解析系统提示词模板，相同模板只解析一次"""
+    return PromptTemplate.from_template(system_prompt)
+
+
+@lru_cache(maxsize=4096)
+def render_system_prompt(system_prompt: str, patient_items: Tuple[Tuple[str, str], ...]) -> str:
+    """
+    用患者信息填充系统提示词
+
+    相同模板与患者信息得到逐字节相同的结果，请求之间重建会话时无需重新格式化，
+    模型服务也能对其复用前缀缓存。
+    """
+    return compile_prompt_template(system_prompt).format(**dict(patient_items))
 
 
 class MedicalConsultation:
-    def __init__(self, llm, system_prompt):
-        """"""
+    def __init__(self, llm, system_prompt, history_policy: Optional[HistoryPolicyConfig] = None,
+                 token_counter: Optional[Callable[[str], int]] = None,
+                 knowledge: Optional["KnowledgeRetriever"] = None,
+                 semantic_cache: Optional["SemanticCache"] = None):
+        """
+        Args:
+            llm: 对话模型
+            system_prompt: 系统提示词模板，包含患者信息字段
+            history_policy: 对话历史策略，默认从环境变量读取
+            token_counter: 统计文本 token 数的函数，默认使用 estimate_tokens
+            knowledge: 知识库检索器，为空时不检索（非 RAG 模式）
+            semantic_cache: 回复语义缓存，为空时不使用
+        """
         self.llm = llm
-        self.prompt_template = PromptTemplate.from_template(system_prompt)
+        self.system_prompt = system_prompt
+        self.prompt_template = compile_prompt_template(system_prompt)
+        self.history_policy = history_policy or HistoryPolicyConfig()
+        self.token_counter = token_counter or estimate_tokens
         self.messages = []
         self.patient_info = None
         self.round_count = 0
+        # 已压缩的早期对话摘要，以及被压缩的轮数
+        self.summary = ""
+        self.summarized_rounds = 0
+        # 已格式化的系统消息，患者信息变化时失效
+        self._system_message: Optional[SystemMessage] = None
+        self.knowledge = knowledge
+        # 患者信息对应的预取检索任务
+        self._patient_retrieval: Optional[Future] = None
+        self.semantic_cache = semantic_cache
+        # 最近一轮的耗时：语义缓存、检索与模型分开统计
+        self.last_timings: Dict[str, Any] = {}
 
     def set_patient_info(self, disease: str, name: str, age: str, sex: str,
                          tongue: str = "未查", face: str = "未查",
@@ -81,19 +260,112 @@ class MedicalConsultation:
             "leftPulse": left_pulse,
             "rightPulse": right_pulse
         }
+        self._system_message = None
+        self._prefetch_patient_context()
         return self
 
+    def _prefetch_patient_context(self) -> None:
+        """RAG 模式下立即在后台检索患者信息相关的知识，与患者输入消息的时间重叠"""
+        self._patient_retrieval = None
+        if self.knowledge is not None and self.patient_info:
+            query = self.knowledge.patient_query(self.patient_info)
+            if query:
+                self._patient_retrieval = self.knowledge.prefetch(query)
+
     def _format_system_prompt(self) -> str:
         """格式化系统提示词"""
         if not self.patient_info:
             raise ValueError("请先使用 set_patient_info() 设置患者信息")
 
-        return self.prompt_template.format(**self.patient_info)
+        # 去掉首尾空白，避免同一患者信息因输入差异产生不同的提示词
+        patient_items = tuple((key, str(value).strip()) for key, value in self.patient_info.items())
+        return render_system_prompt(self.system_prompt, patient_items)
+
+    def _get_system_message(self) -> SystemMessage:
+        """获取系统消息，只在患者信息变化后重新格式化"""
+        if self._system_message is None:
+            self._system_message = SystemMessage(content=self._format_system_prompt())
+        return self._system_message
+
+    def _prompt_messages(self, context: str = "") -> List:
+        """
+        生成本轮发送给模型的完整消息
+
+        顺序固定为 系统提示词、历史摘要、对话历史，越稳定的内容越靠前，
+        使模型服务的前缀缓存在多轮之间（以及相同模板的不同患者之间）尽量命中。
+        每轮变化的参考资料放在最后一条患者消息之前，不影响前面的缓存，也不写入历史。
+        """
+        messages = [self._get_system_message()] + self._history_messages()
+        if context:
+            messages.insert(len(messages) - 1, SystemMessage(
+                content=f"参考资料（来自知识库，仅供参考，与患者情况不符时忽略）：\n{context}"))
+        return messages
+
+    def _cache_lookup(self, user_message: str) -> Tuple[Optional[str], Optional[Tuple[str, "np.ndarray"]]]:
+        """
+        在语义缓存中查找本轮回复
+
+        只在前 max_round 轮、历史尚未被压缩时使用缓存。
+        Returns:
+            (缓存的回复, 写入缓存所需的 (命名空间, 向量))；本轮不使用缓存时均为 None
+        """
+        cache = self.semantic_cache
+        if cache is None or self.round_count > cache.config.max_round or self.summarized_rounds:
+            return None, None
+        # 本轮患者消息已加入历史，匹配文本中的历史不含本轮
+        history = [(item["role"], item["content"]) for item in self.get_conversation_history()[:-1]]
+        namespace = cache.namespace(self.system_prompt, self.patient_info)
+        try:
+            vector = cache.embed(cache.cache_text(history, user_message))
+            return cache.lookup(namespace, vector), (namespace, vector)
+        except Exception as e:
+            print(f"语义缓存查询失败: {e}")
+            return None, None
+
+    def _cache_store(self, slot: Optional[Tuple[str, "np.ndarray"]], reply: str) -> None:
+        """把模型生成的完整回复写入语义缓存"""
+        if slot is None or not reply:
+            return
+        # 回复中出现患者姓名、具体年龄或证件号码等身份信息时不缓存，避免返回给其他患者
+        from app.core.semantic_cache import contains_identifiers
+        if contains_identifiers(reply, self.patient_info):
+            return
+        self.semantic_cache.store(slot[0], slot[1], reply)
+
+    def _retrieve_context(self, user_message: str) -> str:
+        """同步检索本轮参考资料，检索失败时不使用参考资料"""
+        if self.knowledge is None:
+            return ""
+        try:
+            results = [self.knowledge.retrieve(self.knowledge.turn_query(self.patient_info, user_message))]
+            if self._patient_retrieval is not None:
+                results.append(self._patient_retrieval.result())
+            return self.knowledge.build_context(results, self.token_counter)
+        except Exception as e:
+            print(f"知识库检索失败: {e}")
+            return ""
+
+    async def _aretrieve_context(self, user_message: str) -> str:
+        """异步检索本轮参考资料：本轮消息的检索与预取的患者信息检索并行等待"""
+        if self.knowledge is None:
+            return ""
+        try:
+            tasks = [self.knowledge.aretrieve(self.knowledge.turn_query(self.patient_info, user_message))]
+            if self._patient_retrieval is not None:
+                # 预取任务由所有相同检索文本的会话共享，本轮被取消（客户端断开）时不能连带取消它
+                tasks.append(asyncio.shield(asyncio.wrap_future(self._patient_retrieval)))
+            results = await asyncio.gather(*tasks)
+            return self.knowledge.build_context(list(results), self.token_counter)
+        except Exception as e:
+            print(f"知识库检索失败: {e}")
+            return ""
 
     def reset(self):
         """重置对话（开始新的问诊）"""
         self.messages = []
         self.round_count = 0
+        self.summary = ""
+        self.summarized_rounds = 0
         return self
 
     def get_status(self) -> Dict:
@@ -101,9 +373,115 @@ class MedicalConsultation:
         return {
             "patient": self.patient_info.get("name") if self.patient_info else None,
             "round": self.round_count,
-            "message_count": len(self.messages)
+            "message_count": len(self.messages),
+            "summarized_rounds": self.summarized_rounds,
+            "history_tokens": self._count_tokens(self._history_messages()),
         }
 
+    def to_state(self) -> Dict:
+        """导出会话状态（可 JSON 序列化），用于保存到会话存储"""
+        return {
+            "patient_info": self.patient_info,
+            "messages": self.get_conversation_history(),
+            "round_count": self.round_count,
+            "summary": self.summary,
+            "summarized_rounds": self.summarized_rounds,
+        }
+
+    def load_state(self, state: Dict):
+        """从 to_state() 导出的状态恢复会话"""
+        self.patient_info = state.get("patient_info")
+        self._system_message = None
+        # 相同患者信息的检索结果已被检索器缓存，这里不会重复检索
+        self._prefetch_patient_context()
+        self.messages = [HumanMessage(content=item["content"]) if item["role"] == "user"
+                         else AIMessage(content=item["content"]) for item in state.get("messages", [])]
+        self.round_count = state.get("round_count", 0)
+        self.summary = state.get("summary", "")
+        self.summarized_rounds = state.get("summarized_rounds", 0)
+        return self
+
+    def _count_tokens(self, messages: List) -> int:
+        return sum(self.token_counter(message.content) for message in messages)
+
+    def _history_messages(self) -> List:
+        """
+        生成发送给模型的历史消息：摘要（如有）放在系统提示词之后、对话之前
+
+        尚未压缩时若历史仍超过上限（如单轮内容过长），从最早的轮次开始跳过，
+        至少保留最后一条消息，保证提示词长度有界。
+        """
+        messages = list(self.messages)
+        budget = self.history_policy.max_tokens
+        while len(messages) > 1 and self._count_tokens(messages) > budget:
+            messages = messages[2:] if len(messages) > 2 else messages[1:]
+        if self.summary:
+            messages.insert(0, SystemMessage(content=f"此前问诊摘要：\n{self.summary}"))
+        return messages
+
+    def _split_for_compaction(self) -> Tuple[List, List]:
+        """历史超过上限时，按整轮从最早处切出需要压缩的消息，返回 (移出的消息, 保留的消息)"""
+        policy = self.history_policy
+        if self._count_tokens(self.messages) <= policy.max_tokens:
+            return [], self.messages
+        target = policy.max_tokens * policy.compact_ratio
+        # 每轮为一问一答两条消息，最近 keep_rounds 轮不压缩
+        limit = max(0, len(self.messages) - policy.keep_rounds * 2)
+        cut = 0
+        while cut < limit and self._count_tokens(self.messages[cut:]) > target:
+            cut += 2
+        cut = min(cut, limit)
+        return self.messages[:cut], self.messages[cut:]
+
+    def _summary_input(self, evicted: List) -> List:
+        lines = [f"已有摘要：{self.summary}"] if self.summary else []
+        for message in evicted:
+            role = "患者" if isinstance(message, HumanMessage) else "医生"
+            lines.append(f"{role}：{message.content}")
+        return [SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content="\n".join(lines))]
+
+    def _apply_compaction(self, evicted: List, kept: List, summary: Optional[str]) -> None:
+        self.messages = list(kept)
+        self.summarized_rounds += len(evicted) // 2
+        if summary is not None:
+            self.summary = summary
+
+    def compact(self) -> bool:
+        """
+        历史超过上限时压缩最早的轮次，应在一轮回复结束后调用，不占用下一轮的首字延迟
+
+        Returns:
+            是否进行了压缩
+        """
+        evicted, kept = self._split_for_compaction()
+        if not evicted:
+            return False
+        summary = None
+        if self.history_policy.strategy == "summarize":
+            try:
+                summarizer = self.llm.bind(max_tokens=self.history_policy.summary_max_tokens)
+                summary = summarizer.invoke(self._summary_input(evicted)).content
+            except Exception as e:
+                # 摘要失败时退化为直接丢弃，保证提示词长度有界
+                print(f"对话摘要失败: {e}")
+        self._apply_compaction(evicted, kept, summary)
+        return True
+
+    async def acompact(self) -> bool:
+        """compact() 的异步版本"""
+        evicted, kept = self._split_for_compaction()
+        if not evicted:
+            return False
+        summary = None
+        if self.history_policy.strategy == "summarize":
+            try:
+                summarizer = self.llm.bind(max_tokens=self.history_policy.summary_max_tokens)
+                summary = (await summarizer.ainvoke(self._summary_input(evicted))).content
+            except Exception as e:
+                print(f"对话摘要失败: {e}")
+        self._apply_compaction(evicted, kept, summary)
+        return True
+
     def get_conversation_history(self) -> List[Dict[str, str]]:
         """
         获取格式化的对话历史
@@ -134,24 +512,40 @@ class MedicalConsultation:
         self.messages.append(HumanMessage(content=f'{user_message}'))
         self.round_count += 1
 
-        chat_template = ChatPromptTemplate.from_messages([
-            SystemMessage(content=self._format_system_prompt()),
-            MessagesPlaceholder(variable_name="history")
-        ])
+        # 未设置患者信息时在此处抛出，不当作模型调用失败
+        self._get_system_message()
+
+        started = time.perf_counter()
+        cached, cache_slot = self._cache_lookup(user_message)
+        looked_up = time.perf_counter()
+        self.last_timings = {"cache_hit": cached is not None,
+                             "cache_seconds": round(looked_up - started, 4)}
+        if cached is not None:
+            self.messages.append(AIMessage(content=cached))
+            return cached
+
+        context = self._retrieve_context(user_message)
+        retrieved = time.perf_counter()
+        self.last_timings["retrieval_seconds"] = round(retrieved - looked_up, 4)
+        messages = self._prompt_messages(context)
 
         # 调用模型
         try:
-            chain = chat_template | self.llm
-            response = chain.invoke({"history": self.messages})
+            response = get_chain(self.llm).invoke({"messages": messages})
+            self.last_timings["llm_seconds"] = round(time.perf_counter() - retrieved, 4)
 
         except Exception as e:
             print(f"模型调用失败: {e}")
-            return "抱歉，模型暂时无法响应。"
+            # 与 stream 一致写入历史，保持一问一答交替
+            error_msg = "抱歉，模型暂时无法响应。"
+            self.messages.append(AIMessage(content=error_msg))
+            return error_msg
 
         content = response.content if hasattr(response, 'content') else ""
         response = AIMessage(content)
 
         self.messages.append(response)
+        self._cache_store(cache_slot, response.content)
 
         # 返回字符串内容
         return response.content
@@ -170,29 +564,55 @@ class MedicalConsultation:
         self.messages.append(HumanMessage(content=f'{user_message}'))
         self.round_count += 1
 
-        # 创建聊天模板
-        chat_template = ChatPromptTemplate.from_messages([
-            SystemMessage(content=self._format_system_prompt()),
-            MessagesPlaceholder(variable_name="history")
-        ])
+        self._get_system_message()
 
-        # 调用模型（流式）
+        # 从缓存查询开始都放在 try 中：任何一步被取消（客户端断开），历史中都补上本轮的回复，保持一问一答交替
+        full_response = ""
         try:
-            chain = chat_template | self.llm
-            full_response = ""
-
-            # 流式输出
-            async for chunk in chain.astream({"history": self.messages}):
+            started = time.perf_counter()
+            # 编码为 CPU 计算，放入线程中执行
+            cached, cache_slot = await asyncio.to_thread(self._cache_lookup, user_message)
+            looked_up = time.perf_counter()
+            self.last_timings = {"cache_hit": cached is not None,
+                                 "cache_seconds": round(looked_up - started, 4)}
+            if cached is not None:
+                # 命中时整段回复作为一个片段返回
+                self.messages.append(AIMessage(content=cached))
+                yield cached
+                return
+
+            context = await self._aretrieve_context(user_message)
+            retrieved = time.perf_counter()
+            self.last_timings["retrieval_seconds"] = round(retrieved - looked_up, 4)
+            messages = self._prompt_messages(context)
+
+            # 调用模型（流式）
+            async for chunk in get_chain(self.llm).astream({"messages": messages}):
                 if hasattr(chunk, 'content'):
                     content = chunk.content
                     if content:
+                        if not full_response:
+                            self.last_timings["llm_first_token_seconds"] = round(
+                                time.perf_counter() - retrieved, 4)
                         full_response += content
                         yield content
+            self.last_timings["llm_seconds"] = round(time.perf_counter() - retrieved, 4)
 
             # 添加完整回复到历史
             self.messages.append(AIMessage(content=full_response))
+            self._cache_store(cache_slot, full_response)
+
+        except (GeneratorExit, asyncio.CancelledError):
+            # 客户端中途断开：保留已生成的部分回复（可能为空）；缓存命中的回复已写入历史时不再重复写入
+            if isinstance(self.messages[-1], HumanMessage):
+                self.messages.append(AIMessage(content=full_response))
+            raise
 
         except Exception as e:
+            print(f"模型调用失败: {e}")
+            if not isinstance(self.messages[-1], HumanMessage):
+                # 回复已写入历史，只是写入缓存失败
+                return
             error_msg = "抱歉，模型暂时无法响应。"
             self.messages.append(AIMessage(content=error_msg))
             yield error_msg
@@ -0,0 +1,144 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Literal, Optional
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field, model_validator
+from app.vectorstores.config import VectorStoreBase
+
+load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
+
+
+class RAGConfig(BaseModel):
+    """问诊知识库检索配置类"""
+    enabled: bool = Field(default=os.getenv(
+        "CONSULTATION_RAG_ENABLED", "False").lower() == "true", description="是否在问诊时检索知识库")
+    store: Literal["chroma", "milvus"] = Field(default=os.getenv(
+        "CONSULTATION_RAG_STORE", "chroma"), description="向量库类型")
+    db_path: Optional[str] = Field(default=os.getenv(
+        "CONSULTATION_RAG_DB_PATH") or None, description="Chroma 持久化目录或 Milvus URI")
+    collection_name: Optional[str] = Field(default=os.getenv(
+        "CONSULTATION_RAG_COLLECTION") or None, description="集合名称")
+    k: int = Field(default=int(os.getenv(
+        "CONSULTATION_RAG_K", 4)), ge=1, description="每次检索返回的片段数")
+    max_tokens: int = Field(default=int(os.getenv(
+        "CONSULTATION_RAG_MAX_TOKENS", 1024)), ge=1, description="注入提示词的参考资料 token 上限")
+    prefetch_cache_size: int = Field(default=256, ge=1, description="缓存的患者信息检索结果数量")
+
+    @model_validator(mode="after")
+    def check_store(self) -> "RAGConfig":
+        """开启时必须指定向量库位置与集合名称（.env 中的空字符串视为未设置）"""
+        if self.enabled:
+            missing = [name for name, value in (("CONSULTATION_RAG_DB_PATH", self.db_path),
+                                                ("CONSULTATION_RAG_COLLECTION", self.collection_name)) if not value]
+            if missing:
+                raise ValueError(f"开启知识库检索时必须设置 {', '.join(missing)}")
+        return self
+
+
+def create_knowledge_store(config: RAGConfig) -> VectorStoreBase:
+    """按配置创建向量库实例（按需导入对应后端）"""
+    if config.store == "milvus":
+        from app.vectorstores.vs_Milvus import VSMilvus, VSMilvusConfig
+        return VSMilvus(VSMilvusConfig(db_path=config.db_path, collection_name=config.collection_name))
+    from app.vectorstores.vs_chroma import VSChroma, VSChromaConfig
+    return VSChroma(VSChromaConfig(db_path=config.db_path, collection_name=config.collection_name))
+
+
+class KnowledgeRetriever:
+    """
+    问诊知识库检索
+
+    患者信息对应的检索在 set_patient_info 时即提交到向量库线程池，与患者输入第一条消息的时间重叠；
+    结果按查询文本缓存，按会话存储重建会话时直接复用。每轮再按患者消息检索一次，
+    两部分结果去重后在 token 上限内拼接为参考资料。
+    """
+
+    def __init__(self, vector_store: VectorStoreBase, config: RAGConfig):
+        self.vector_store = vector_store
+        self.config = config
+        # 查询文本 -> 检索任务，按最近使用顺序淘汰
+        self._prefetched: "OrderedDict[str, Future]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def patient_query(patient_info: Dict) -> str:
+        """由患者信息生成检索文本：主诉与四诊信息，未查的项目不参与检索"""
+        values = [patient_info.get(key, "") for key in ("disease", "tongueFront", "face", "leftPulse", "rightPulse")]
+        return " ".join(str(value).strip() for value in values if value and str(value).strip() != "未查")
+
+    @staticmethod
+    def turn_query(patient_info: Optional[Dict], user_message: str) -> str:
+        """由本轮患者消息生成检索文本，带上主诉，避免"三天了"这类短回答检索不到相关内容"""
+        disease = str((patient_info or {}).get("disease", "")).strip()
+        return f"{disease} {user_message.strip()}".strip()
+
+    def prefetch(self, query: str) -> Future:
+        """提交（或复用）一次后台检索，立即返回"""
+        with self._lock:
+            future = self._prefetched.get(query)
+            # 已失败或已被取消的检索不再复用，重新提交
+            if future is not None and not (future.done() and (future.cancelled() or future.exception() is not None)):
+                self._prefetched.move_to_end(query)
+                return future
+            future = self.vector_store.get_executor().submit(
+                self.vector_store.query_with_score, query, self.config.k)
+            self._prefetched[query] = future
+            while len(self._prefetched) > self.config.prefetch_cache_size:
+                self._prefetched.popitem(last=False)
+            return future
+
+    def retrieve(self, query: str) -> List[tuple]:
+        return self.vector_store.query_with_score(query, self.config.k)
+
+    async def aretrieve(self, query: str) -> List[tuple]:
+        return await self.vector_store.aquery_with_score(query, self.config.k)
+
+    def build_context(self, results: List[List[tuple]], token_counter: Callable[[str], int]) -> str:
+        """
+        把多组检索结果拼接为参考资料
+
+        各组按传入顺序依次取用，相同内容只保留一次；放不下的片段跳过，继续尝试后面较短的片段。
+        """
+        snippets, seen, used = [], set(), 0
+        for hits in results:
+            for document, _ in hits:
+                content = document.page_content.strip()
+                if not content or content in seen:
+                    continue
+                seen.add(content)
+                tokens = token_counter(content)
+                if used + tokens > self.config.max_tokens:
+                    continue
+                used += tokens
+                snippets.append(content)
+        return "\n\n".join(f"[{i}] {content}" for i, content in enumerate(snippets, 1))
+
+
+_retriever: Optional[KnowledgeRetriever] = None
+_retriever_failed = False
+_retriever_lock = threading.Lock()
+
+
+def get_knowledge_retriever(config: Optional[RAGConfig] = None) -> Optional[KnowledgeRetriever]:
+    """
+    获取共享的知识库检索器，首次调用时创建向量库；未开启时返回 None
+
+    向量库创建失败（路径无效、服务不可达等）时记录错误并返回 None，问诊不使用参考资料继续进行；
+    失败后不再重试，修正配置后需重启服务。
+    """
+    global _retriever, _retriever_failed
+    config = config or RAGConfig()
+    if not config.enabled:
+        return None
+    with _retriever_lock:
+        if _retriever is None and not _retriever_failed:
+            try:
+                _retriever = KnowledgeRetriever(create_knowledge_store(config), config)
+            except Exception as e:
+                _retriever_failed = True
+                logger.error(f"知识库向量库创建失败，问诊将不使用知识库检索: {e}")
+        return _retriever
@@ -0,0 +1,232 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field
+from app.core.embedding_cache import normalize_text
+
+load_dotenv(find_dotenv(), override=True)
+
+# 参与命名空间划分的患者信息字段；年龄按年龄段参与（见 age_band），姓名不参与，使不同患者的相同问题可以命中
+NAMESPACE_FIELDS = ("disease", "sex", "age", "tongueFront", "face", "leftPulse", "rightPulse")
+# 年龄段上界（不含）与名称：儿童、青少年、老人的用药与调理建议不同，不能共用回复
+AGE_BANDS = ((1, "婴儿"), (7, "幼儿"), (18, "少年"), (40, "青年"), (60, "中年"))
+# 回复中出现即不缓存的身份信息：手机号、身份证号
+_IDENTIFIER_PATTERN = re.compile(r"(?<!\d)(1[3-9]\d{9}|\d{17}[\dXx]|\d{15})(?!\d)")
+
+
+def age_band(age) -> str:
+    """把年龄归入年龄段；"8个月"等不足一岁的写法归为婴儿，无法解析时保留规范化后的原文"""
+    text = normalize_text(str(age or ""))
+    match = re.search(r"\d+(\.\d+)?", text)
+    if match is None:
+        return text
+    if re.search(r"(个?月|周|天)", text[match.end():]):
+        return AGE_BANDS[0][1]
+    years = float(match.group())
+    for upper, name in AGE_BANDS:
+        if years < upper:
+            return name
+    return "老年"
+
+
+def contains_identifiers(reply: str, patient_info: Optional[Dict]) -> bool:
+    """
+    回复是否包含患者身份信息，包含时不应写入缓存
+
+    检查患者姓名、"30岁""8个月大"形式的具体年龄，以及手机号、身份证号形式的数字串。
+    """
+    info = patient_info or {}
+    name = str(info.get("name", "")).strip()
+    if name and name in reply:
+        return True
+    # 只认带单位的写法，避免把"3天""30分钟"中的数字误判为年龄
+    age = re.search(r"\d+", str(info.get("age", "")))
+    if age and re.search(rf"(?<!\d){age.group()}\s*(周?岁|个?月大)", reply):
+        return True
+    return _IDENTIFIER_PATTERN.search(reply) is not None
+
+
+class SemanticCacheConfig(BaseModel):
+    """问诊语义缓存配置类"""
+    enabled: bool = Field(default=os.getenv(
+        "CONSULTATION_SEMANTIC_CACHE_ENABLED", "False").lower() == "true", description="是否启用语义缓存")
+    threshold: float = Field(default=float(os.getenv(
+        "CONSULTATION_SEMANTIC_CACHE_THRESHOLD", 0.95)), ge=0.0, le=1.0, description="命中所需的最低余弦相似度")
+    max_entries: int = Field(default=int(os.getenv(
+        "CONSULTATION_SEMANTIC_CACHE_MAX_ENTRIES", 4096)), ge=1, description="所有命名空间合计的最大条目数，超出时淘汰最久未使用的条目")
+    ttl_seconds: float = Field(default=float(os.getenv(
+        "CONSULTATION_SEMANTIC_CACHE_TTL_SECONDS", 86400)), gt=0, description="条目的有效期（秒）")
+    max_round: int = Field(default=int(os.getenv(
+        "CONSULTATION_SEMANTIC_CACHE_MAX_ROUND", 2)), ge=1, description="只在前几轮查询与写入缓存，越往后的对话越个性化")
+    history_tail: int = Field(default=2, ge=0, description="参与匹配的最近历史消息条数")
+
+
+@dataclass
+class _Entry:
+    namespace: str
+    vector: np.ndarray
+    reply: str
+    expires_at: float
+    hits: int = 0
+
+
+class _NamespaceIndex:
+    """单个命名空间的向量索引：条目较少，直接用矩阵乘法做精确的最近邻搜索"""
+
+    def __init__(self):
+        self.entry_ids: List[int] = []
+        self.matrix: Optional[np.ndarray] = None
+        self.dirty = False
+
+    def add(self, entry_id: int) -> None:
+        self.entry_ids.append(entry_id)
+        self.dirty = True
+
+    def remove(self, entry_id: int) -> None:
+        self.entry_ids.remove(entry_id)
+        self.dirty = True
+
+    def search(self, vector: np.ndarray, entries: Dict[int, _Entry]) -> Tuple[Optional[int], float]:
+        """返回最相似的条目ID与相似度"""
+        if not self.entry_ids:
+            return None, 0.0
+        if self.dirty or self.matrix is None:
+            # 写入后首次查询时重建矩阵，连续写入只重建一次
+            self.matrix = np.stack([entries[entry_id].vector for entry_id in self.entry_ids])
+            self.dirty = False
+        scores = self.matrix @ vector
+        best = int(np.argmax(scores))
+        return self.entry_ids[best], float(scores[best])
+
+
+class SemanticCache:
+    """
+    问诊回复的语义缓存
+
+    按 系统提示词模板哈希 + 患者临床信息 划分命名空间，在命名空间内以
+    规范化的最近历史与本轮患者消息的向量做最近邻匹配，相似度达到阈值即直接返回缓存的医生回复，
+    省去一次完整的模型生成。条目按 TTL 过期，总数超限时按 LRU 淘汰。
+    """
+
+    def __init__(self, embed_fn: Callable[[List[str]], np.ndarray],
+                 config: Optional[SemanticCacheConfig] = None):
+        """
+        Args:
+            embed_fn: 文本编码函数，返回 L2 归一化的 (n, dim) 向量矩阵
+            config: 缓存配置，默认从环境变量读取
+        """
+        self.embed_fn = embed_fn
+        self.config = config or SemanticCacheConfig()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._indexes: Dict[str, _NamespaceIndex] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.evicted = 0
+        self.expired = 0
+
+    @staticmethod
+    def namespace(system_prompt: str, patient_info: Optional[Dict]) -> str:
+        """生成命名空间：模板哈希 + 影响回复内容的患者临床信息，年龄取年龄段"""
+        template_hash = hashlib.blake2b(system_prompt.encode("utf-8"), digest_size=8).hexdigest()
+        info = patient_info or {}
+        fields = "|".join(
+            age_band(info.get(name)) if name == "age" else normalize_text(str(info.get(name, "")))
+            for name in NAMESPACE_FIELDS)
+        return f"{template_hash}:{fields}"
+
+    def cache_text(self, history: List[Tuple[str, str]], user_message: str) -> str:
+        """生成用于匹配的文本：最近若干条历史与本轮患者消息，均做规范化"""
+        tail = history[-self.config.history_tail:] if self.config.history_tail else []
+        lines = [f"{role}: {normalize_text(content)}" for role, content in tail]
+        lines.append(f"user: {normalize_text(user_message)}")
+        return "\n".join(lines)
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed_fn([text])[0], dtype=np.float32)
+        # 复制一份，避免持有编码结果所在的共享缓冲区
+        return np.array(vector, dtype=np.float32)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        index = self._indexes[entry.namespace]
+        index.remove(entry_id)
+        if not index.entry_ids:
+            del self._indexes[entry.namespace]
+
+    def _purge_expired(self, namespace: str, now: float) -> None:
+        index = self._indexes.get(namespace)
+        if index is None:
+            return
+        for entry_id in [i for i in index.entry_ids if self._entries[i].expires_at <= now]:
+            self._remove(entry_id)
+            self.expired += 1
+
+    def lookup(self, namespace: str, vector: np.ndarray) -> Optional[str]:
+        """查找相似度达到阈值的缓存回复，未命中时返回 None"""
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            self._purge_expired(namespace, now)
+            index = self._indexes.get(namespace)
+            if index is None:
+                return None
+            entry_id, score = index.search(vector, self._entries)
+            if entry_id is None or score < self.config.threshold:
+                return None
+            entry = self._entries[entry_id]
+            entry.hits += 1
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return entry.reply
+
+    def store(self, namespace: str, vector: np.ndarray, reply: str) -> None:
+        """写入一条回复；命名空间内已有几乎相同的条目时只刷新其回复与有效期"""
+        now = time.time()
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is not None:
+                entry_id, score = index.search(vector, self._entries)
+                if entry_id is not None and score >= self.config.threshold:
+                    entry = self._entries[entry_id]
+                    entry.reply = reply
+                    entry.expires_at = now + self.config.ttl_seconds
+                    self._entries.move_to_end(entry_id)
+                    return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(namespace, vector, reply, now + self.config.ttl_seconds)
+            self._indexes.setdefault(namespace, _NamespaceIndex()).add(entry_id)
+            self.stores += 1
+            while len(self._entries) > self.config.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+
+    def stats(self) -> Dict:
+        """获取缓存状态与命中率"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "namespaces": len(self._indexes),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "stores": self.stores,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "threshold": self.config.threshold,
+            }
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Literal, Optional, Tuple
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field
+
+load_dotenv(find_dotenv(), override=True)
+
+
+class SessionStoreConfig(BaseModel):
+    """问诊会话存储配置类"""
+    backend: Literal["memory", "sqlite"] = Field(default=os.getenv(
+        "SESSION_STORE_BACKEND", "memory"), description="存储后端：memory 仅当前进程可见，sqlite 可在多个 worker 间共享")
+    max_sessions: int = Field(default=int(os.getenv(
+        "SESSION_MAX_SESSIONS", 10000)), ge=1, description="最多保留的会话数，超出时淘汰最久未使用的会话")
+    ttl_seconds: float = Field(default=float(os.getenv(
+        "SESSION_TTL_SECONDS", 7200)), gt=0, description="会话闲置超过该时间（秒）后过期")
+    sqlite_path: str = Field(default=os.getenv(
+        "SESSION_SQLITE_PATH", "./.sessions/sessions.db"), description="sqlite 数据库文件路径")
+
+
+class SessionStoreBase(ABC):
+    """会话存储基类，会话状态为可 JSON 序列化的字典"""
+
+    def __init__(self, config: SessionStoreConfig):
+        self.config = config
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict]:
+        """获取会话状态，不存在或已过期时返回 None；读取会刷新会话的过期时间"""
+        pass
+
+    @abstractmethod
+    def put(self, session_id: str, state: Dict) -> None:
+        """保存会话状态"""
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """删除会话，返回会话是否存在"""
+        pass
+
+    @abstractmethod
+    def stats(self) -> Dict:
+        """获取存储状态"""
+        pass
+
+
+class MemorySessionStore(SessionStoreBase):
+    """进程内会话存储：按最近使用顺序淘汰（LRU），闲置超过 TTL 的会话视为过期"""
+
+    def __init__(self, config: SessionStoreConfig):
+        super().__init__(config)
+        # session_id -> (最近使用时间, 状态)，按最近使用顺序排列
+        self._sessions: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def _purge_expired(self, now: float) -> None:
+        # 最久未使用的会话在最前面，遇到未过期的即可停止
+        while self._sessions:
+            session_id, (used_at, _) = next(iter(self._sessions.items()))
+            if now - used_at <= self.config.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            self._sessions[session_id] = (now, item[1])
+            self._sessions.move_to_end(session_id)
+            # 返回副本，调用方修改后须通过 put 保存
+            return json.loads(json.dumps(item[1]))
+
+    def put(self, session_id: str, state: Dict) -> None:
+        now = time.time()
+        snapshot = json.loads(json.dumps(state))
+        with self._lock:
+            self._purge_expired(now)
+            self._sessions[session_id] = (now, snapshot)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.config.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "max_sessions": self.config.max_sessions,
+                "evicted": self.evicted,
+                "expired": self.expired,
+            }
+
+
+class SQLiteSessionStore(SessionStoreBase):
+    """
+    基于 sqlite 文件的会话存储
+
+    多个 uvicorn worker 指向同一个数据库文件即可共享会话，进程重启后会话仍然保留。
+    使用 WAL 模式，读写互不阻塞；过期与超量的会话在写入时定期清理。
+    """
+    # 每写入多少次清理一次过期与超量会话
+    PURGE_INTERVAL = 100
+
+    def __init__(self, config: SessionStoreConfig):
+        super().__init__(config)
+        directory = os.path.dirname(os.path.abspath(config.sqlite_path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(config.sqlite_path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, state TEXT NOT NULL, used_at REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_used_at ON sessions(used_at)")
+            self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, used_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.config.ttl_seconds:
+                self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE sessions SET used_at = ? WHERE id = ?", (now, session_id))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, session_id: str, state: Dict) -> None:
+        payload = json.dumps(state, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (id, state, used_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET state = excluded.state, used_at = excluded.used_at",
+                (session_id, payload, time.time()))
+            self._writes += 1
+            if self._writes % self.PURGE_INTERVAL == 0:
+                self._purge()
+            self._conn.commit()
+
+    def _purge(self) -> None:
+        """删除过期会话，以及超出数量上限的最久未使用会话"""
+        self._conn.execute("DELETE FROM sessions WHERE used_at < ?",
+                           (time.time() - self.config.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM sessions WHERE id IN ("
+            "SELECT id FROM sessions ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.config.max_sessions,))
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "path": self.config.sqlite_path,
+            "sessions": count,
+            "max_sessions": self.config.max_sessions,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(config: Optional[SessionStoreConfig] = None) -> SessionStoreBase:
+    """按配置创建会话存储"""
+    config = config or SessionStoreConfig()
+    if config.backend == "sqlite":
+        return SQLiteSessionStore(config)
+    return MemorySessionStore(config)
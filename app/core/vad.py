@@ -0,0 +1,100 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field
+from app.tools.audio import SAMPLE_RATE, energy_vad, split_segment
+
+load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
+
+VADMode = Literal["none", "energy", "fsmn"]
+
+
+class VADConfig(BaseModel):
+    """语音活动检测配置类"""
+    mode: VADMode = Field(default=os.getenv(
+        "ASR_VAD_MODE", "none"), description="默认检测方式：none 不切分，energy 能量检测，fsmn 使用 fsmn-vad 模型")
+    fsmn_model_path: str = Field(default=os.getenv(
+        "ASR_VAD_MODEL_PATH", "fsmn-vad"), description="fsmn-vad 模型路径或名称")
+    load_fsmn: bool = Field(default=os.getenv(
+        "ASR_VAD_LOAD_FSMN", "False").lower() == "true", description="启动时是否加载 fsmn-vad 模型")
+    max_segment_seconds: float = Field(default=float(os.getenv(
+        "ASR_VAD_MAX_SEGMENT_SECONDS", 30)), gt=0, description="单个语音片段的最大时长（秒）")
+
+
+class SpeechDetector:
+    """
+    语音片段检测器
+
+    energy 方式直接用 NumPy 计算，无需模型；fsmn 方式在独立线程中运行 fsmn-vad 模型。
+    """
+
+    def __init__(self, config: Optional[VADConfig] = None):
+        """
+        Args:
+            config: 检测配置，默认从环境变量读取
+        """
+        self.config = config or VADConfig()
+        self._fsmn_model = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="asr-vad")
+
+    @property
+    def fsmn_ready(self) -> bool:
+        return self._fsmn_model is not None
+
+    async def start(self) -> None:
+        """按配置加载 fsmn-vad 模型"""
+        if not (self.config.load_fsmn or self.config.mode == "fsmn"):
+            return
+        from app.core.asr import _load_model, ASRWorkerPool
+
+        logger.info(f"正在加载语音活动检测模型: {self.config.fsmn_model_path}")
+        loop = asyncio.get_running_loop()
+        self._fsmn_model = await loop.run_in_executor(
+            self._executor, _load_model, self.config.fsmn_model_path,
+            ASRWorkerPool._default_device(), 1)
+        logger.info("语音活动检测模型加载成功！")
+
+    async def stop(self) -> None:
+        self._fsmn_model = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def detect(self, audio: np.ndarray, mode: Optional[VADMode] = None) -> List[Tuple[int, int]]:
+        """
+        检测语音片段
+
+        Args:
+            audio: float32 音频数组（16kHz）
+            mode: 检测方式，默认使用配置中的方式
+
+        Returns:
+            语音片段列表，每项为 (起始采样点, 结束采样点)；none 方式返回整段音频
+        """
+        mode = mode or self.config.mode
+        max_length = int(self.config.max_segment_seconds * SAMPLE_RATE)
+        loop = asyncio.get_running_loop()
+
+        if mode == "energy":
+            return await loop.run_in_executor(
+                self._executor, lambda: energy_vad(
+                    audio, max_segment_seconds=self.config.max_segment_seconds))
+
+        if mode == "fsmn":
+            if self._fsmn_model is None:
+                raise RuntimeError("fsmn-vad 模型未加载，请设置 ASR_VAD_LOAD_FSMN=True")
+            result = await loop.run_in_executor(
+                self._executor, lambda: self._fsmn_model.generate(input=audio))
+            spans = result[0].get("value", []) if result else []
+            segments = []
+            for begin_ms, end_ms in spans:
+                end_ms = len(audio) * 1000 // SAMPLE_RATE if end_ms < 0 else end_ms
+                segments.extend(split_segment(
+                    begin_ms * SAMPLE_RATE // 1000,
+                    min(len(audio), end_ms * SAMPLE_RATE // 1000), max_length))
+            return segments
+
+        return [(0, len(audio))]
@@ -0,0 +1,68 @@
+"""
+批量语音转写命令行工具
+
+用法:
+    python app/tools/asr_batch.py recordings/ > result.jsonl
+    python app/tools/asr_batch.py a.wav b.pcm --batch-size 8 --output result.jsonl
+"""
+import sys
+import json
+import asyncio
+import argparse
+from pathlib import Path
+
+# 将项目根目录添加到 Python 路径中，确保可以导入 app 模块
+project_root = Path(__file__).parent.parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from app.core.asr import ASRWorkerPool, ASRBatchConfig, transcribe_files
+from app.tools.audio import list_audio_files
+
+
+def collect_paths(inputs):
+    """展开输入中的目录，返回去重后的音频文件列表"""
+    paths = []
+    for item in inputs:
+        if Path(item).is_dir():
+            paths.extend(list_audio_files(item))
+        else:
+            paths.append(item)
+    return list(dict.fromkeys(paths))
+
+
+async def run(args) -> int:
+    paths = collect_paths(args.inputs)
+    config = ASRBatchConfig()
+    if args.batch_size:
+        config.max_batch_size = args.batch_size
+
+    pool = ASRWorkerPool()
+    await pool.start()
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    failed = 0
+    try:
+        done = 0
+        async for record in transcribe_files(pool, paths, config):
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            done += 1
+            failed += 0 if record["success"] else 1
+            print(f"[{done}/{len(paths)}] {record['path']}", file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        await pool.stop()
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量转写 16kHz、16bit、单声道的 wav/pcm 录音，结果输出为 JSONL")
+    parser.add_argument("inputs", nargs="+", help="音频文件或目录")
+    parser.add_argument("--batch-size", type=int, default=None, help="单次推理最多包含的录音条数")
+    parser.add_argument("--output", default=None, help="结果文件路径，默认输出到标准输出")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
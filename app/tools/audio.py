@@ -0,0 +1,238 @@
+import os
+import wave
+import numpy as np
+from typing import List, Sequence, Tuple, Union
+
+# 支持的音频采样率与格式：16kHz、16bit、单声道
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+AUDIO_EXTENSIONS = ('.wav', '.pcm')
+
+
+def pcm16_to_float32(raw: Union[bytes, bytearray, memoryview],
+                     out: np.ndarray = None) -> np.ndarray:
+    """
+    将 int16 PCM 字节转换为 [-1, 1) 区间的 float32 数组
+
+    np.frombuffer 直接复用输入缓冲区，缩放结果一次性写入输出数组，不产生中间副本。
+
+    Args:
+        raw: PCM 字节数据
+        out: 可选的输出数组，长度需等于采样点数
+
+    Returns:
+        float32 音频数组
+    """
+    samples = np.frombuffer(raw, dtype=np.int16)
+    if out is None:
+        out = np.empty(len(samples), dtype=np.float32)
+    np.multiply(samples, np.float32(1.0 / 32768.0), out=out, dtype=np.float32)
+    return out
+
+
+def probe_audio(file_path: str) -> int:
+    """
+    获取音频文件的采样点数（只读文件头，不读取音频数据）
+
+    Raises:
+        ValueError: 如果 wav 文件不是 16kHz、16bit、单声道，或扩展名不受支持
+    """
+    _, extension = os.path.splitext(file_path.lower())
+    if extension == '.pcm':
+        return os.path.getsize(file_path) // SAMPLE_WIDTH
+    if extension == '.wav':
+        try:
+            f = wave.open(file_path, 'rb')
+        except (wave.Error, EOFError) as e:
+            raise ValueError(f"无法解析 wav 文件: {file_path} ({e})") from e
+        with f:
+            if (f.getframerate(), f.getsampwidth(), f.getnchannels()) != (SAMPLE_RATE, SAMPLE_WIDTH, 1):
+                raise ValueError(
+                    f"仅支持 16kHz、16bit、单声道 wav: {file_path} "
+                    f"({f.getframerate()}Hz, {f.getsampwidth() * 8}bit, {f.getnchannels()}声道)")
+            return f.getnframes()
+    raise ValueError(f"不支持的音频扩展名: {extension}")
+
+
+def read_pcm16(file_path: str) -> bytes:
+    """读取 wav 或裸 pcm 文件中的 int16 PCM 字节"""
+    _, extension = os.path.splitext(file_path.lower())
+    if extension == '.wav':
+        with wave.open(file_path, 'rb') as f:
+            return f.readframes(f.getnframes())
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def _wav_data_offset(f) -> int:
+    """解析 RIFF 分块，返回 wav 文件中 data 分块的起始偏移"""
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise ValueError("不是有效的 wav 文件")
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ValueError("wav 文件缺少 data 分块")
+        size = int.from_bytes(chunk[4:8], "little")
+        if chunk[:4] == b"data":
+            return f.tell()
+        # 分块按 2 字节对齐
+        f.seek(size + (size & 1), os.SEEK_CUR)
+
+
+def _read_into(file_path: str, target: np.ndarray) -> int:
+    """把文件中的 PCM 数据直接读入 int16 数组，返回实际读到的采样点数"""
+    _, extension = os.path.splitext(file_path.lower())
+    view = memoryview(target).cast("B")
+    filled = 0
+    with open(file_path, "rb") as f:
+        if extension == ".wav":
+            f.seek(_wav_data_offset(f))
+        while filled < len(view):
+            n = f.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+    return filled // SAMPLE_WIDTH
+
+
+def load_audio_batch(file_paths: Sequence[str]) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    把一批音频读入同一块连续缓冲区，并一次性完成 int16 到 float32 的转换
+
+    先只读文件头得到各文件的采样点数，预分配一块 int16 缓冲区，用 readinto 把各文件的 PCM 直接读入对应位置，
+    再一次转换为 float32。整个过程只有这两份数据：int16 缓冲区与 float32 结果。
+
+    Args:
+        file_paths: 音频文件路径列表
+
+    Returns:
+        (float32 缓冲区, 每个文件对应的切片视图列表)，视图与缓冲区共享内存
+    """
+    # 裸 pcm 文件可能带有不完整的尾字节，probe_audio 已按整采样点截断
+    counts = [probe_audio(path) for path in file_paths]
+    samples = np.empty(sum(counts), dtype=np.int16)
+
+    spans = []
+    offset = 0
+    for path, count in zip(file_paths, counts):
+        read = _read_into(path, samples[offset:offset + count])
+        # 文件头声明的长度大于实际数据（文件被截断）时，只使用实际读到的部分
+        samples[offset + read:offset + count] = 0
+        spans.append((offset, read))
+        offset += count
+    buffer = pcm16_to_float32(samples)
+
+    views = [buffer[start:start + count] for start, count in spans]
+    return buffer, views
+
+
+def list_audio_files(directory_path: str) -> List[str]:
+    """
+    递归列出目录下所有支持的音频文件
+
+    Raises:
+        FileNotFoundError: 如果目录不存在
+    """
+    if not os.path.isdir(directory_path):
+        raise FileNotFoundError(f"目录未找到: {directory_path}")
+
+    files = []
+    for root, _, names in os.walk(directory_path):
+        for name in names:
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+def group_by_length(lengths: Sequence[int], max_batch_size: int,
+                    max_batch_samples: int) -> List[List[int]]:
+    """
+    按长度排序后分组，使同一批内长度接近，减少补零
+
+    每批不超过 max_batch_size 条，且 批内最大长度 × 条数（即补零后的总采样点数）
+    不超过 max_batch_samples；单条超过上限的音频单独成批。
+
+    Args:
+        lengths: 每条音频的采样点数
+        max_batch_size: 单批最大条数
+        max_batch_samples: 单批补零后的最大采样点数
+
+    Returns:
+        分组后的下标列表
+    """
+    groups: List[List[int]] = []
+    current: List[int] = []
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # 升序遍历，新加入的音频就是批内最长的
+        padded = lengths[index] * (len(current) + 1)
+        if current and (len(current) >= max_batch_size or padded > max_batch_samples):
+            groups.append(current)
+            current = []
+        current.append(index)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def energy_vad(samples: np.ndarray, sample_rate: int = SAMPLE_RATE, frame_ms: int = 30,
+               margin_db: float = 12.0, floor_db: float = -50.0, min_speech_ms: int = 250,
+               min_silence_ms: int = 400, pad_ms: int = 150,
+               max_segment_seconds: float = 30.0) -> List[Tuple[int, int]]:
+    """
+    基于短时能量的语音活动检测
+
+    按帧计算能量（dBFS），以低分位数估计底噪，高于 底噪+margin_db 且高于 floor_db 的帧视为语音；
+    整段能量起伏不足 margin_db 时（裁剪得很紧的单句、连续说话、整段静音）没有可用的底噪，
+    改为只按 floor_db 判断，不会把整段语音都丢掉。
+    短于 min_silence_ms 的停顿并入前后语音，短于 min_speech_ms 的片段丢弃，
+    每段前后各保留 pad_ms，超过 max_segment_seconds 的片段再等长切分。
+
+    Args:
+        samples: float32 音频数组
+        sample_rate: 采样率
+
+    Returns:
+        语音片段列表，每项为 (起始采样点, 结束采样点)
+    """
+    frame = sample_rate * frame_ms // 1000
+    count = len(samples) // frame
+    if count == 0:
+        return []
+
+    frames = samples[:count * frame].reshape(count, frame)
+    energy = 10 * np.log10(np.einsum('ij,ij->i', frames, frames) / frame + 1e-10)
+    low, high = np.percentile(energy, [10, 90])
+    threshold = max(low + margin_db, floor_db)
+    active = energy > threshold
+    if high - low < margin_db or not active.any():
+        # 没有明显的静音帧可作底噪参考，只按绝对阈值判断
+        active = energy > floor_db
+    speech = np.concatenate(([0], active.astype(np.int8), [0]))
+    # 相邻帧的跳变位置成对出现：(语音起始帧, 语音结束帧)
+    runs = np.flatnonzero(np.diff(speech)).reshape(-1, 2)
+
+    merged: List[List[int]] = []
+    for start, end in runs:
+        if merged and (start - merged[-1][1]) * frame_ms < min_silence_ms:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    pad = sample_rate * pad_ms // 1000
+    max_length = int(max_segment_seconds * sample_rate)
+    segments = []
+    for start, end in merged:
+        if (end - start) * frame_ms < min_speech_ms:
+            continue
+        begin = max(0, start * frame - pad)
+        finish = min(len(samples), end * frame + pad)
+        segments.extend(split_segment(begin, finish, max_length))
+    return segments
+
+
+def split_segment(start: int, end: int, max_length: int) -> List[Tuple[int, int]]:
+    """把超过 max_length 的片段等长切分"""
+    pieces = max(1, -(-(end - start) // max_length))
+    bounds = np.linspace(start, end, pieces + 1).astype(int)
+    return [(int(bounds[i]), int(bounds[i + 1])) for i in range(pieces)]
@@ -0,0 +1,374 @@
+"""
+知识库批量导入流水线
+
+文件解析与分块在进程池中并行执行，分块结果按固定条数组批，经有界队列交给写入线程
+编码并写入 Chroma / Milvus（确定性分块ID，幂等写入）；队列满时解析端自动等待，内存中最多只保留少量批次，
+语料再大也不会一次性加载。
+
+用法:
+    python app/tools/ingest.py docs/ --store chroma --db-path ./chroma_db --collection tcm
+    python app/tools/ingest.py docs/ cases.pdf --store milvus --db-path http://localhost:19530 \\
+        --collection tcm --batch-size 256 --workers 8
+
+默认按导入清单增量导入：只处理新增与修改的文件，并删除修改文件的旧分块；--full 为全量导入。
+加上 --prune 时，还会删除输入路径下已不存在的文件的分块，清单中其他路径的文件不受影响。
+"""
+import os
+import sys
+import time
+import queue
+import logging
+import argparse
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 将项目根目录添加到 Python 路径中，确保可以导入 app 模块
+project_root = Path(__file__).parent.parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from dotenv import load_dotenv, find_dotenv
+from pydantic import BaseModel, Field
+from langchain_core.documents import Document
+from app.tools.load_docs import load_document, list_document_files
+from app.tools.splitters import SplitRecursiveConfig, split_from_recursive
+from app.tools.manifest import IngestManifest, file_hash
+from app.vectorstores.config import make_document_ids
+
+load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
+
+
+class IngestConfig(BaseModel):
+    """知识库导入配置类"""
+    parse_workers: int = Field(default=int(os.getenv(
+        "INGEST_PARSE_WORKERS", 0)), ge=0, description="解析与分块的进程数，0 表示使用 CPU 核心数")
+    batch_size: int = Field(default=int(os.getenv(
+        "INGEST_BATCH_SIZE", 256)), ge=1, description="每批编码并写入向量库的分块数")
+    max_pending_batches: int = Field(default=int(os.getenv(
+        "INGEST_MAX_PENDING_BATCHES", 4)), ge=1, description="等待写入的批次上限，超过时解析端暂停")
+    manifest_dir: str = Field(default=os.getenv(
+        "INGEST_MANIFEST_DIR", ".ingest_manifest"), description="导入清单的保存目录")
+    split: SplitRecursiveConfig = Field(
+        default_factory=lambda: SplitRecursiveConfig(add_start_index=True),
+        description="分块配置，元数据中记录分块在原文中的起始位置（start_index，不参与分块ID）")
+
+
+@dataclass
+class IngestStats:
+    """导入进度统计"""
+    files_total: int = 0
+    files_unchanged: int = 0
+    files_removed: int = 0
+    chunks_deleted: int = 0
+    files_done: int = 0
+    files_failed: int = 0
+    chunks: int = 0
+    batches: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+    errors: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @property
+    def docs_per_sec(self) -> float:
+        """写入向量库的分块吞吐（块/秒）"""
+        return self.chunks / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "files_total": self.files_total,
+            "files_unchanged": self.files_unchanged,
+            "files_removed": self.files_removed,
+            "chunks_deleted": self.chunks_deleted,
+            "files_done": self.files_done,
+            "files_failed": self.files_failed,
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "elapsed_seconds": round(self.elapsed, 2),
+            "docs_per_sec": round(self.docs_per_sec, 1),
+        }
+
+
+def load_and_split(file_path: str, split_config: SplitRecursiveConfig) -> Tuple[str, List[Document]]:
+    """在解析进程中计算文件内容哈希，并加载、分块"""
+    return file_hash(file_path), split_from_recursive(load_document(file_path), split_config)
+
+
+def iter_split_documents(paths: List[str], config: IngestConfig,
+                         stats: Optional[IngestStats] = None) -> Iterator[Tuple[str, str, List[Document]]]:
+    """
+    在进程池中并行解析与分块，按完成顺序逐个文件产出结果
+
+    同时在途的文件数限制为进程数的两倍，调用方消费变慢时不会继续提交新文件。
+    解析失败的文件记入 stats 后跳过。
+
+    Args:
+        paths: 文件路径列表
+        config: 导入配置
+        stats: 进度统计，可为空
+
+    Yields:
+        (文件路径, 内容哈希, 分块列表)
+    """
+    workers = config.parse_workers or os.cpu_count() or 1
+    pending: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        remaining = iter(paths)
+
+        def submit_next() -> bool:
+            path = next(remaining, None)
+            if path is None:
+                return False
+            pending.put((path, executor.submit(load_and_split, path, config.split)))
+            return True
+
+        for _ in range(workers * 2):
+            if not submit_next():
+                break
+
+        while not pending.empty():
+            path, future = pending.get()
+            try:
+                content_hash, chunks = future.result()
+            except Exception as e:
+                logger.error(f"解析文件失败: {path} ({e})")
+                if stats is not None:
+                    stats.files_failed += 1
+                    stats.errors.append((path, str(e)))
+                chunks = None
+            submit_next()
+            if chunks is not None:
+                if stats is not None:
+                    stats.files_done += 1
+                yield path, content_hash, chunks
+
+
+def iter_batches(documents: Iterable[Document], batch_size: int) -> Iterator[List[Document]]:
+    """把分块流按固定条数组批"""
+    batch: List[Document] = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest(vector_store, paths: List[str], config: Optional[IngestConfig] = None,
+           progress: Optional[Callable[[IngestStats], None]] = None,
+           manifest: Optional[IngestManifest] = None,
+           prune_roots: Optional[List[str]] = None) -> IngestStats:
+    """
+    流式导入文件到向量库
+
+    解析与分块在进程池中进行；写入线程逐批调用 vector_store.upsert_documents 完成编码与写入，
+    两端通过有界队列衔接，写入变慢时解析端随之暂停。
+
+    传入 manifest 时按清单增量导入：只解析新增与修改的文件，
+    文件的全部分块写入后再删除它上次导入留下的旧分块并更新清单。
+    只有同时传入 prune_roots 时，才会删除这些路径下已不存在的文件的分块。
+
+    Args:
+        vector_store: VectorStoreBase 实例（VSChroma / VSMilvus）
+        paths: 文件路径列表
+        config: 导入配置，默认从环境变量读取
+        progress: 每写入一批后调用的进度回调
+        manifest: 导入清单，为空时全量导入
+        prune_roots: 需要清理已删除文件的文件或目录，应为 paths 的来源；为空时不删除任何文件的分块
+
+    Returns:
+        导入统计
+    """
+    config = config or IngestConfig()
+    stats = IngestStats(files_total=len(paths))
+
+    def finish_file(path: str, content_hash: str, ids: List) -> None:
+        """文件全部分块写入后，删除上次导入的旧分块并更新清单"""
+        if manifest is None:
+            return
+        current = set(ids)
+        stale = [chunk_id for chunk_id in manifest.chunk_ids(path) if chunk_id not in current]
+        if stale:
+            vector_store.delete_collection(stale)
+            stats.chunks_deleted += len(stale)
+        manifest.record(path, ids, content_hash)
+
+    if manifest is not None:
+        plan = manifest.plan(paths, prune_roots)
+        logger.info(f"导入计划: {plan.summary()}")
+        for path in plan.removed:
+            stale = manifest.chunk_ids(path)
+            if stale:
+                vector_store.delete_collection(stale)
+                stats.chunks_deleted += len(stale)
+            manifest.forget(path)
+        manifest.save()
+        paths = plan.to_ingest
+        stats.files_total = len(paths)
+        stats.files_unchanged = len(plan.unchanged)
+        stats.files_removed = len(plan.removed)
+
+    # 每个文件的 (分块总数, 内容哈希) 与已写入的分块 ID，用于判断文件何时写完
+    expected: Dict[str, Tuple[int, str]] = {}
+    written: Dict[str, List] = {}
+    batches: "queue.Queue[Optional[List[Tuple[str, str, Document]]]]" = queue.Queue(
+        maxsize=config.max_pending_batches)
+    failure: List[BaseException] = []
+    # 写入端出错时置位，解析端据此停止投递，不会在已满的队列上一直等待
+    failed = threading.Event()
+
+    def write_batches() -> None:
+        try:
+            drain_batches()
+        except BaseException as e:
+            # 意外退出时同样记录错误，解析端不会等待一个已经结束的线程
+            failure.append(e)
+            failed.set()
+
+    def drain_batches() -> None:
+        last_saved = time.perf_counter()
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if failed.is_set():
+                continue  # 出错后只负责清空队列，让解析端尽快结束
+            try:
+                # 确定性ID + 幂等写入：重试或重复导入时已存在的分块不再编码
+                ids = vector_store.upsert_documents([document for _, _, document in batch],
+                                                    ids=[chunk_id for _, chunk_id, _ in batch])
+                for (path, _, _), chunk_id in zip(batch, ids):
+                    written.setdefault(path, []).append(chunk_id)
+                    count, content_hash = expected[path]
+                    if len(written[path]) == count:
+                        finish_file(path, content_hash, written.pop(path))
+                # 定期保存清单，中途退出后已完成的文件无需重做
+                if manifest is not None and time.perf_counter() - last_saved > 5:
+                    manifest.save()
+                    last_saved = time.perf_counter()
+                stats.chunks += len(batch)
+                stats.batches += 1
+                if progress is not None:
+                    progress(stats)
+            except BaseException as e:
+                failure.append(e)
+                failed.set()
+
+    def iter_chunks() -> Iterator[Tuple[str, str, Document]]:
+        for path, content_hash, chunks in iter_split_documents(paths, config, stats):
+            if not chunks:
+                # 空文件没有分块进入写入线程，直接更新清单
+                finish_file(path, content_hash, [])
+                continue
+            expected[path] = (len(chunks), content_hash)
+            # 按整个文件生成分块ID：相同内容的出现序号在文件内计数，不受分批影响
+            for chunk_id, chunk in zip(make_document_ids(chunks), chunks):
+                yield path, chunk_id, chunk
+
+    def submit(item: Optional[List[Tuple[str, str, Document]]]) -> bool:
+        """投递一批分块；写入线程已出错或已退出时放弃投递并返回 False"""
+        while True:
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if failed.is_set() or not writer.is_alive():
+                    return False
+
+    writer = threading.Thread(target=write_batches, name="ingest-writer", daemon=True)
+    writer.start()
+    try:
+        for batch in iter_batches(iter_chunks(), config.batch_size):
+            if failed.is_set() or not submit(batch):
+                break
+    finally:
+        submit(None)
+        writer.join()
+        if manifest is not None:
+            manifest.save()
+
+    if failure:
+        raise RuntimeError(f"写入向量库失败: {failure[0]}") from failure[0]
+    return stats
+
+
+def collect_paths(inputs: List[str]) -> List[str]:
+    """展开输入中的目录，返回去重后的文档文件列表"""
+    paths = []
+    for item in inputs:
+        if Path(item).is_dir():
+            paths.extend(list_document_files(item))
+        else:
+            paths.append(item)
+    # 统一为绝对路径，分块的 source 元数据与分块ID不随运行目录变化
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+def create_store(store: str, db_path: str, collection_name: str):
+    """按名称创建向量库实例（按需导入对应后端）"""
+    if store == "milvus":
+        from app.vectorstores.vs_Milvus import VSMilvus, VSMilvusConfig
+        return VSMilvus(VSMilvusConfig(db_path=db_path, collection_name=collection_name))
+    from app.vectorstores.vs_chroma import VSChroma, VSChromaConfig
+    return VSChroma(VSChromaConfig(db_path=db_path, collection_name=collection_name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库批量导入")
+    parser.add_argument("inputs", nargs="+", help="文档文件或目录")
+    parser.add_argument("--store", choices=["chroma", "milvus"], default="chroma", help="向量库类型")
+    parser.add_argument("--db-path", required=True, help="Chroma 持久化目录或 Milvus URI")
+    parser.add_argument("--collection", required=True, help="集合名称")
+    parser.add_argument("--batch-size", type=int, default=None, help="每批写入的分块数")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数")
+    parser.add_argument("--chunk-size", type=int, default=None, help="分块大小")
+    parser.add_argument("--chunk-overlap", type=int, default=None, help="分块重叠大小")
+    parser.add_argument("--manifest", default=None,
+                        help="导入清单路径，默认 INGEST_MANIFEST_DIR/<store>_<collection>.json")
+    parser.add_argument("--full", action="store_true", help="忽略清单，全量导入")
+    parser.add_argument("--prune", action="store_true",
+                        help="删除输入路径下已不存在的文件的分块（只清理本次传入的文件与目录）")
+    args = parser.parse_args()
+
+    config = IngestConfig()
+    if args.batch_size:
+        config.batch_size = args.batch_size
+    if args.workers:
+        config.parse_workers = args.workers
+    if args.chunk_size:
+        config.split.chunk_size = args.chunk_size
+    if args.chunk_overlap is not None:
+        config.split.chunk_overlap = args.chunk_overlap
+
+    paths = collect_paths(args.inputs)
+    vector_store = create_store(args.store, args.db_path, args.collection)
+    manifest = None
+    if not args.full:
+        manifest = IngestManifest(args.manifest or os.path.join(
+            config.manifest_dir, f"{args.store}_{args.collection}.json"))
+
+    def report(stats: IngestStats) -> None:
+        print(f"\r文件 {stats.files_done + stats.files_failed}/{stats.files_total}，"
+              f"已写入 {stats.chunks} 块，{stats.docs_per_sec:.1f} 块/秒",
+              end="", file=sys.stderr, flush=True)
+
+    prune_roots = [os.path.abspath(item) for item in args.inputs] if args.prune else None
+    stats = ingest(vector_store, paths, config, progress=report, manifest=manifest,
+                   prune_roots=prune_roots)
+    print(file=sys.stderr)
+    for path, error in stats.errors:
+        print(f"解析失败: {path} ({error})", file=sys.stderr)
+    print(stats.to_dict())
+
+
+if __name__ == "__main__":
+    main()
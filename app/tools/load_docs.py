@@ -4,6 +4,9 @@ from langchain_community.document_loaders.csv_loader import CSVLoader
 from langchain_core.documents import Document
 from typing import List
 
+# load_document 支持的文件扩展名
+DOCUMENT_EXTENSIONS = ('.pdf', '.docx', '.csv', '.html', '.md', '.txt')
+
 
 def load_document(file_path: str) -> List[Document]:
     """
@@ -79,6 +82,31 @@ def load_documents_from_directory(directory_path: str, glob: str = "**/*.{pdf,do
     return loader.load()
 
 
+def list_document_files(directory_path: str, extensions: tuple = DOCUMENT_EXTENSIONS) -> List[str]:
+    """
+    递归列出目录下所有支持的文档文件（只列路径，不读取内容）
+
+    Args:
+        directory_path: 文档目录的路径
+        extensions: 需要包含的扩展名
+
+    Returns:
+        排序后的文件路径列表
+
+    Raises:
+        FileNotFoundError: 如果目录不存在
+    """
+    if not os.path.isdir(directory_path):
+        raise FileNotFoundError(f"目录未找到: {directory_path}")
+
+    files = []
+    for root, _, names in os.walk(directory_path):
+        for name in names:
+            if name.lower().endswith(extensions):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+
 def load_documents_from_json(file_path: str, jq_schema: str = '.', is_text_content: bool = True) -> List[Document]:
     """
     从JSON文件加载文档。
@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 计算文件哈希时每次读取的字节数
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(file_path: str) -> str:
+    """流式计算文件内容哈希（blake2b），不把整个文件读入内存"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class ManifestPlan:
+    """一次增量导入的变更计划"""
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    @property
+    def to_ingest(self) -> List[str]:
+        """需要重新解析、编码的文件"""
+        return self.added + self.changed
+
+    def summary(self) -> dict:
+        return {name: len(getattr(self, name)) for name in ("added", "changed", "unchanged", "removed")}
+
+
+class IngestManifest:
+    """
+    知识库导入清单
+
+    为每个已导入的文件记录 路径、大小、修改时间、内容哈希 与 写入向量库的分块 ID，保存为 JSON 文件。
+    重新导入时据此只处理新增与修改的文件，并删除已修改文件的旧分块和已删除文件的全部分块。
+    大小与修改时间都未变的文件直接视为未修改，不再计算哈希。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 清单文件路径，不存在时视为空清单
+        """
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("files", {})
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        return os.path.abspath(file_path)
+
+    @staticmethod
+    def _is_under(key: str, root: str) -> bool:
+        """判断清单中的文件是否为 root 本身或位于 root 目录之下"""
+        return key == root or key.startswith(root.rstrip(os.sep) + os.sep)
+
+    def plan(self, paths: List[str], prune_roots: Optional[List[str]] = None) -> ManifestPlan:
+        """
+        对比清单与当前文件，生成变更计划
+
+        Args:
+            paths: 本次导入的文件
+            prune_roots: 需要清理的文件或目录；清单中位于这些路径之下、但不在 paths 中的文件视为已删除。
+                为空时不判定任何删除，只导入一部分语料不会影响集合中其他文件的分块。
+        """
+        plan = ManifestPlan()
+        current = set()
+        for file_path in paths:
+            key = self._key(file_path)
+            current.add(key)
+            entry = self.entries.get(key)
+            if entry is None:
+                plan.added.append(file_path)
+                continue
+            stat = os.stat(file_path)
+            if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+                plan.unchanged.append(file_path)
+            elif stat.st_size == entry["size"] and file_hash(file_path) == entry["hash"]:
+                # 内容未变（如被 touch 过），只更新修改时间
+                entry["mtime_ns"] = stat.st_mtime_ns
+                plan.unchanged.append(file_path)
+            else:
+                plan.changed.append(file_path)
+        if prune_roots:
+            roots = [self._key(root) for root in prune_roots]
+            plan.removed = [key for key in self.entries if key not in current
+                            and any(self._is_under(key, root) for root in roots)]
+        return plan
+
+    def chunk_ids(self, file_path: str) -> List:
+        """获取文件上次导入时写入的分块 ID"""
+        entry = self.entries.get(self._key(file_path))
+        return list(entry["chunk_ids"]) if entry else []
+
+    def record(self, file_path: str, chunk_ids: List, content_hash: Optional[str] = None) -> None:
+        """记录文件本次导入的结果"""
+        stat = os.stat(file_path)
+        with self._lock:
+            self.entries[self._key(file_path)] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": content_hash or file_hash(file_path),
+                "chunk_ids": list(chunk_ids),
+            }
+
+    def forget(self, file_path: str) -> None:
+        """移除文件的记录"""
+        with self._lock:
+            self.entries.pop(self._key(file_path), None)
+
+    def save(self) -> None:
+        """先写临时文件再替换，避免中途退出留下损坏的清单"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with self._lock:
+            payload = {"version": 1, "files": self.entries}
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
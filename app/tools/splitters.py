@@ -11,6 +11,7 @@ class SplitConfig(BaseModel):
     length_function: Callable = len  # 长度计算函数
     is_separator_regex: bool = False  # 分隔符是否为正则表达式
     separator: str = "\n\n"  # 分隔符
+    add_start_index: bool = False  # 是否在元数据中记录分块在原文中的起始位置（start_index）
 
 
 class SplitRecursiveConfig(BaseModel):
@@ -19,6 +20,7 @@ class SplitRecursiveConfig(BaseModel):
     chunk_overlap: int = 20  # 分块重叠大小
     length_function: Callable = len  # 长度计算函数
     is_separator_regex: bool = False  # 分隔符是否为正则表达式
+    add_start_index: bool = False  # 是否在元数据中记录分块在原文中的起始位置（start_index）
 
 
 def split_from_character(
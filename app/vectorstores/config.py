@@ -1,8 +1,21 @@
+import os
+import asyncio
+import hashlib
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from dotenv import load_dotenv, find_dotenv
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from typing import Callable, Dict, Iterator, List, Optional, Any, Tuple
+import numpy as np
 from langchain_core.documents import Document
 
+load_dotenv(find_dotenv(), override=True)
+
+# 异步接口执行编码与同步后端调用的线程数
+VECTORSTORE_EXECUTOR_WORKERS = int(os.getenv("VECTORSTORE_EXECUTOR_WORKERS", 8))
+
 
 class VectorStoreConfig(BaseModel):
     """向量存储配置类"""
@@ -12,11 +25,72 @@ class VectorStoreConfig(BaseModel):
     collection_name: Optional[str] = Field(default=None, description="集合名称")
 
 
+def make_document_id(document: Document, occurrence: int = 0) -> str:
+    """
+    根据来源与内容生成确定性的分块ID
+
+    由 source、page、row 元数据、内容哈希与 occurrence（同一来源内相同内容的第几次出现）共同决定，
+    不含 start_index：文件前面的修改使后面分块的偏移变化时，内容未变的分块ID保持不变，
+    增量导入只需编码真正变化的分块；重试或重复导入不会产生重复向量。
+
+    Args:
+        document: 分块文档
+        occurrence: 同一 source/page/row 内相同内容的出现序号，从 0 开始
+
+    Returns:
+        32 位十六进制ID
+    """
+    metadata = document.metadata or {}
+    content_hash = hashlib.blake2b(document.page_content.encode("utf-8"), digest_size=16).hexdigest()
+    parts = [str(metadata.get(name, "")) for name in ("source", "page", "row")]
+    key = "\x00".join(parts + [content_hash, str(occurrence)])
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def make_document_ids(documents: List[Document]) -> List[str]:
+    """为一组分块生成ID，同一 source/page/row 内的相同内容按出现顺序编号，得到不同的ID"""
+    seen: Dict[Tuple[str, ...], int] = {}
+    ids = []
+    for document in documents:
+        metadata = document.metadata or {}
+        key = tuple(str(metadata.get(name, "")) for name in ("source", "page", "row")) + (document.page_content,)
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        ids.append(make_document_id(document, occurrence))
+    return ids
+
+
 class VectorStoreBase(ABC):
+    # 所有向量库实例共享的线程池，异步接口在其中执行编码与同步后端调用，不阻塞事件循环
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
     def __init__(self, config: VectorStoreConfig):
         self.config = config
         self.vector_store = self.create_vector_store()
 
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """获取共享线程池，首次调用时创建"""
+        with VectorStoreBase._executor_lock:
+            if VectorStoreBase._executor is None:
+                VectorStoreBase._executor = ThreadPoolExecutor(
+                    max_workers=VECTORSTORE_EXECUTOR_WORKERS, thread_name_prefix="vectorstore")
+            return VectorStoreBase._executor
+
+    @classmethod
+    def shutdown_executor(cls) -> None:
+        """关闭共享线程池（应用退出时调用）"""
+        with VectorStoreBase._executor_lock:
+            executor, VectorStoreBase._executor = VectorStoreBase._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    async def _run_in_executor(self, func: Callable, *args, **kwargs) -> Any:
+        """在共享线程池中执行同步函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.get_executor(), partial(func, *args, **kwargs))
+
     @abstractmethod
     def create_vector_store(self) -> Any:
         """
@@ -24,22 +98,70 @@ class VectorStoreBase(ABC):
         """
         raise NotImplementedError("子类必须实现 create_vector_store 方法")
 
-    def add_documents(self, documents: List[Document]) -> None:
+    def add_documents(self, documents: List[Document], ids: Optional[List[str]] = None) -> List:
         """
         添加文档到向量存储
 
         Args:
             documents: 要添加的文档列表
+            ids: 文档ID列表，为空时由向量库生成
+
+        Returns:
+            写入的文档ID列表，可用于 delete_collection 删除
         """
         if not documents:
-            return
+            return []
 
         try:
-            self.vector_store.add_documents(
-                documents, collection_name=self.config.collection_name)
+            kwargs = {"collection_name": self.config.collection_name}
+            if ids is not None:
+                kwargs["ids"] = ids
+            return list(self.vector_store.add_documents(documents, **kwargs))
         except Exception as e:
             raise
 
+    def upsert_documents(self, documents: List[Document], ids: Optional[List[str]] = None) -> List[str]:
+        """
+        幂等地批量写入文档
+
+        未指定ID时使用 make_document_ids 生成确定性ID；批内重复ID只保留第一条，
+        向量库中已存在的ID直接跳过（ID由内容决定，已存在即内容相同），重复文档不做任何编码。
+
+        Args:
+            documents: 要写入的文档列表
+            ids: 文档ID列表，为空时根据内容生成
+
+        Returns:
+            与 documents 一一对应的文档ID列表（含被跳过的重复文档）
+        """
+        if not documents:
+            return []
+        if ids is None:
+            ids = make_document_ids(documents)
+
+        unique = {}
+        for doc_id, document in zip(ids, documents):
+            unique.setdefault(doc_id, document)
+        existing = set(self.get_existing_ids(list(unique)))
+        new_ids = [doc_id for doc_id in unique if doc_id not in existing]
+        if new_ids:
+            self.add_documents([unique[doc_id] for doc_id in new_ids], ids=new_ids)
+        return list(ids)
+
+    def get_existing_ids(self, ids: List[str]) -> List[str]:
+        """
+        获取已存在于向量库中的ID
+
+        Args:
+            ids: 待检查的ID列表
+
+        Returns:
+            已存在的ID列表
+        """
+        if not ids:
+            return []
+        return [document.id for document in self.vector_store.get_by_ids(ids)]
+
     def query(self, query: str, k: int = 1) -> List[Document]:
         """
         相似性搜索查询
@@ -80,6 +202,147 @@ class VectorStoreBase(ABC):
         except Exception as e:
             raise
 
+    def query_batch(self, queries: List[str], k: int = 1, **kwargs) -> List[List[Document]]:
+        """
+        批量相似性搜索查询
+
+        Args:
+            queries: 查询文本列表
+            k: 每个查询返回的结果数量
+            **kwargs: 传给后端检索的额外参数（如 Milvus 的 search_params）
+
+        Returns:
+            与 queries 一一对应的相似文档列表
+        """
+        return [[document for document, _ in hits]
+                for hits in self.query_batch_with_score(queries, k, **kwargs)]
+
+    def query_batch_with_score(self, queries: List[str], k: int = 1, **kwargs) -> List[List[tuple]]:
+        """
+        带分数的批量相似性搜索查询
+
+        所有查询只调用一次嵌入模型，再用后端的多向量检索一次完成搜索；空查询对应空列表。
+
+        Args:
+            queries: 查询文本列表
+            k: 每个查询返回的结果数量
+            **kwargs: 传给后端检索的额外参数（如 Milvus 的 search_params）
+
+        Returns:
+            与 queries 一一对应的 (文档, 分数) 元组列表
+        """
+        results: List[List[tuple]] = [[] for _ in queries]
+        positions = [i for i, query in enumerate(queries) if query.strip()]
+        if not positions:
+            return results
+
+        try:
+            vectors = self._embed_queries([queries[i] for i in positions])
+            for i, hits in zip(positions, self._search_by_vectors(vectors, k, **kwargs)):
+                results[i] = hits
+            return results
+        except Exception as e:
+            raise
+
+    async def aadd_documents(self, documents: List[Document], ids: Optional[List[str]] = None) -> List:
+        """
+        异步添加文档到向量存储，编码与写入在共享线程池中执行
+
+        Args:
+            documents: 要添加的文档列表
+            ids: 文档ID列表，为空时由向量库生成
+
+        Returns:
+            写入的文档ID列表
+        """
+        return await self._run_in_executor(self.add_documents, documents, ids)
+
+    async def aquery(self, query: str, k: int = 1, **kwargs) -> List[Document]:
+        """
+        异步相似性搜索查询
+
+        Args:
+            query: 查询文本
+            k: 返回结果数量
+            **kwargs: 传给后端检索的额外参数（如 Milvus 的 search_params）
+
+        Returns:
+            相似文档列表
+        """
+        return [document for document, _ in await self.aquery_with_score(query, k, **kwargs)]
+
+    async def aquery_with_score(self, query: str, k: int = 1, **kwargs) -> List[tuple]:
+        """
+        异步带分数的相似性搜索查询
+
+        Args:
+            query: 查询文本
+            k: 返回结果数量
+            **kwargs: 传给后端检索的额外参数（如 Milvus 的 search_params）
+
+        Returns:
+            (文档, 分数) 元组列表
+        """
+        if not query.strip():
+            return []
+        return (await self.aquery_batch_with_score([query], k, **kwargs))[0]
+
+    async def aquery_batch(self, queries: List[str], k: int = 1, **kwargs) -> List[List[Document]]:
+        """
+        异步批量相似性搜索查询
+
+        Args:
+            queries: 查询文本列表
+            k: 每个查询返回的结果数量
+            **kwargs: 传给后端检索的额外参数（如 Milvus 的 search_params）
+
+        Returns:
+            与 queries 一一对应的相似文档列表
+        """
+        return [[document for document, _ in hits]
+                for hits in await self.aquery_batch_with_score(queries, k, **kwargs)]
+
+    async def aquery_batch_with_score(self, queries: List[str], k: int = 1, **kwargs) -> List[List[tuple]]:
+        """
+        异步带分数的批量相似性搜索查询
+
+        编码在共享线程池中执行；检索优先使用后端的异步客户端，否则同样放入线程池。
+
+        Args:
+            queries: 查询文本列表
+            k: 每个查询返回的结果数量
+            **kwargs: 传给后端检索的额外参数（如 Milvus 的 search_params）
+
+        Returns:
+            与 queries 一一对应的 (文档, 分数) 元组列表
+        """
+        results: List[List[tuple]] = [[] for _ in queries]
+        positions = [i for i, query in enumerate(queries) if query.strip()]
+        if not positions:
+            return results
+
+        vectors = await self._run_in_executor(self._embed_queries, [queries[i] for i in positions])
+        for i, hits in zip(positions, await self._asearch_by_vectors(vectors, k, **kwargs)):
+            results[i] = hits
+        return results
+
+    async def _asearch_by_vectors(self, vectors: List[List[float]], k: int, **kwargs) -> List[List[tuple]]:
+        """异步按向量批量检索，默认在线程池中执行同步检索，子类可使用异步客户端覆盖"""
+        return await self._run_in_executor(self._search_by_vectors, vectors, k, **kwargs)
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """一次编码多个查询，嵌入函数不支持批量查询时逐条编码"""
+        embeddings = self.vector_store.embeddings
+        embed_queries = getattr(embeddings, "embed_queries", None)
+        if embed_queries is not None:
+            return embed_queries(queries)
+        return [embeddings.embed_query(query) for query in queries]
+
+    def _search_by_vectors(self, vectors: List[List[float]], k: int, **kwargs) -> List[List[tuple]]:
+        """按向量批量检索，子类可使用后端的多向量检索覆盖"""
+        return [self.vector_store.similarity_search_with_score_by_vector(vector, k)
+                for vector in vectors]
+
     def get_retriever(self, search_type: str = 'similarity', k: int = 1) -> Any:
         """
         获取检索器
@@ -100,6 +363,23 @@ class VectorStoreBase(ABC):
         except Exception as e:
             raise
 
+    @abstractmethod
+    def scan(self, page_size: int = 1000,
+             include_vectors: bool = False) -> Iterator[Tuple[List[Document], Optional[np.ndarray]]]:
+        """
+        分页遍历集合中的全部文档
+
+        直接从集合按页读取，不调用嵌入模型，内存中只保留当前页。
+
+        Args:
+            page_size: 每页文档数
+            include_vectors: 是否同时返回向量
+
+        Yields:
+            (文档列表, 向量矩阵)，未请求向量时向量矩阵为 None
+        """
+        raise NotImplementedError("子类必须实现 scan 方法")
+
     def get_all_documents(self, limit: int = 1000) -> List[Document]:
         """
         获取所有文档数据
@@ -111,9 +391,11 @@ class VectorStoreBase(ABC):
             所有文档列表
         """
         try:
-            # 使用一个通用的查询来获取所有数据
-            # 这里使用一个空字符串或通用查询来获取所有数据
-            results = self.vector_store.similarity_search("", k=limit)
+            results = []
+            for documents, _ in self.scan(page_size=min(limit, 1000)):
+                results.extend(documents[:limit - len(results)])
+                if len(results) >= limit:
+                    break
             return results
         except Exception as e:
             print(f"获取所有文档时出错: {e}")
@@ -126,73 +408,51 @@ class VectorStoreBase(ABC):
         Returns:
             集合信息字典
         """
+        collection_info = {
+            "collection_name": self.config.collection_name,
+        }
         try:
-            collection = self.vector_store._collection
-
-            # 获取集合基本信息
-            collection_info = {
-                "collection_name": self.config.collection_name,
-            }
-
-            try:
-                if hasattr(collection, 'num_entities'):
-                    collection_info["total_entities"] = collection.num_entities
-                elif hasattr(collection, 'count'):
-                    collection_info["total_entities"] = collection.count()
-                else:
-                    all_docs = self.get_all_documents(limit=10000)
-                    collection_info["total_entities"] = len(all_docs)
-            except Exception as count_error:
-                print(f"获取文档数量时出错: {count_error}")
-                collection_info["total_entities"] = 0
-
-            return collection_info
-        except Exception as e:
-            print(f"获取集合信息时出错: {e}")
-            return {}
+            collection_info["total_entities"] = self.get_documents_count()
+        except Exception as count_error:
+            print(f"获取文档数量时出错: {count_error}")
+            collection_info["total_entities"] = 0
+        return collection_info
 
-    def search_by_ids(self, ids: List[str]) -> List[Document]:
+    def search_by_ids(self, ids: List[str]) -> List[Optional[Document]]:
         """
         根据ID列表获取文档
 
+        按主键一次性批量读取，不调用嵌入模型。
+
         Args:
             ids: 文档ID列表
 
         Returns:
-            对应的文档列表
+            与 ids 顺序一一对应的文档列表，不存在的ID对应 None
         """
+        if not ids:
+            return []
         try:
-            # 这里需要根据实际的Milvus API来实现
-            # 由于langchain_milvus可能不直接支持按ID查询，我们使用相似性搜索作为替代
-            results = []
-            for doc_id in ids:
-                # 使用ID作为查询文本进行搜索
-                docs = self.vector_store.similarity_search(doc_id, k=1)
-                if docs:
-                    results.extend(docs)
-            return results
+            found = {document.id: document for document in self._fetch_by_ids(list(dict.fromkeys(ids)))}
+            return [found.get(doc_id) for doc_id in ids]
         except Exception as e:
             print(f"根据ID搜索文档时出错: {e}")
-            return []
+            raise
+
+    def _fetch_by_ids(self, ids: List[str]) -> List[Document]:
+        """按主键读取文档（顺序不限，缺失的ID直接忽略），子类可使用后端原生接口覆盖"""
+        return self.vector_store.get_by_ids(ids)
 
     def get_documents_count(self) -> int:
         """
         获取文档总数
 
+        默认分页遍历集合计数（不读取向量）；子类应使用后端的计数接口覆盖，避免读取文档内容
+
         Returns:
             文档总数
         """
-        try:
-            collection = self.vector_store._collection
-            if hasattr(collection, 'num_entities'):
-                return collection.num_entities
-            else:
-                # 如果无法直接获取数量，通过搜索来估算
-                all_docs = self.get_all_documents(limit=10000)
-                return len(all_docs)
-        except Exception as e:
-            print(f"获取文档数量时出错: {e}")
-            return 0
+        return sum(len(documents) for documents, _ in self.scan())
 
     def delete_collection(self, ids: List[str] = None) -> None:
         """
@@ -1,5 +1,7 @@
 # Milvus 向量存储相关模块引入
 import sys
+import json
+import time
 from pathlib import Path
 
 # 将项目根目录添加到 Python 路径中，确保可以导入 app 模块
@@ -10,24 +12,106 @@ if str(project_root) not in sys.path:
 
 from app.vectorstores.config import VectorStoreConfig, VectorStoreBase
 from langchain_milvus import Milvus
+from langchain_core.documents import Document
 from app.core.embedding import Embedding
-from pydantic import Field
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Iterator, List, Literal, Optional, Tuple
+import numpy as np
 
 # 初始化嵌入模型
 embedding = Embedding()
 
+# 支持的索引类型与距离度量
+MilvusIndexType = Literal["FLAT", "IVF_FLAT", "IVF_SQ8", "IVF_PQ", "HNSW", "DISKANN", "AUTOINDEX"]
+MilvusMetricType = Literal["L2", "IP", "COSINE"]
+
+
+class MilvusIndexParams(BaseModel):
+    """Milvus 建索引参数，只有与索引类型对应的参数会被使用"""
+    M: int = Field(default=16, ge=2, le=2048, description="HNSW：每个节点的最大连接数")
+    efConstruction: int = Field(default=200, ge=1, description="HNSW：建图时的候选集大小")
+    nlist: int = Field(default=1024, ge=1, le=65536, description="IVF_*：聚类中心数量")
+    m: Optional[int] = Field(default=None, ge=1, description="IVF_PQ：子向量数量，需整除向量维度")
+    nbits: int = Field(default=8, ge=1, le=16, description="IVF_PQ：每个子向量的编码位数")
+
+
+class MilvusSearchParams(BaseModel):
+    """Milvus 查询参数，只有与索引类型对应的参数会被使用"""
+    ef: int = Field(default=64, ge=1, description="HNSW：查询时的候选集大小，需不小于 k")
+    nprobe: int = Field(default=16, ge=1, description="IVF_*：查询时访问的聚类数量")
+    search_list: int = Field(default=100, ge=1, description="DISKANN：查询时的候选列表大小")
+
+
+# 各索引类型使用的建索引参数与查询参数
+_INDEX_PARAM_NAMES = {
+    "IVF_FLAT": ["nlist"],
+    "IVF_SQ8": ["nlist"],
+    "IVF_PQ": ["nlist", "m", "nbits"],
+    "HNSW": ["M", "efConstruction"],
+}
+_SEARCH_PARAM_NAMES = {
+    "IVF_FLAT": ["nprobe"],
+    "IVF_SQ8": ["nprobe"],
+    "IVF_PQ": ["nprobe"],
+    "HNSW": ["ef"],
+    "DISKANN": ["search_list"],
+}
+
+
 class VSMilvusConfig(VectorStoreConfig):
-    """Milvus 向量存储配置类"""
+    """
+    Milvus 向量存储配置类
+
+    bge 等输出归一化向量的模型建议使用 COSINE（或在归一化后使用 IP）；
+    已存在集合的索引类型与度量在建集合时确定，修改配置不会影响已有集合。
+    """
     db_path: str = Field(description="数据库连接路径")
-    index_type: str = Field(default="FLAT", description="索引类型")
-    metric_type: str = Field(default="L2", description="距离度量类型")
+    index_type: MilvusIndexType = Field(default="FLAT", description="索引类型")
+    metric_type: MilvusMetricType = Field(default="L2", description="距离度量类型")
     collection_name: Optional[str] = Field(default=None, description="集合名称")
+    index_params: MilvusIndexParams = Field(default_factory=MilvusIndexParams, description="建索引参数")
+    search_params: MilvusSearchParams = Field(default_factory=MilvusSearchParams, description="默认查询参数")
+
+    def build_index_params(self) -> dict:
+        """生成 Milvus 的建索引参数"""
+        values = self.index_params.model_dump()
+        params = {name: values[name] for name in _INDEX_PARAM_NAMES.get(self.index_type, [])
+                  if values[name] is not None}
+        return {"index_type": self.index_type, "metric_type": self.metric_type, "params": params}
+
+    def build_search_params(self, search_params: Optional[MilvusSearchParams] = None) -> dict:
+        """
+        生成 Milvus 的查询参数
+
+        Args:
+            search_params: 本次查询使用的参数，为空时使用配置中的默认值
+        """
+        values = (search_params or self.search_params).model_dump()
+        params = {name: values[name] for name in _SEARCH_PARAM_NAMES.get(self.index_type, [])}
+        return {"metric_type": self.metric_type, "params": params}
 
 class VSMilvus(VectorStoreBase):
+    # 集合存在性确认结果的有效期（秒），集合可能被其他进程删除或重建，过期后重新确认
+    COLLECTION_CHECK_TTL = 30.0
+
     def __init__(self, config: VSMilvusConfig):
         # 初始化基类
         super().__init__(config)
+        # 最近一次确认集合存在的时间，None 表示需要重新确认
+        self._collection_checked_at: Optional[float] = None
+
+    def _invalidate_collection_check(self) -> None:
+        self._collection_checked_at = None
+
+    async def _acollection_exists(self) -> bool:
+        """确认集合是否存在，存在的结果在有效期内复用"""
+        now = time.monotonic()
+        if self._collection_checked_at is not None and now - self._collection_checked_at < self.COLLECTION_CHECK_TTL:
+            return True
+        store = self.vector_store
+        exists = await self._run_in_executor(store.client.has_collection, store.collection_name)
+        self._collection_checked_at = now if exists else None
+        return exists
 
     def create_vector_store(self) -> Milvus:
         """
@@ -38,11 +122,173 @@ class VSMilvus(VectorStoreBase):
             embedding_function=embedding.local_embedding(),
             # 连接参数，db_path 作为 Milvus 的 URI
             connection_args={"uri": self.config.db_path},
-            # 索引参数，包括索引类型和距离度量类型
-            index_params={
-                "index_type": self.config.index_type,
-                "metric_type": self.config.metric_type
-            },
+            # 索引参数，包括索引类型、距离度量类型和对应的建索引参数
+            index_params=self.config.build_index_params(),
+            # 默认查询参数（ef / nprobe 等）
+            search_params=self.config.build_search_params(),
             # 指定集合名称
             collection_name=self.config.collection_name
         )
+
+    def query(self, query: str, k: int = 1,
+              search_params: Optional[MilvusSearchParams] = None) -> List[Document]:
+        """
+        相似性搜索查询
+
+        Args:
+            query: 查询文本
+            k: 返回结果数量
+            search_params: 本次查询的 ef / nprobe 等参数，为空时使用配置中的默认值
+        """
+        if search_params is None:
+            return super().query(query, k)
+        if not query.strip():
+            return []
+        return self.vector_store.similarity_search(
+            query, k, param=self.config.build_search_params(search_params))
+
+    def query_with_score(self, query: str, k: int = 1,
+                         search_params: Optional[MilvusSearchParams] = None) -> List[tuple]:
+        """
+        带分数的相似性搜索查询
+
+        Args:
+            query: 查询文本
+            k: 返回结果数量
+            search_params: 本次查询的 ef / nprobe 等参数，为空时使用配置中的默认值
+        """
+        if search_params is None:
+            return super().query_with_score(query, k)
+        if not query.strip():
+            return []
+        return self.vector_store.similarity_search_with_score(
+            query, k, param=self.config.build_search_params(search_params))
+
+    def _search_by_vectors(self, vectors: List[List[float]], k: int,
+                           search_params: Optional[MilvusSearchParams] = None) -> List[List[tuple]]:
+        """一次 search 传入全部查询向量，search_params 可覆盖本次查询的 ef / nprobe"""
+        store = self.vector_store
+        if not store.client.has_collection(store.collection_name):
+            return [[] for _ in vectors]
+        results = store.client.search(**self._search_request(vectors, k, search_params))
+        return self._parse_hits(results)
+
+    async def _asearch_by_vectors(self, vectors: List[List[float]], k: int,
+                                  search_params: Optional[MilvusSearchParams] = None) -> List[List[tuple]]:
+        """使用 AsyncMilvusClient 检索，网络等待期间不占用线程"""
+        store = self.vector_store
+        aclient = getattr(store, "aclient", None)
+        if aclient is None:
+            return await super()._asearch_by_vectors(vectors, k, search_params=search_params)
+        if not await self._acollection_exists():
+            return [[] for _ in vectors]
+        try:
+            results = await aclient.search(**self._search_request(vectors, k, search_params))
+        except Exception:
+            # 集合可能已被删除，下次检索时重新确认
+            self._invalidate_collection_check()
+            raise
+        return self._parse_hits(results)
+
+    def _search_request(self, vectors: List[List[float]], k: int,
+                        search_params: Optional[MilvusSearchParams]) -> dict:
+        """生成同步与异步客户端共用的 search 参数"""
+        store = self.vector_store
+        return {
+            "collection_name": store.collection_name,
+            "data": vectors,
+            "anns_field": store._vector_field,
+            "search_params": self.config.build_search_params(search_params),
+            "limit": k,
+            "output_fields": [name for name in store.fields if name != store._vector_field] or ["*"],
+        }
+
+    def _parse_hits(self, results: List[List[dict]]) -> List[List[tuple]]:
+        """把 search 结果转换为 (文档, 距离) 列表"""
+        primary_field = self.vector_store._primary_field
+        return [
+            [(document, hit["distance"]) for document, hit in zip(
+                self._parse_rows([{**hit["entity"], primary_field: hit["id"]} for hit in hits]), hits)]
+            for hits in results
+        ]
+
+    def get_existing_ids(self, ids: List[str]) -> List[str]:
+        """按主键查询已存在的ID，集合尚未创建时返回空列表"""
+        store = self.vector_store
+        if not ids or not store.client.has_collection(store.collection_name):
+            return []
+        rows = store.client.query(
+            collection_name=store.collection_name,
+            filter=f"{store._primary_field} in {json.dumps(ids)}",
+            output_fields=[store._primary_field])
+        return [row[store._primary_field] for row in rows]
+
+    def _parse_rows(self, rows: List[dict]) -> List[Document]:
+        """把 query 返回的行转换为文档，主键作为文档ID"""
+        store = self.vector_store
+        documents = []
+        for row in rows:
+            doc_id = row[store._primary_field]
+            # 向量已单独取出，不放入文档元数据
+            document = store._parse_document(
+                {key: value for key, value in row.items() if key != store._vector_field})
+            document.id = doc_id
+            documents.append(document)
+        return documents
+
+    def _fetch_by_ids(self, ids: List[str]) -> List[Document]:
+        """按主键 query 一次取回，只返回标量字段，不取向量"""
+        store = self.vector_store
+        if not store.client.has_collection(store.collection_name):
+            return []
+        output_fields = [name for name in store.fields if name != store._vector_field] or ["*"]
+        rows = store.client.query(
+            collection_name=store.collection_name,
+            filter=f"{store._primary_field} in {json.dumps(ids)}",
+            output_fields=output_fields)
+        return self._parse_rows(rows)
+
+    def delete_collection(self, ids: List[str] = None) -> None:
+        """删除集合中的指定文档，并让检索重新确认集合是否存在"""
+        self._invalidate_collection_check()
+        super().delete_collection(ids)
+
+    def scan(self, page_size: int = 1000,
+             include_vectors: bool = False) -> Iterator[Tuple[List[Document], Optional[np.ndarray]]]:
+        """使用 query_iterator 按主键游标分页读取，深分页时不会越翻越慢"""
+        store = self.vector_store
+        if not store.client.has_collection(store.collection_name):
+            return
+        output_fields = [name for name in store.fields if name != store._vector_field] or ["*"]
+        if include_vectors and output_fields != ["*"]:
+            output_fields.append(store._vector_field)
+        iterator = store.client.query_iterator(
+            collection_name=store.collection_name, batch_size=page_size,
+            filter="", output_fields=output_fields)
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    return
+                vectors = (np.asarray([row[store._vector_field] for row in rows], dtype=np.float32)
+                           if include_vectors else None)
+                yield self._parse_rows(rows), vectors
+        finally:
+            iterator.close()
+
+    def get_documents_count(self, exact: bool = True) -> int:
+        """
+        获取文档总数
+
+        Args:
+            exact: 为 True 时使用 count(*) 精确计数（已删除的实体不计入）；
+                   为 False 时读取集合统计信息中的行数，速度更快但可能包含尚未压缩的已删除实体
+        """
+        store = self.vector_store
+        if not store.client.has_collection(store.collection_name):
+            return 0
+        if exact:
+            rows = store.client.query(
+                collection_name=store.collection_name, filter="", output_fields=["count(*)"])
+            return int(rows[0]["count(*)"])
+        return int(store.client.get_collection_stats(store.collection_name)["row_count"])
@@ -3,10 +3,12 @@ from pathlib import Path
 project_root = Path(__file__).parent.parent.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
-from typing import Optional
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
 from pydantic import Field
 from app.core.embedding import Embedding
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from app.vectorstores.config import VectorStoreConfig, VectorStoreBase
 
 
@@ -36,3 +38,50 @@ class VSChroma(VectorStoreBase):
             embedding_function=embedding.local_embedding(),  # 指定embedding函数
             collection_name=self.config.collection_name      # 指定集合名称
         )
+
+    def get_existing_ids(self, ids: List[str]) -> List[str]:
+        # 只查询ID，不取回文档与向量
+        if not ids:
+            return []
+        return self.vector_store._collection.get(ids=ids, include=[])["ids"]
+
+    def _search_by_vectors(self, vectors: List[List[float]], k: int, **kwargs) -> List[List[tuple]]:
+        # 一次 query 传入全部查询向量，分数与 similarity_search_with_score 一致（距离）
+        result = self.vector_store._collection.query(
+            query_embeddings=vectors, n_results=k, include=["documents", "metadatas", "distances"])
+        return [
+            [(Document(id=doc_id, page_content=text, metadata=metadata or {}), distance)
+             for doc_id, text, metadata, distance in zip(ids, texts, metadatas, distances)]
+            for ids, texts, metadatas, distances in zip(
+                result["ids"], result["documents"], result["metadatas"], result["distances"])
+        ]
+
+    def _fetch_by_ids(self, ids: List[str]) -> List[Document]:
+        # 一次 get 取回文档与元数据，不取向量
+        result = self.vector_store._collection.get(ids=ids, include=["documents", "metadatas"])
+        return [
+            Document(id=doc_id, page_content=text, metadata=metadata or {})
+            for doc_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+
+    def scan(self, page_size: int = 1000,
+             include_vectors: bool = False) -> Iterator[Tuple[List[Document], Optional[np.ndarray]]]:
+        # 按 offset 分页读取集合
+        include = ["documents", "metadatas"] + (["embeddings"] if include_vectors else [])
+        offset = 0
+        while True:
+            result = self.vector_store._collection.get(limit=page_size, offset=offset, include=include)
+            if not result["ids"]:
+                return
+            documents = [
+                Document(id=doc_id, page_content=text, metadata=metadata or {})
+                for doc_id, text, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+            ]
+            vectors = np.asarray(result["embeddings"], dtype=np.float32) if include_vectors else None
+            yield documents, vectors
+            if len(result["ids"]) < page_size:
+                return
+            offset += page_size
+
+    def get_documents_count(self) -> int:
+        return self.vector_store._collection.count()
@@ -0,0 +1,138 @@
+"""
+嵌入模型推理后端基准测试
+
+以 PyTorch fp32 为基准，对比 ONNX Runtime / OpenVINO（可选 int8 量化）后端的
+精度（与基准向量的余弦相似度、近邻召回一致率）与延迟（单条 p50/p99、批量吞吐）。
+
+用法:
+    python benchmarks/bench_embedding_backends.py --backends onnx openvino --threads 4
+    python benchmarks/bench_embedding_backends.py --backends onnx --file-name onnx/model_qint8_avx512_vnni.onnx
+    python benchmarks/bench_embedding_backends.py --quantize avx512_vnni      # 先导出 int8 ONNX 模型
+    python benchmarks/bench_embedding_backends.py --input texts.txt --max-texts 2000
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from app.core.embedding import Embedding, EmbeddingBackendConfig, EMBEDDING_MODEL_PATH  # noqa: E402
+
+# 未指定 --input 时使用的示例文本
+_SAMPLE_TEXTS = [
+    "患者近一周反复咳嗽，痰黄黏稠，伴有咽喉肿痛。",
+    "舌红苔黄腻，脉滑数，考虑痰热壅肺证。",
+    "失眠多梦，心悸健忘，神疲食少，面色萎黄。",
+    "桂枝汤主治外感风寒表虚证，症见头痛发热、汗出恶风。",
+    "脾胃虚弱，食少便溏，倦怠乏力，宜用参苓白术散加减。",
+    "腰膝酸软，耳鸣耳聋，潮热盗汗，五心烦热。",
+    "月经后期，量少色淡，小腹冷痛，得热痛减。",
+    "针刺足三里、内关、中脘，以健脾和胃、降逆止呕。",
+]
+
+
+def load_texts(path: str, max_texts: int) -> list:
+    """读取测试文本：每行一条，未指定文件时重复示例文本并附加编号"""
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return texts[:max_texts]
+    return [f"{_SAMPLE_TEXTS[i % len(_SAMPLE_TEXTS)]}（病例{i}）" for i in range(max_texts)]
+
+
+def percentile_ms(samples: list, q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 2)
+
+
+def measure(embedding: Embedding, texts: list, queries: int) -> dict:
+    """测量单条延迟与批量吞吐，返回指标与全部向量"""
+    embedding.encode(texts[:8])  # 预热
+
+    latencies = []
+    for text in texts[:queries]:
+        start = time.perf_counter()
+        embedding.encode([text])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    vectors = embedding.encode(texts)
+    elapsed = time.perf_counter() - start
+    return {
+        "single_p50_ms": percentile_ms(latencies, 50),
+        "single_p99_ms": percentile_ms(latencies, 99),
+        "batch_texts_per_sec": round(len(texts) / elapsed, 1),
+    }, vectors
+
+
+def compare(reference: np.ndarray, candidate: np.ndarray, k: int) -> dict:
+    """与基准向量对比：逐条余弦相似度，以及以每条文本为查询时 top-k 近邻的重合率"""
+    cosine = np.einsum("ij,ij->i", reference, candidate)
+    k = min(k, len(reference) - 1)
+    if k <= 0:
+        return {"cosine_mean": round(float(cosine.mean()), 6), "cosine_min": round(float(cosine.min()), 6)}
+
+    def neighbors(vectors):
+        scores = vectors @ vectors.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argpartition(-scores, k, axis=1)[:, :k]
+
+    expected, actual = neighbors(reference), neighbors(candidate)
+    overlap = [len(set(e) & set(a)) / k for e, a in zip(expected, actual)]
+    return {
+        "cosine_mean": round(float(cosine.mean()), 6),
+        "cosine_min": round(float(cosine.min()), 6),
+        f"recall@{k}": round(float(np.mean(overlap)), 4),
+    }
+
+
+def quantize(model_path: str, config_name: str) -> str:
+    """导出动态 int8 量化的 ONNX 模型，返回相对模型目录的文件名"""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    model = SentenceTransformer(model_path, device="cpu", backend="onnx")
+    export_dynamic_quantized_onnx_model(model, config_name, model_path)
+    return f"onnx/model_qint8_{config_name}.onnx"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="嵌入模型推理后端精度与延迟对比")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_PATH, help="模型路径")
+    parser.add_argument("--backends", nargs="+", default=["onnx"],
+                        choices=["torch", "onnx", "openvino"], help="参与对比的后端")
+    parser.add_argument("--file-name", default=None, help="onnx/openvino 后端加载的导出文件")
+    parser.add_argument("--quantize", default=None, choices=["arm64", "avx2", "avx512", "avx512_vnni"],
+                        help="导出指定指令集的 int8 ONNX 模型并加入对比")
+    parser.add_argument("--device", default="cpu", help="推理设备")
+    parser.add_argument("--threads", type=int, default=0, help="算子内线程数，0 为默认")
+    parser.add_argument("--input", default=None, help="测试文本文件，每行一条")
+    parser.add_argument("--max-texts", type=int, default=512, help="参与测试的文本条数")
+    parser.add_argument("--queries", type=int, default=100, help="单条延迟的测量次数")
+    parser.add_argument("--k", type=int, default=10, help="近邻召回一致率的 k")
+    args = parser.parse_args()
+
+    texts = load_texts(args.input, args.max_texts)
+    candidates = [(name, args.file_name if name != "torch" else None) for name in args.backends]
+    if args.quantize:
+        candidates.append(("onnx", quantize(args.model, args.quantize)))
+
+    def build(name, file_name):
+        return Embedding(args.model, backend=EmbeddingBackendConfig(
+            backend=name, device=args.device, file_name=file_name, num_threads=args.threads))
+
+    baseline_metrics, reference = measure(build("torch", None), texts, args.queries)
+    report = [{"backend": "torch", "file_name": None, **baseline_metrics}]
+    for name, file_name in candidates:
+        metrics, vectors = measure(build(name, file_name), texts, args.queries)
+        metrics["speedup"] = round(metrics["batch_texts_per_sec"] / baseline_metrics["batch_texts_per_sec"], 2)
+        report.append({"backend": name, "file_name": file_name, **metrics, **compare(reference, vectors, args.k)})
+
+    print(json.dumps({"model": args.model, "texts": len(texts), "threads": args.threads,
+                      "results": report}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
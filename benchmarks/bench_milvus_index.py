@@ -0,0 +1,172 @@
+"""
+Milvus 索引调优基准测试
+
+从已有集合中抽样向量，为每种索引配置建立临时集合，以 FLAT（精确检索）的结果为基准，
+统计不同查询参数下的 recall@k 与单条查询 p50/p99 延迟，用于选择索引类型与 ef / nprobe。
+
+用法:
+    python benchmarks/bench_milvus_index.py --uri http://localhost:19530 --collection tcm
+    python benchmarks/bench_milvus_index.py --uri http://localhost:19530 --collection tcm \\
+        --sample 50000 --queries 500 --k 10 --metric COSINE --variants HNSW IVF_FLAT IVF_SQ8
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from app.vectorstores.vs_Milvus import (  # noqa: E402
+    VSMilvus, VSMilvusConfig, MilvusIndexParams, MilvusSearchParams)
+
+# 各索引类型的建索引参数与需要扫描的查询参数
+_VARIANTS = {
+    "HNSW": (MilvusIndexParams(M=16, efConstruction=200),
+             [MilvusSearchParams(ef=ef) for ef in (16, 32, 64, 128, 256)]),
+    "IVF_FLAT": (MilvusIndexParams(nlist=1024),
+                 [MilvusSearchParams(nprobe=n) for n in (8, 16, 32, 64, 128)]),
+    "IVF_SQ8": (MilvusIndexParams(nlist=1024),
+                [MilvusSearchParams(nprobe=n) for n in (8, 16, 32, 64, 128)]),
+    "IVF_PQ": (MilvusIndexParams(nlist=1024, nbits=8),
+               [MilvusSearchParams(nprobe=n) for n in (8, 16, 32, 64, 128)]),
+    "DISKANN": (MilvusIndexParams(),
+                [MilvusSearchParams(search_list=n) for n in (50, 100, 200)]),
+}
+
+
+def sample_vectors(uri: str, collection: str, count: int) -> np.ndarray:
+    """通过分页扫描读取源集合中的前 count 条向量"""
+    store = VSMilvus(VSMilvusConfig(db_path=uri, collection_name=collection))
+    pages = []
+    total = 0
+    for _, vectors in store.scan(page_size=min(count, 1000), include_vectors=True):
+        pages.append(vectors)
+        total += len(vectors)
+        if total >= count:
+            break
+    if not pages:
+        raise RuntimeError(f"集合 {collection} 中没有数据")
+    return np.concatenate(pages)[:count]
+
+
+def build_collection(client, name: str, base: np.ndarray, config: VSMilvusConfig) -> float:
+    """建立临时集合并写入向量，等待索引构建完成，返回建索引耗时"""
+    from pymilvus import MilvusClient, DataType
+
+    if client.has_collection(name):
+        client.drop_collection(name)
+    schema = MilvusClient.create_schema(auto_id=False)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("vector", DataType.FLOAT_VECTOR, dim=base.shape[1])
+    index = config.build_index_params()
+    index_params = client.prepare_index_params()
+    index_params.add_index(field_name="vector", index_type=index["index_type"],
+                           metric_type=index["metric_type"], params=index["params"])
+    client.create_collection(name, schema=schema, index_params=index_params)
+
+    start = time.perf_counter()
+    for offset in range(0, len(base), 5000):
+        rows = [{"id": offset + i, "vector": vector.tolist()}
+                for i, vector in enumerate(base[offset:offset + 5000])]
+        client.insert(name, rows)
+    client.flush(name)
+    # 等待所有已落盘的数据完成索引构建
+    while True:
+        info = client.describe_index(name, "vector")
+        if int(info.get("pending_index_rows", 0)) == 0:
+            break
+        time.sleep(0.5)
+    client.release_collection(name)
+    client.load_collection(name)
+    return time.perf_counter() - start
+
+
+def run_queries(client, name: str, queries: np.ndarray, k: int, search_params: dict):
+    """逐条查询，返回每条的结果ID与延迟"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = client.search(name, data=[query.tolist()], anns_field="vector",
+                             search_params=search_params, limit=k)
+        latencies.append(time.perf_counter() - start)
+        results.append([hit["id"] for hit in hits[0]])
+    return results, latencies
+
+
+def recall_at_k(expected: list, actual: list, k: int) -> float:
+    return float(np.mean([len(set(e[:k]) & set(a[:k])) / k for e, a in zip(expected, actual)]))
+
+
+def percentile_ms(samples: list, q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Milvus 索引 recall 与延迟调优")
+    parser.add_argument("--uri", required=True, help="Milvus URI")
+    parser.add_argument("--collection", required=True, help="抽样的源集合")
+    parser.add_argument("--sample", type=int, default=20000, help="抽样向量数")
+    parser.add_argument("--queries", type=int, default=200, help="查询向量数（从样本末尾取出，不参与建库）")
+    parser.add_argument("--k", type=int, default=10, help="recall@k 的 k")
+    parser.add_argument("--metric", default="COSINE", choices=["L2", "IP", "COSINE"], help="距离度量")
+    parser.add_argument("--variants", nargs="+", default=["HNSW", "IVF_FLAT", "IVF_SQ8"],
+                        choices=list(_VARIANTS), help="参与对比的索引类型")
+    parser.add_argument("--keep", action="store_true", help="保留临时集合")
+    args = parser.parse_args()
+
+    from pymilvus import MilvusClient
+
+    vectors = sample_vectors(args.uri, args.collection, args.sample + args.queries)
+    if len(vectors) <= args.queries:
+        raise RuntimeError(f"样本数 {len(vectors)} 不足，至少需要 {args.queries + 1} 条")
+    base, queries = vectors[:-args.queries], vectors[-args.queries:]
+    client = MilvusClient(uri=args.uri)
+    created = []
+
+    try:
+        # FLAT 为精确检索，其结果作为 recall 的基准
+        flat = VSMilvusConfig(db_path=args.uri, index_type="FLAT", metric_type=args.metric)
+        name = f"bench_{args.collection}_flat"
+        created.append(name)
+        build_seconds = build_collection(client, name, base, flat)
+        expected, latencies = run_queries(client, name, queries, args.k, flat.build_search_params())
+        report = [{"index_type": "FLAT", "build_seconds": round(build_seconds, 2), "search_params": {},
+                   f"recall@{args.k}": 1.0, "p50_ms": percentile_ms(latencies, 50),
+                   "p99_ms": percentile_ms(latencies, 99)}]
+
+        for index_type in args.variants:
+            index_params, sweeps = _VARIANTS[index_type]
+            if index_type == "IVF_PQ" and index_params.m is None:
+                # 每个子向量 8 维
+                index_params = index_params.model_copy(update={"m": base.shape[1] // 8})
+            config = VSMilvusConfig(db_path=args.uri, index_type=index_type, metric_type=args.metric,
+                                    index_params=index_params)
+            name = f"bench_{args.collection}_{index_type.lower()}"
+            created.append(name)
+            build_seconds = build_collection(client, name, base, config)
+            for search_params in sweeps:
+                params = config.build_search_params(search_params)
+                actual, latencies = run_queries(client, name, queries, args.k, params)
+                report.append({
+                    "index_type": index_type,
+                    "index_params": config.build_index_params()["params"],
+                    "build_seconds": round(build_seconds, 2),
+                    "search_params": params["params"],
+                    f"recall@{args.k}": round(recall_at_k(expected, actual, args.k), 4),
+                    "p50_ms": percentile_ms(latencies, 50),
+                    "p99_ms": percentile_ms(latencies, 99),
+                })
+    finally:
+        if not args.keep:
+            for name in created:
+                client.drop_collection(name)
+
+    print(json.dumps({"collection": args.collection, "base": len(base), "queries": len(queries),
+                      "metric": args.metric, "results": report}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
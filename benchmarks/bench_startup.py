@@ -0,0 +1,96 @@
+"""
+启动耗时基准测试
+
+在独立子进程中多次导入 main.py 并执行应用的 lifespan 启动流程，统计耗时分布，
+用于发现导入期加载模型或引入重量级依赖导致的启动退化。
+
+用法:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --runs 5 --max-seconds 3   # 超过阈值时返回非零退出码
+    python benchmarks/bench_startup.py --importtime                # 输出导入最慢的模块
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+# 在子进程中执行：分别计时导入与 lifespan 启动
+_PROBE = r"""
+import json, time, asyncio
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def _startup():
+    async with main.app.router.lifespan_context(main.app):
+        pass
+
+asyncio.run(_startup())
+started = time.perf_counter()
+print(json.dumps({"import": imported - start, "startup": started - imported}))
+"""
+
+
+def run_once(env: dict) -> dict:
+    """在新进程中测量一次导入与启动耗时"""
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=PROJECT_ROOT, env=env,
+        capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: dict, top: int = 15) -> list:
+    """使用 -X importtime 获取累计导入耗时最高的模块"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=PROJECT_ROOT,
+        env=env, capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative), name))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="main.py 启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数")
+    parser.add_argument("--warmup", action="store_true", help="同时开启 WARMUP_ON_STARTUP")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="导入+启动耗时中位数的上限，超过时以非零状态退出")
+    parser.add_argument("--importtime", action="store_true", help="输出导入最慢的模块")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["WARMUP_ON_STARTUP"] = "True" if args.warmup else "False"
+
+    if args.importtime:
+        for cumulative, name in slowest_imports(env):
+            print(f"{cumulative / 1e6:8.3f}s  {name}")
+        return
+
+    results = [run_once(env) for _ in range(args.runs)]
+    totals = [r["import"] + r["startup"] for r in results]
+    report = {
+        "runs": args.runs,
+        "import_median": round(statistics.median(r["import"] for r in results), 3),
+        "startup_median": round(statistics.median(r["startup"] for r in results), 3),
+        "total_median": round(statistics.median(totals), 3),
+        "total_max": round(max(totals), 3),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.max_seconds is not None and report["total_median"] > args.max_seconds:
+        print(f"启动耗时 {report['total_median']}s 超过阈值 {args.max_seconds}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
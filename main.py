@@ -1,14 +1,61 @@
 
+import os
+import time
+import asyncio
+import logging
 import uvicorn
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv, find_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.main import router
+from app.api.embedding import embedding, embedding_batcher
+from app.api.health import app_state
+from app.core.embedding import Embedding
+from app.vectorstores.config import VectorStoreBase
+from app.core.llm import close_http_clients
+from app.api import tts
+
+load_dotenv(find_dotenv(), override=True)
+logger = logging.getLogger(__name__)
+
+# 启动时是否预加载模型并执行一次推理
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "False").lower() == "true"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期管理：启动语音识别推理池、按需预热模型，关闭时清理资源"""
+    async with tts.lifespan(app):
+        if WARMUP_ON_STARTUP:
+            start = time.perf_counter()
+            # 预热在线程中执行，避免阻塞事件循环
+            await asyncio.to_thread(embedding.warmup)
+            app_state["warmup"]["embedding"] = round(time.perf_counter() - start, 3)
+            logger.info(f"嵌入模型预热完成，耗时 {app_state['warmup']['embedding']} 秒")
+
+            if tts.asr_pool is not None:
+                start = time.perf_counter()
+                await tts.asr_pool.warmup()
+                app_state["warmup"]["asr"] = round(time.perf_counter() - start, 3)
+                logger.info(f"语音识别模型预热完成，耗时 {app_state['warmup']['asr']} 秒")
+
+        app_state["started"] = True
+        yield  # 应用运行期间
+
+        app_state["started"] = False
+        await embedding_batcher.close()
+        await asyncio.to_thread(Embedding.shutdown_pools)
+        VectorStoreBase.shutdown_executor()
+        await close_http_clients()
+
 
 app = FastAPI(
-    debug='',
-    title='',
-    description='',
-    version='',
+    debug=os.getenv("PROJECT_DEBUG", "False").lower() == "true",
+    title=os.getenv("PROJECT_NAME", "tcm"),
+    description=os.getenv("PROJECT_DESCRIPTION", ""),
+    version=os.getenv("PROJECT_VERSION", "0.1.0"),
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -17,6 +64,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 二进制向量响应的形状与类型放在响应头中，需要对浏览器暴露
+    expose_headers=["X-Embedding-Shape", "X-Embedding-Dtype", "X-Embedding-Model",
+                    "X-Usage-Prompt-Tokens", "X-Usage-Total-Tokens"],
 )
 
 app.include_router(router)
@@ -27,4 +77,5 @@ def main():
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    # reload 模式需要以导入字符串的形式传入应用
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)